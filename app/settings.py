@@ -11,7 +11,6 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
-from dotenv import load_dotenv
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -28,8 +27,13 @@ DEBUG = True
 ALLOWED_HOSTS = []
 
 
-# Load environment variables from .env file
-load_dotenv()
+# Load environment variables from the project's .env file, if there is one.
+# python-dotenv is only imported then, and the file is not searched for.
+if (BASE_DIR / '.env').is_file():
+    from dotenv import load_dotenv
+
+    load_dotenv(BASE_DIR / '.env')
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -46,6 +50,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.profiling.ProfilingMiddleware',
+    'core.slow_queries.SlowQueryMiddleware',
+    'core.compression.CompressionMiddleware',
+    'core.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -92,6 +101,72 @@ DATABASES = {
     }
 }
 
+# Connection reuse
+# With DB_POOL_MAX_SIZE set, each process keeps a psycopg 3 connection pool
+# (requires psycopg[pool]); connections are health-checked on checkout and
+# recycled after DB_POOL_MAX_LIFETIME seconds. The pool works under WSGI and
+# ASGI alike. Without it, connections persist for DB_CONN_MAX_AGE seconds,
+# which only helps under WSGI.
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 0))
+
+if DB_POOL_MAX_SIZE:
+    from psycopg_pool import ConnectionPool
+
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': DB_POOL_MAX_SIZE,
+            'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', 30 * 60)),
+            'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 10 * 60)),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            'check': ConnectionPool.check_connection,
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 60))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# How often (in seconds) each worker exports its pool statistics.
+DB_POOL_METRICS_INTERVAL = 5
+
+# Read replicas
+# DB_REPLICA_HOSTS is a comma separated list of hosts replicating the default
+# database. Reads are routed to them unless they lag more than REPLICA_MAX_LAG
+# seconds or the client wrote within the last READ_YOUR_WRITES_WINDOW seconds.
+# Pointing DB_REPLICA_HOSTS at DB_HOST gives a two-alias setup for local testing.
+DATABASE_REPLICAS = []
+for index, replica_host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dict(
+        DATABASES['default'],
+        HOST=replica_host.strip(),
+        OPTIONS=dict(DATABASES['default'].get('OPTIONS', {})),
+        TEST={'MIRROR': 'default'},
+    )
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+READ_YOUR_WRITES_WINDOW = int(os.getenv('READ_YOUR_WRITES_WINDOW', 10))
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+REPLICA_LAG_CHECK_INTERVAL = 1
+
+# Cache
+# Shared by all workers when REDIS_URL is set, otherwise local to each process.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -136,6 +211,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'user.authentication.SignedTokenAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -145,6 +221,11 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ],
+    # Reverse proxies in front of the app. Throttling identifies clients by
+    # the address the outermost of them added to X-Forwarded-For, or by
+    # REMOTE_ADDR without any; left unset, rest_framework would trust the
+    # whole header, which clients can forge.
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 0)),
 }
 
 AUTHENTICATION_BACKENDS = [
@@ -153,3 +234,201 @@ AUTHENTICATION_BACKENDS = [
 AUTH_USER_MODEL = 'user.User'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_URL = '/media/'
+
+# Media files are stored under relative, hash-sharded keys through the
+# default storage (see core/storage.py). MEDIA_STORAGE_BACKEND may be e.g.
+# 'core.storage.LocalObjectStorage', a local stand-in for S3-compatible
+# object storage, or django-storages' 'storages.backends.s3.S3Storage'.
+STORAGES = {
+    'default': {
+        'BACKEND': os.getenv('MEDIA_STORAGE_BACKEND', 'django.core.files.storage.FileSystemStorage'),
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+OBJECT_STORAGE_ROOT = os.getenv('OBJECT_STORAGE_ROOT', os.path.join(BASE_DIR, 'object_storage'))
+
+# Prometheus metrics
+# /metrics/ answers scrapers that send "Authorization: Bearer <METRICS_TOKEN>"
+# or connect from METRICS_ALLOWED_IPS, a comma separated list of addresses or
+# networks matched against REMOTE_ADDR. With neither set, it answers no one
+# (see core/views.py).
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = list(filter(None, os.getenv('METRICS_ALLOWED_IPS', '').split(',')))
+
+# Request profiling
+# A fraction of requests (or any request with a signed X-Profile header, see
+# `manage.py profile_token`) is profiled and written under PROFILER_DIR.
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'False') == 'True'
+PROFILER_SAMPLE_RATE = float(os.getenv('PROFILER_SAMPLE_RATE', 0))
+PROFILER_FORMAT = os.getenv('PROFILER_FORMAT', 'collapsed')  # 'collapsed' or 'pstats'
+PROFILER_INTERVAL = 0.005
+PROFILER_DIR = os.getenv('PROFILER_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILER_MAX_FILES = 200
+PROFILER_TOKEN_MAX_AGE = 60 * 60
+
+# Slow query log
+# Queries slower than SLOW_QUERY_THRESHOLD seconds are explained in the
+# background and kept in a ring of SLOW_QUERY_RING_SIZE files, browsable at
+# /admin/slow-queries/.
+SLOW_QUERY_THRESHOLD = float(os.getenv('SLOW_QUERY_THRESHOLD', 0.5))
+SLOW_QUERY_DIR = os.getenv('SLOW_QUERY_DIR', os.path.join(BASE_DIR, 'slow_queries'))
+SLOW_QUERY_RING_SIZE = 500
+
+# Serve the feed, profile, post detail and like lists with the native async
+# views in user/async_views.py. Meant for ASGI deployments (app/asgi.py).
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False') == 'True'
+
+# Live feed events
+# New posts are pushed to followers connected to /api/feed/events/. The
+# stream needs an ASGI server (app/asgi.py): a WSGI worker would buffer it
+# forever, so the route is only registered with FEED_EVENTS_STREAM=True. The
+# in-memory broker only reaches clients connected to the same process and
+# keeps the history of FEED_EVENTS_MAX_USERS users; point FEED_EVENTS_BROKER
+# at a shared broker to fan out across workers (see user/events.py).
+FEED_EVENTS_STREAM = os.getenv('FEED_EVENTS_STREAM', 'False') == 'True'
+FEED_EVENTS_BROKER = os.getenv('FEED_EVENTS_BROKER', 'user.events.InMemoryBroker')
+FEED_EVENTS_HISTORY = 100
+FEED_EVENTS_MAX_USERS = 10000
+FEED_EVENTS_QUEUE_SIZE = 200
+FEED_EVENTS_BATCH_WINDOW = 0.5
+FEED_EVENTS_BATCH_SIZE = 50
+FEED_EVENTS_HEARTBEAT = 15
+
+# Top feed
+# /api/feed/?mode=top ranks up to FEED_TOP_CANDIDATES posts of the last
+# FEED_TOP_WINDOW seconds by likes, the reader's affinity for the author and
+# age, each decaying with its half-life in seconds (see user/ranking.py).
+FEED_TOP_WINDOW = 7 * 24 * 60 * 60
+FEED_TOP_CANDIDATES = 500
+FEED_TOP_SIZE = 50
+FEED_TOP_LIKE_HALF_LIFE = 6 * 60 * 60
+FEED_TOP_AGE_HALF_LIFE = 24 * 60 * 60
+FEED_TOP_AFFINITY_HALF_LIFE = 30 * 24 * 60 * 60
+FEED_TOP_AFFINITY_WEIGHT = 0.5
+
+# Feed delta polling
+# /api/feed/?since_id=N or ?max_id=N returns at most FEED_PAGE_SIZE posts
+# newer or older than N; /api/feed/new/?since_id=N counts the newer ones, up
+# to FEED_NEW_POSTS_MAX_COUNT (see user/feed.py). A new post is recorded in
+# its author's follows in the background, FEED_HEAD_BATCH_SIZE follows per
+# transaction.
+FEED_PAGE_SIZE = 50
+FEED_NEW_POSTS_MAX_COUNT = 100
+FEED_HEAD_BATCH_SIZE = 1000
+
+# Liked post index
+# Post payloads carry liked_by_me, looked up in a per-user sorted array of
+# liked post ids kept in the cache (see user/likes.py).
+LIKED_POSTS_INDEX_MAX_SIZE = 100_000
+LIKED_POSTS_INDEX_TIMEOUT = 60 * 60
+
+# Recommendations
+# /api/posts/recommended/ serves RECOMMENDATION_SIZE posts per user,
+# precomputed from the likes of posts of the last RECOMMENDATION_WINDOW
+# seconds by `manage.py refresh_recommendations` (see user/recommendations.py).
+RECOMMENDATION_WINDOW = 30 * 24 * 60 * 60
+RECOMMENDATION_HISTORY_SIZE = 50
+RECOMMENDATION_MAX_LIKERS = 100
+RECOMMENDATION_NEIGHBOURS = 20
+RECOMMENDATION_SEEDS = 20
+RECOMMENDATION_SIZE = 100
+
+# Approximate counts
+# Paginated lists count at most APPROXIMATE_COUNT_CAP rows; unfiltered
+# PostgreSQL tables over APPROXIMATE_COUNT_THRESHOLD rows use the planner's
+# statistics instead (see core/pagination.py).
+APPROXIMATE_COUNT_CAP = 10_000
+APPROXIMATE_COUNT_THRESHOLD = 100_000
+
+# Response compression
+# Text (but not HTML) and JSON responses of at least COMPRESSION_MIN_SIZE
+# bytes are sent with Brotli (if the brotli package is installed) or gzip,
+# as the client accepts; compressed bodies are cached by ETag in a
+# per-process LRU of COMPRESSION_CACHE_SIZE bytes (see core/compression.py).
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_CACHE_SIZE = 32 * 1024 * 1024
+
+# Post partitions
+# On PostgreSQL user_post is partitioned by date_created month;
+# `manage.py create_post_partitions`, run at least monthly, keeps
+# POST_PARTITIONS_AHEAD months of partitions ahead (see user/partitions.py).
+POST_PARTITIONS_AHEAD = 3
+
+# Rate limiting
+# Likes, follows, tag creation and text searches take THROTTLE_COSTS tokens
+# from both a per-user and a per-IP bucket (see user/throttling.py). Buckets
+# hold `capacity` tokens and regain `refill_rate` tokens per second.
+THROTTLE_USER_BUCKET = {'capacity': 60, 'refill_rate': 1}
+THROTTLE_IP_BUCKET = {'capacity': 300, 'refill_rate': 5}
+THROTTLE_COSTS = {'like': 1, 'follow': 1, 'tag': 2, 'search': 5, 'import': 30}
+THROTTLE_BUCKET_STORE = (
+    'user.throttling.RedisBucketStore' if os.getenv('REDIS_URL')
+    else 'user.throttling.LocalBucketStore'
+)
+
+# Signed access tokens
+# Short-lived access tokens from /api/token/ are verified without a database
+# lookup; revocations reach every worker within REVOCATION_SYNC_INTERVAL
+# seconds through a Bloom filter rebuilt from the database.
+ACCESS_TOKEN_LIFETIME = 15 * 60
+REFRESH_TOKEN_LIFETIME = 30 * 24 * 60 * 60
+REVOCATION_SYNC_INTERVAL = 30
+REVOCATION_FILTER_BITS = 2 ** 20
+REVOCATION_FILTER_HASHES = 7
+
+# Background jobs
+# Jobs such as data exports run on a small in-process thread pool after the
+# request's transaction commits (see core/tasks.py); their state is kept in
+# the database so they can be resumed by their management command.
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', 2))
+BACKGROUND_TASKS_EAGER = os.getenv('BACKGROUND_TASKS_EAGER', 'False') == 'True'
+
+# Personal data exports
+# Archives are kept outside MEDIA_ROOT, downloaded through
+# /api/export/<id>/download/ and deleted DATA_EXPORT_RETENTION seconds after
+# they are built (`manage.py run_data_exports`).
+DATA_EXPORT_DIR = os.getenv('DATA_EXPORT_DIR', os.path.join(BASE_DIR, 'exports'))
+DATA_EXPORT_CHUNK_SIZE = 2000
+DATA_EXPORT_RETENTION = 7 * 24 * 60 * 60
+# A running export whose worker stopped renewing its lease for this many
+# seconds is built again by the next `manage.py run_data_exports`.
+DATA_EXPORT_LEASE = 10 * 60
+
+# Bulk post import
+# /api/posts/import/ and `manage.py import_posts` read NDJSON and insert
+# posts in batches of POST_IMPORT_BATCH_SIZE (see user/imports.py).
+POST_IMPORT_BATCH_SIZE = 5000
+POST_IMPORT_MAX_IMAGE_SIZE = 10 * 1024 * 1024
+
+# Account deletion
+# Deleted accounts are deactivated at once and removed in the background,
+# ACCOUNT_DELETION_BATCH_SIZE rows per transaction (see user/deletion.py).
+ACCOUNT_DELETION_BATCH_SIZE = 500
+
+# Orphan tag collection
+# `manage.py collect_orphan_tags`, run periodically, deletes tags no post uses
+# once they are older than TAG_GC_GRACE_PERIOD seconds (see user/tag_gc.py).
+TAG_GC_BATCH_SIZE = 1000
+TAG_GC_GRACE_PERIOD = 24 * 60 * 60
+
+# Media delivery
+# /media/ is served by user.views.MediaView, which checks access and then
+# hands the transfer to the front proxy (see user/media.py):
+# 'x-accel-redirect' for nginx, 'x-sendfile' for Apache or lighttpd, or
+# 'django' to stream files from the app.
+MEDIA_SERVE_METHOD = os.getenv('MEDIA_SERVE_METHOD', 'django')
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+# Post image deduplication
+# Uploads identical to, or at most IMAGE_DEDUP_MAX_DISTANCE dHash bits from,
+# a stored post image share its file (see user/images.py); None shares exact
+# copies only. Near duplicates must also be within
+# IMAGE_DEDUP_MAX_PIXEL_DIFFERENCE (0-255) per pixel of a 16 x 16 thumbnail.
+IMAGE_DEDUP_MAX_DISTANCE = 4
+IMAGE_DEDUP_MAX_PIXEL_DIFFERENCE = 6
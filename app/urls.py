@@ -17,8 +17,14 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from core.views import metrics_view, slow_query_list_view
+from user.views import MediaView
+
 urlpatterns = [
+    path('admin/slow-queries/', admin.site.admin_view(slow_query_list_view), name='admin-slow-queries'),
     path('admin/', admin.site.urls),
     path('api/',include('user.urls')),
+    path('metrics/', metrics_view, name='metrics'),
+    path('media/<path:name>', MediaView.as_view(), name='media'),
 
 ]
@@ -0,0 +1,67 @@
+"""Throughput of the sync DRF feed view against its async counterpart at high concurrency.
+
+The sync view is driven from a thread pool, as under a threaded WSGI server;
+the async view is driven from one event loop, as under an ASGI server. Both
+run in-process against the configured database, without the network.
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import create_feed_fixture, setup_django
+
+setup_django()
+
+from django.db import connections  # noqa: E402
+from django.test import AsyncRequestFactory, RequestFactory  # noqa: E402
+
+from user.async_views import FollowingFeedAsyncView  # noqa: E402
+from user.views import FollowingFeedView  # noqa: E402
+
+
+
+def run_sync(token, concurrency, total_requests):
+    view = FollowingFeedView.as_view()
+    factory = RequestFactory()
+
+    def call(_):
+        response = view(factory.get('/api/feed/', HTTP_AUTHORIZATION=f'Token {token}'))
+        response.render()
+        connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        list(executor.map(call, range(total_requests)))
+        return total_requests / (time.perf_counter() - start)
+
+
+async def run_async(token, concurrency, total_requests):
+    view = FollowingFeedAsyncView.as_view()
+    factory = AsyncRequestFactory()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call():
+        async with semaphore:
+            await view(factory.get('/api/feed/', headers={'Authorization': f'Token {token}'}))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(total_requests)))
+    return total_requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 100])
+    args = parser.parse_args()
+
+    token = create_feed_fixture()
+    for concurrency in args.concurrency:
+        sync_rps = run_sync(token, concurrency, args.requests)
+        async_rps = asyncio.run(run_async(token, concurrency, args.requests))
+        print(f"concurrency {concurrency:>4}: sync {sync_rps:8.1f} req/s   async {async_rps:8.1f} req/s")
+
+
+if __name__ == '__main__':
+    main()
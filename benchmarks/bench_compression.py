@@ -0,0 +1,92 @@
+"""CPU cost of response compression against the bytes it saves, per endpoint.
+
+The bodies of the feed, the top feed, a profile and a page of posts are
+fetched uncompressed through the full middleware stack. For each body and
+encoding the compression ratio, the time to compress it and the time per
+kilobyte saved are printed, along with the middleware's cost when the
+compressed body is served from its ETag-keyed cache. Exits with status 1 if
+gzip saves less than --target-saving of the feed, or if a cached response
+costs more than --target-cached-us.
+"""
+import argparse
+import sys
+
+from benchmarks.common import create_feed_fixture, report, setup_django
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+from django.http import HttpResponse  # noqa: E402
+from django.test import Client, RequestFactory, override_settings  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+
+from core import compression  # noqa: E402
+from core.compression import CompressionMiddleware, compress, get_compressed_cache  # noqa: E402
+
+
+def endpoint_bodies(token):
+    client = Client(HTTP_AUTHORIZATION=f'Token {token}', HTTP_HOST='localhost')
+    user_id = Token.objects.get(key=token).user_id
+    endpoints = {
+        'feed': '/api/feed/',
+        'top feed': '/api/feed/?mode=top',
+        'profile': f'/api/profile/{user_id}/',
+        'posts page': '/api/posts/?page_size=50',
+    }
+    bodies = {}
+    for name, url in endpoints.items():
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+        assert not response.has_header('Content-Encoding')
+        bodies[name] = response.content
+    return bodies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--posts-per-author', type=int, default=20)
+    parser.add_argument('--authors', type=int, default=5)
+    parser.add_argument('--target-saving', type=float, default=0.7)
+    parser.add_argument('--target-cached-us', type=float, default=50.0)
+    args = parser.parse_args()
+
+    token = create_feed_fixture(args.posts_per_author, args.authors)
+    encodings = [('gzip', level) for level in (1, settings.COMPRESSION_GZIP_LEVEL, 9)]
+    if compression.brotli is not None:
+        encodings += [('br', quality) for quality in (1, settings.COMPRESSION_BROTLI_QUALITY, 11)]
+    else:
+        print("brotli is not installed; only gzip is measured")
+
+    feed_saving = 0
+    for name, body in endpoint_bodies(token).items():
+        print(f"{name} ({len(body)} bytes)")
+        for encoding, level in encodings:
+            setting = 'COMPRESSION_GZIP_LEVEL' if encoding == 'gzip' else 'COMPRESSION_BROTLI_QUALITY'
+            with override_settings(**{setting: level}):
+                saved = len(body) - len(compress(body, encoding))
+                seconds = report(f"  {encoding} {level}, {saved / len(body):.1%} saved",
+                                 lambda: compress(body, encoding), number=50)
+            print(f"{'':<50} {seconds * 1e6 / max(saved / 1024, 1e-9):10.2f} us/KB saved")
+            if name == 'feed' and encoding == 'gzip' and level == settings.COMPRESSION_GZIP_LEVEL:
+                feed_saving = saved / len(body)
+
+    feed_body = endpoint_bodies(token)['feed']
+    middleware = CompressionMiddleware(lambda request: HttpResponse(feed_body, content_type='application/json'))
+    request = RequestFactory().get('/api/feed/', HTTP_ACCEPT_ENCODING='gzip')
+    get_compressed_cache().clear()
+    middleware(request)
+    cached_us = report('middleware, feed body from the cache', lambda: middleware(request), number=2000) * 1e6
+
+    missed = []
+    if feed_saving < args.target_saving:
+        missed.append(f"gzip saves {feed_saving:.1%} of the feed, less than the {args.target_saving:.0%} target")
+    if cached_us > args.target_cached_us:
+        missed.append(f"a cached response costs {cached_us:.1f} us, more than the {args.target_cached_us} us target")
+    for message in missed:
+        print(message)
+    if missed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
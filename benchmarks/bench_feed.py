@@ -0,0 +1,121 @@
+"""Latency of the top feed against ranking by like count per request.
+
+A reader follows --authors accounts whose posts of the last week have
+--likes likes in total. Exits with status 1 if rank() or the top feed
+request miss their latency targets, so the check can run in CI.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+from benchmarks.common import report, setup_django
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+
+from user.filters import likes_count  # noqa: E402
+from user.ranking import author_affinities, candidate_posts, rank, rebuild_scores  # noqa: E402
+from user.models import Post, User  # noqa: E402
+from user.serializers import PostSerializer  # noqa: E402
+from user.views import FollowingFeedView  # noqa: E402
+
+
+def create_fixture(authors, posts_per_author, likers, likes):
+    """Create (once) the reader, authors, posts and likes; return the reader."""
+    reader, created = User.objects.get_or_create(email='bench-top-reader@example.com')
+    if not created:
+        return reader
+    author_objects = User.objects.bulk_create(
+        User(email=f'bench-top-author{i}@example.com') for i in range(authors))
+    liker_objects = User.objects.bulk_create(
+        User(email=f'bench-top-liker{i}@example.com') for i in range(likers))
+    reader.following.add(*author_objects)
+    posts = Post.objects.bulk_create(
+        Post(user=author, text=f'Top feed post {i}') for author in author_objects for i in range(posts_per_author))
+    now = timezone.now()
+    for post in posts:
+        post.date_created = now - timedelta(seconds=random.uniform(0, settings.FEED_TOP_WINDOW))
+    Post.objects.bulk_update(posts, ['date_created'], batch_size=1000)
+    pairs = {(random.choice(liker_objects + [reader]).id, random.choice(posts).id) for _ in range(likes)}
+    Post.likes.through.objects.bulk_create(
+        (Post.likes.through(user_id=user_id, post_id=post_id) for user_id, post_id in pairs), batch_size=5000)
+    rebuild_scores()
+    return reader
+
+
+def latencies(func, number):
+    times = []
+    for _ in range(number):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def print_latencies(name, times):
+    times = sorted(times)
+    p50 = statistics.median(times) * 1000
+    p95 = times[int(len(times) * 0.95) - 1] * 1000
+    print(f"{name:<50} p50 {p50:8.2f} ms   p95 {p95:8.2f} ms")
+    return p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--authors', type=int, default=200)
+    parser.add_argument('--posts-per-author', type=int, default=25)
+    parser.add_argument('--likers', type=int, default=500)
+    parser.add_argument('--likes', type=int, default=50000)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--target-rank-ms', type=float, default=2.0)
+    parser.add_argument('--target-p95-ms', type=float, default=100.0)
+    args = parser.parse_args()
+
+    reader = create_fixture(args.authors, args.posts_per_author, args.likers, args.likes)
+    token, _ = Token.objects.get_or_create(user=reader)
+    factory = RequestFactory()
+    view = FollowingFeedView.as_view()
+
+    def top_request():
+        response = view(factory.get('/api/feed/', {'mode': 'top'}, HTTP_AUTHORIZATION=f'Token {token.key}'))
+        assert response.status_code == 200, response.status_code
+        response.render()
+
+    def count_request():
+        # What the top feed would cost without precomputed scores.
+        since = timezone.now() - timedelta(seconds=settings.FEED_TOP_WINDOW)
+        posts = (
+            Post.objects.filter(user__in=reader.following.all(), date_created__gte=since)
+            .annotate(like_count=likes_count()).order_by('-like_count', '-id')
+            .prefetch_related('tags')[:settings.FEED_TOP_SIZE]
+        )
+        PostSerializer(posts, many=True).data
+
+    now = timezone.now()
+    candidates = list(candidate_posts(reader, now))
+    affinities = list(author_affinities(reader))
+    rank_ms = report(f"rank() of {len(candidates)} candidates",
+                     lambda: rank(candidates, affinities, now, 50), number=200) * 1000
+
+    top_p95 = print_latencies('top feed request', latencies(top_request, args.requests))
+    print_latencies('like count ranking', latencies(count_request, args.requests))
+    missed = []
+    if rank_ms > args.target_rank_ms:
+        missed.append(f"rank() {rank_ms:.2f} ms exceeds the {args.target_rank_ms} ms target")
+    if top_p95 > args.target_p95_ms:
+        missed.append(f"top feed p95 {top_p95:.2f} ms exceeds the {args.target_p95_ms} ms target")
+    for message in missed:
+        print(message)
+    if missed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Upload latency of shared post images, and near-duplicate lookups as images accumulate.
+
+Each upload is a distinct 600 x 600 PNG of random shapes. The benchmark
+times, per upload (median of --uploads):
+
+- resizing and storing it as Post.save did before images were shared;
+- store_post_image() for a new image: hashing, lookups, storing and
+  recording its ImageBlob;
+- store_post_image() for the same upload again, and for a re-encoded,
+  rescaled copy of it.
+
+find_similar() is then timed with --sizes stored images of random hashes,
+to show that near-duplicate lookups read a few index entries rather than
+every hash. Exits with status 1 if sharing adds more than
+--target-overhead-ms to a new upload with the largest number of stored
+images.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from io import BytesIO
+
+from benchmarks.common import setup_django
+
+setup_django()
+
+from django.core.files import File  # noqa: E402
+from django.core.files.storage import default_storage  # noqa: E402
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.db import transaction  # noqa: E402
+from PIL import Image, ImageDraw  # noqa: E402
+
+from user.images import (  # noqa: E402
+    dhash, find_similar, fingerprint, reduced_image, release_image, segments, store_post_image,
+)
+from user.models import POST_IMAGES_UPLOAD_PATH, ImageBlob, prepare_image, sharded_filename  # noqa: E402
+
+PREFIX = 'bench-dedup/'
+
+
+def random_image(rng, size=600):
+    image = Image.new('RGB', (size, size), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _shape in range(6):
+        x, y = rng.randrange(size), rng.randrange(size)
+        draw.rectangle((x, y, x + rng.randrange(size // 2), y + rng.randrange(size // 2)),
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+    return image
+
+
+def encoded(image, image_format='PNG', **options):
+    output = BytesIO()
+    image.save(output, format=image_format, **options)
+    return output.getvalue()
+
+
+def median_ms(name, func, arguments):
+    timings = []
+    for argument in arguments:
+        start = time.perf_counter()
+        func(argument)
+        timings.append(time.perf_counter() - start)
+    median = statistics.median(timings) * 1e3
+    print(f"{name:<50} {median:10.2f} ms")
+    return median
+
+
+def add_blobs(rng, count):
+    """Store count ImageBlob rows of random hashes, without files."""
+    ImageBlob.objects.bulk_create(
+        (ImageBlob(
+            name=f'{PREFIX}{index}-{rng.getrandbits(64):x}', sha256=f'{rng.getrandbits(256):064x}',
+            source_sha256=f'{rng.getrandbits(256):064x}',
+            **{f'dhash_{i}': segment for i, segment in enumerate(segments(rng.getrandbits(64)))},
+            width=300, height=300, fingerprint=os.urandom(768), size=20_000,
+        ) for index in range(count)),
+        batch_size=5000,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--uploads', type=int, default=50)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--target-overhead-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    ImageBlob.objects.filter(name__startswith=PREFIX).delete()
+    names = []
+    stored = 0
+    overhead = None
+    try:
+        for size in args.sizes:
+            add_blobs(rng, size - stored)
+            stored = size
+            print(f"{stored} stored images")
+            images = [random_image(rng) for _ in range(args.uploads)]
+            uploads = [encoded(image) for image in images]
+
+            def baseline(data):
+                resized = prepare_image(BytesIO(data))
+                names.append(default_storage.save(f"{POST_IMAGES_UPLOAD_PATH}/{sharded_filename()}", File(resized)))
+
+            def share(data):
+                names.append(store_post_image(SimpleUploadedFile('upload.png', data)))
+
+            before = median_ms('  resize and store (before sharing)', baseline, uploads)
+            # Post.save stores uploads in the transaction that saves the post,
+            # whose commit is left out of both timings.
+            with transaction.atomic():
+                new = median_ms('  store_post_image, new image', share, uploads)
+            with transaction.atomic():
+                median_ms('  store_post_image, same upload again', share, uploads)
+            copies = [encoded(image.resize((900, 900)), 'JPEG', quality=60) for image in images]
+            with transaction.atomic():
+                median_ms('  store_post_image, re-encoded copy', share, copies)
+            overhead = new - before
+
+            probes = []
+            for image in images:
+                image.thumbnail((300, 300))
+                reduced = reduced_image(image)
+                probes.append((dhash(reduced), fingerprint(reduced), image.size))
+            median_ms('  find_similar', lambda probe: find_similar(*probe), probes)
+    finally:
+        # Files stored without a blob are deleted by release_image() too.
+        for name in names:
+            release_image(name)
+        ImageBlob.objects.filter(name__startswith=PREFIX).delete()
+
+    print(f"{'sharing overhead on a new upload':<50} {overhead:10.2f} ms")
+    if overhead > args.target_overhead_ms:
+        print(f"sharing adds {overhead:.2f} ms to a new upload, more than the {args.target_overhead_ms} ms target")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
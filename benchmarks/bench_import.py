@@ -0,0 +1,35 @@
+"""Throughput of the bulk NDJSON post import, without images."""
+import argparse
+import json
+import time
+
+from benchmarks.common import setup_django
+
+setup_django()
+
+from user.imports import import_posts  # noqa: E402
+from user.models import Post, User  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--posts', type=int, default=50000)
+    parser.add_argument('--tags', type=int, default=200, help='distinct tag names across the import')
+    args = parser.parse_args()
+
+    user, _ = User.objects.get_or_create(email='bench-import@example.com')
+    lines = [
+        json.dumps({'text': f'Imported post {i}', 'tags': [f'bench-tag{i % args.tags}', 'bench']}).encode()
+        for i in range(args.posts)
+    ]
+    Post.objects.filter(user=user).delete()
+
+    start = time.perf_counter()
+    result = import_posts(user, lines)
+    elapsed = time.perf_counter() - start
+    print(f"imported {result.imported} posts in {elapsed:.2f}s: {result.imported / elapsed:,.0f} posts/s")
+    Post.objects.filter(user=user).delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,460 @@
+"""Throughput, latency and errors per operation under a realistic traffic mix.
+
+A server is started locally: gunicorn with the project's gunicorn.conf.py,
+or `manage.py runserver` with --server runserver. With --url, the harness
+uses a server that is already running. Fixture users are first registered
+over HTTP. Each one logs in, writes --posts-per-user tagged posts and
+follows --follows other users.
+
+Requests arrive open loop. Their start times are drawn in advance, as
+Poisson arrivals at the step's rate. Each request is sent at its time on a
+pool of --concurrency threads, whether or not earlier ones have finished.
+Latency is measured from the scheduled time, so time spent waiting for a
+free thread when the server falls behind is counted rather than hidden.
+
+MIX weighs registration and login, feed reads, posts filtered by tag, likes,
+follows, and post creation with and without an image. The arrival rate
+steps through --rates, --step-seconds each, to find where the server
+saturates. With --replay, a recorded schedule is replayed instead, once per
+--speeds factor. A schedule is an NDJSON file of {"time": seconds, "op":
+name} lines, and --record saves the synthetic one in that format.
+
+For each step and operation the harness prints:
+
+- completed requests per second;
+- p50, p95 and p99 latency;
+- errors: failed requests, and 4xx or 5xx answers other than 429;
+- throttled (429) answers.
+
+A step is saturated when it completes less than 90% of its offered rate,
+when its p99 exceeds --slo-p99-ms, or when more than 1% of its requests
+fail. Exits with status 1 if a step at or below --target-rps saturates.
+
+Likes and follows are rate limited per client IP (THROTTLE_IP_BUCKET).
+Raise that limit in the server's settings to load them beyond it.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'load-password'
+TAGS = 20
+IMAGES = 8
+
+MIX = {
+    'feed': 40,
+    'posts by tag': 15,
+    'like': 15,
+    'login': 10,
+    'create post': 8,
+    'follow': 5,
+    'create post with image': 4,
+    'register': 3,
+}
+
+
+class Request:
+    def __init__(self, method, path, token=None, data=None, image=None, on_success=None):
+        self.method = method
+        self.path = path
+        self.token = token
+        self.data = data
+        self.image = image
+        self.on_success = on_success
+
+
+class Client:
+    """Sends requests over a new connection each, as gunicorn's sync workers close them."""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+
+    def send(self, request):
+        """Return the status and body of the answer to request."""
+        headers = {}
+        body = None
+        if request.token:
+            headers['Authorization'] = f'Token {request.token}'
+        if request.image is not None:
+            body, headers['Content-Type'] = multipart(request.data, request.image)
+        elif request.data is not None:
+            body = json.dumps(request.data).encode()
+            headers['Content-Type'] = 'application/json'
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request(request.method, self.prefix + request.path, body=body, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+
+def multipart(fields, image):
+    boundary = uuid.uuid4().hex
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in fields.items()
+    ]
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="upload.png"\r\n'
+        f'Content-Type: image/png\r\n\r\n'.encode() + image + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def png_images(count, seed):
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    images = []
+    for _index in range(count):
+        image = Image.new('RGB', (600, 600), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _shape in range(6):
+            x, y = rng.randrange(600), rng.randrange(600)
+            draw.rectangle((x, y, x + rng.randrange(300), y + rng.randrange(300)),
+                           fill=tuple(rng.randrange(256) for _ in range(3)))
+        output = BytesIO()
+        image.save(output, format='PNG')
+        images.append(output.getvalue())
+    return images
+
+
+class LoadState:
+    """Users and posts known to the harness; updated as requests succeed."""
+
+    def __init__(self, run_id, images):
+        self.run_id = run_id
+        self.images = images
+        # Per run, so that runs do not share tags.
+        self.tags = [f'load-{run_id}-{index}' for index in range(TAGS)]
+        self.users = []
+        self.post_ids = []
+        self.liked = set()
+        self.registered = 0
+        self.lock = threading.Lock()
+
+    def new_email(self):
+        with self.lock:
+            self.registered += 1
+            return f'load-{self.run_id}-{self.registered}@example.com'
+
+    def add_post(self, status, body):
+        post_id = json.loads(body)['id']
+        with self.lock:
+            self.post_ids.append(post_id)
+
+    def unliked_pair(self, rng):
+        with self.lock:
+            for _attempt in range(10):
+                user, post_id = rng.choice(self.users), rng.choice(self.post_ids)
+                if (user['id'], post_id) not in self.liked:
+                    self.liked.add((user['id'], post_id))
+                    return user, post_id
+        return user, post_id
+
+
+def feed(state, rng):
+    return Request('GET', '/api/feed/', rng.choice(state.users)['token'])
+
+
+def posts_by_tag(state, rng):
+    return Request('GET', f'/api/posts/?tags__name={rng.choice(state.tags)}', rng.choice(state.users)['token'])
+
+
+def like(state, rng):
+    user, post_id = state.unliked_pair(rng)
+    return Request('POST', f'/api/posts/{post_id}/like/', user['token'])
+
+
+def follow(state, rng):
+    user, other = rng.sample(state.users, 2)
+    return Request('PUT', '/api/follow/', user['token'], {'user_id': other['id']})
+
+
+def create_post(state, rng):
+    tags = [{'name': name} for name in rng.sample(state.tags, 2)]
+    return Request('POST', '/api/posts/', rng.choice(state.users)['token'],
+                   {'text': f'Load post {rng.random():.6f}', 'tags': tags}, on_success=state.add_post)
+
+
+def create_post_with_image(state, rng):
+    # A few distinct images, so uploads of the same picture are common.
+    return Request('POST', '/api/posts/', rng.choice(state.users)['token'],
+                   {'text': f'Load image post {rng.random():.6f}'}, image=rng.choice(state.images),
+                   on_success=state.add_post)
+
+
+def login(state, rng):
+    return Request('POST', '/api/login/', data={'email': rng.choice(state.users)['email'], 'password': PASSWORD})
+
+
+def register(state, rng):
+    return Request('POST', '/api/register/', data={'email': state.new_email(), 'password': PASSWORD})
+
+
+OPERATIONS = {
+    'feed': feed,
+    'posts by tag': posts_by_tag,
+    'like': like,
+    'login': login,
+    'create post': create_post,
+    'follow': follow,
+    'create post with image': create_post_with_image,
+    'register': register,
+}
+
+
+def send_checked(client, request, expected):
+    """Send a fixture request, waiting out throttling; return the parsed answer."""
+    while True:
+        status, body = client.send(request)
+        if status != 429:
+            break
+        time.sleep(1)
+    if status != expected:
+        raise RuntimeError(f"{request.method} {request.path} answered {status}: {body[:200]!r}")
+    return json.loads(body) if body else None
+
+
+def create_user(client, state, rng, posts):
+    email = state.new_email()
+    send_checked(client, Request('POST', '/api/register/', data={'email': email, 'password': PASSWORD}), 201)
+    token = send_checked(client, Request('POST', '/api/login/', data={'email': email, 'password': PASSWORD}), 200)['token']
+    user = {'email': email, 'token': token, 'id': None}
+    for _index in range(posts):
+        post = send_checked(client, Request(
+            'POST', '/api/posts/', token, {'text': 'Fixture post', 'tags': [{'name': rng.choice(state.tags)}]}), 201)
+        user['id'] = post['user']
+        state.add_post(201, json.dumps(post))
+    return user
+
+
+def create_fixture(client, state, args, rng):
+    # Sequential, so that setting up does not fail on databases that lock
+    # on concurrent writes, such as SQLite.
+    state.users = [create_user(client, state, rng, max(args.posts_per_user, 1)) for _index in range(args.users)]
+    for user in state.users:
+        for other in rng.sample(state.users, min(args.follows + 1, len(state.users))):
+            if other is not user:
+                send_checked(client, Request('PUT', '/api/follow/', user['token'], {'user_id': other['id']}), 200)
+
+
+def synthetic_schedule(rate, seconds, rng):
+    """Return (offset, operation name) arrivals of a Poisson process at rate per second."""
+    names, weights = list(MIX), list(MIX.values())
+    schedule = []
+    offset = rng.expovariate(rate)
+    while offset < seconds:
+        schedule.append((offset, rng.choices(names, weights)[0]))
+        offset += rng.expovariate(rate)
+    return schedule
+
+
+def read_schedule(path):
+    schedule = []
+    with open(path) as lines:
+        for line in lines:
+            if line.strip():
+                record = json.loads(line)
+                schedule.append((float(record['time']), record['op']))
+    return sorted(schedule)
+
+
+def run_step(client, state, schedule, concurrency, rng):
+    """Send the schedule open loop; return [(operation, latency, outcome, status)] and the elapsed time."""
+    results = []
+    start = time.perf_counter() + 0.1
+
+    def send(name, request, scheduled):
+        try:
+            status, body = client.send(request)
+        except (OSError, http.client.HTTPException):
+            status, body = 0, b''
+        latency = time.perf_counter() - scheduled
+        if status == 429:
+            outcome = 'throttled'
+        elif 200 <= status < 400:
+            outcome = 'ok'
+            if request.on_success is not None:
+                request.on_success(status, body)
+        else:
+            outcome = 'error'
+        results.append((name, latency, outcome, status))
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for offset, name in schedule:
+            request = OPERATIONS[name](state, rng)
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, name, request, start + offset)
+    return results, time.perf_counter() - start
+
+
+def percentile(ordered, share):
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def step_statistics(row, elapsed):
+    """Return (completed rps, p50, p95, p99 in ms, errors, throttled) of [(latency, outcome)]."""
+    latencies = sorted(latency * 1e3 for latency, _outcome in row)
+    errors = sum(outcome == 'error' for _latency, outcome in row)
+    throttled = sum(outcome == 'throttled' for _latency, outcome in row)
+    return ((len(row) - errors) / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.95),
+            percentile(latencies, 0.99), errors, throttled)
+
+
+def report_step(results, elapsed):
+    """Print per-operation statistics; return those of all operations."""
+    print(f"  {'operation':<24} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8} {'throttled':>9}")
+    rows = {name: [] for name in OPERATIONS}
+    error_statuses = {}
+    for name, latency, outcome, status in results:
+        rows[name].append((latency, outcome))
+        if outcome == 'error':
+            error_statuses[status] = error_statuses.get(status, 0) + 1
+    rows['all'] = [(latency, outcome) for _name, latency, outcome, _status in results]
+    for name, row in rows.items():
+        if not row:
+            continue
+        statistics = step_statistics(row, elapsed)
+        rps, p50, p95, p99, errors, throttled = statistics
+        print(f"  {name:<24} {rps:8.1f} {p50:9.1f} {p95:9.1f} {p99:9.1f} {errors:8d} {throttled:9d}")
+    if error_statuses:
+        # Status 0 stands for requests that failed or timed out.
+        print("  errors by status: " + ', '.join(
+            f"{status}: {count}" for status, count in sorted(error_statuses.items())))
+    return statistics
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, workers, log):
+    port = free_port()
+    if kind == 'gunicorn':
+        args = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers)]
+    else:
+        args = [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}']
+    process = subprocess.Popen(args, cwd=PROJECT_ROOT, stdout=log, stderr=log)
+    url = f'http://127.0.0.1:{port}'
+    client = Client(url, timeout=5)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            # Answered 401 once the app is loaded, without touching the database.
+            if client.send(Request('GET', '/api/feed/'))[0] == 401:
+                return process, url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    log.seek(0)
+    raise RuntimeError(f"The {kind} server did not start:\n{log.read().decode(errors='replace')[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='use a running server instead of starting one')
+    parser.add_argument('--server', choices=['gunicorn', 'runserver'], default='gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts-per-user', type=int, default=5)
+    parser.add_argument('--follows', type=int, default=5)
+    parser.add_argument('--rates', type=float, nargs='+', default=[10, 20, 40, 80, 160],
+                        help='arrival rates of the ramp, in requests per second')
+    parser.add_argument('--step-seconds', type=float, default=20)
+    parser.add_argument('--replay', help='NDJSON schedule to replay instead of the synthetic mix')
+    parser.add_argument('--speeds', type=float, nargs='+', default=[1], help='replay speed factors')
+    parser.add_argument('--record', help='save the synthetic schedule as NDJSON')
+    parser.add_argument('--concurrency', type=int, default=200, help='requests in flight at most')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--slo-p99-ms', type=float, default=500)
+    parser.add_argument('--target-rps', type=float, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.replay:
+        recorded = read_schedule(args.replay)
+        unknown = {name for _offset, name in recorded} - OPERATIONS.keys()
+        if unknown:
+            parser.error(f"unknown operations in {args.replay}: {', '.join(sorted(unknown))}")
+        duration = recorded[-1][0] if recorded else 0
+        steps = [(len(recorded) / max(duration / speed, 1e-9), f'replay at {speed}x',
+                  [(offset / speed, name) for offset, name in recorded]) for speed in args.speeds]
+    else:
+        steps = [(rate, f'{rate:g} rps', synthetic_schedule(rate, args.step_seconds, rng)) for rate in args.rates]
+        if args.record:
+            with open(args.record, 'w') as output:
+                elapsed = 0
+                for _rate, _name, schedule in steps:
+                    for offset, name in schedule:
+                        output.write(json.dumps({'time': round(elapsed + offset, 6), 'op': name}) + '\n')
+                    elapsed += args.step_seconds
+
+    with tempfile.TemporaryFile() as log:
+        process = None
+        url = args.url
+        if url is None:
+            process, url = start_server(args.server, args.workers, log)
+            print(f"{args.server} started at {url}")
+        try:
+            client = Client(url, args.timeout)
+            state = LoadState(uuid.uuid4().hex[:8], png_images(IMAGES, args.seed))
+            create_fixture(client, state, args, rng)
+            print(f"{len(state.users)} users and {len(state.post_ids)} posts created")
+
+            missed = []
+            for rate, name, schedule in steps:
+                print(f"step {name}: {len(schedule)} requests")
+                results, elapsed = run_step(client, state, schedule, args.concurrency, rng)
+                if not results:
+                    continue
+                completed, _p50, _p95, p99, errors, _throttled = report_step(results, elapsed)
+                error_rate = errors / len(results)
+                reasons = []
+                if completed < 0.9 * rate:
+                    reasons.append(f"completed {completed:.1f} of {rate:.1f} rps")
+                if p99 > args.slo_p99_ms:
+                    reasons.append(f"p99 {p99:.0f} ms over {args.slo_p99_ms:g} ms")
+                if error_rate > 0.01:
+                    reasons.append(f"{error_rate:.1%} errors")
+                if reasons:
+                    print(f"  saturated: {', '.join(reasons)}")
+                    if rate <= args.target_rps:
+                        missed.append(f"step {name} saturated, at or below the {args.target_rps:g} rps target")
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    for message in missed:
+        print(message)
+    if missed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
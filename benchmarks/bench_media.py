@@ -0,0 +1,61 @@
+"""Cost of delivering a media file through MediaView, compared with django.views.static.serve.
+
+With X-Accel-Redirect the app only checks access and sends headers; the bytes
+are sent by the proxy, so the per-request cost no longer grows with file size.
+"""
+import argparse
+import os
+
+from benchmarks.common import create_feed_fixture, report, setup_django
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+from django.core.files.base import ContentFile  # noqa: E402
+from django.core.files.storage import default_storage  # noqa: E402
+from django.test import Client, RequestFactory  # noqa: E402
+from django.views.static import serve  # noqa: E402
+
+from user.models import Post  # noqa: E402
+
+NAME = 'post_images/bench-media.jpg'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=256 * 1024, help='file size in bytes')
+    parser.add_argument('--number', type=int, default=500)
+    args = parser.parse_args()
+
+    token = create_feed_fixture()
+    default_storage.delete(NAME)
+    default_storage.save(NAME, ContentFile(os.urandom(args.size)))
+    post = Post.objects.filter(user__email='bench-author0@example.com').first()
+    Post.objects.filter(id=post.id).update(image=NAME)
+
+    client = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Token {token}')
+    url = f'/media/{NAME}'
+    factory = RequestFactory()
+
+    def read(response):
+        assert response.status_code in (200, 206), response.status_code
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
+    print(f"file size: {args.size} bytes")
+    report('django.views.static.serve (no access check)',
+           lambda: read(serve(factory.get(url), NAME, document_root=settings.MEDIA_ROOT)),
+           number=args.number, repeat=3)
+    for method in ('django', 'x-accel-redirect', 'x-sendfile'):
+        settings.MEDIA_SERVE_METHOD = method
+        report(f'MediaView, {method}', lambda: read(client.get(url)), number=args.number, repeat=3)
+    report('MediaView, django, Range: last 64 KiB',
+           lambda: read(client.get(url, HTTP_RANGE='bytes=-65536')), number=args.number, repeat=3)
+
+    Post.objects.filter(id=post.id).update(image='')
+    default_storage.delete(NAME)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""Per-request overhead of MetricsMiddleware on the request hot path."""
+from benchmarks.common import report, setup_django
+
+setup_django()
+
+from django.http import HttpResponse  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from django.urls import resolve  # noqa: E402
+
+from core.metrics import MetricsMiddleware  # noqa: E402
+
+
+def view(request):
+    return HttpResponse(b'{}' * 512, content_type='application/json')
+
+
+def main():
+    request = RequestFactory().get('/api/feed/')
+    request.resolver_match = resolve('/api/feed/')
+    middleware = MetricsMiddleware(view)
+
+    baseline = report('view without middleware', lambda: view(request))
+    instrumented = report('view with MetricsMiddleware', lambda: middleware(request))
+    print(f"{'overhead per request':<50} {(instrumented - baseline) * 1e6:10.2f} us")
+
+
+if __name__ == '__main__':
+    main()
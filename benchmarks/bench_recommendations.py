@@ -0,0 +1,117 @@
+"""Build time and memory of post recommendations on synthetic likes.
+
+--likes likes (10M by default) are generated in memory: likes per user
+follow a Pareto distribution and a few posts get most of them. They are fed
+to the functions refresh_recommendations() uses, as if every post were in
+the window, without the database round trips. The benchmark times:
+
+- building the likes matrix;
+- a full build of every post's similar posts and every user's
+  recommendations;
+- an incremental refresh after --changed (1%) of the posts got new likes.
+
+It also prints the size of the matrix and of the packed stores, and the
+peak RSS. Exits with status 1 if the full build or the incremental refresh
+misses its target.
+"""
+import argparse
+import random
+import resource
+import sys
+import time
+from array import array
+
+from benchmarks.common import setup_django
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+
+from user.recommendations import LikesMatrix, neighbour_rows, recommend  # noqa: E402
+
+
+def synthetic_likes(users, posts, likes, seed=1):
+    """Return (user ids, post ids) arrays of likes grouped by user."""
+    rng = random.Random(seed)
+    weights = [rng.paretovariate(1.5) for _ in range(users)]
+    scale = likes / sum(weights)
+    user_ids, post_ids = array('q'), array('q')
+    for user_id, weight in enumerate(weights, 1):
+        count = max(1, round(weight * scale))
+        user_ids.extend([user_id] * count)
+        # Cubing a uniform draw favours low ids: a few posts get most likes.
+        post_ids.extend(int(posts * rng.random() ** 3) + 1 for _ in range(count))
+    return user_ids, post_ids
+
+
+def recommendations(matrix, neighbours, user_ids):
+    return {user_id: array('q', recommend(matrix.histories[user_id], neighbours, settings.RECOMMENDATION_SIZE))
+            for user_id in user_ids}
+
+
+def array_bytes(arrays):
+    return sum(values.itemsize * len(values) for values in arrays)
+
+
+def timed(name, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<50} {elapsed:10.2f} s")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--posts', type=int, default=1_000_000)
+    parser.add_argument('--likes', type=int, default=10_000_000)
+    parser.add_argument('--changed', type=float, default=0.01, help='share of posts with new likes')
+    parser.add_argument('--target-full-s', type=float, default=600.0)
+    parser.add_argument('--target-incremental-s', type=float, default=60.0)
+    args = parser.parse_args()
+
+    (user_ids, post_ids), _elapsed = timed('generate likes', lambda: synthetic_likes(args.users, args.posts, args.likes))
+    print(f"{len(post_ids)} likes by {args.users} users of up to {args.posts} posts")
+    matrix, build_matrix = timed('build the likes matrix', lambda: LikesMatrix.from_rows(
+        zip(user_ids, post_ids), settings.RECOMMENDATION_HISTORY_SIZE, settings.RECOMMENDATION_MAX_LIKERS))
+    del user_ids, post_ids
+    print(f"{'matrix: likes kept, posts':<50} {sum(map(len, matrix.histories.values())):10d} "
+          f"{len(matrix.likers):10d}")
+    matrix_mb = (array_bytes(matrix.histories.values()) + array_bytes(matrix.likers.values())) / 2 ** 20
+    print(f"{'matrix arrays, contents only':<50} {matrix_mb:10.1f} MB")
+
+    neighbours, similar_time = timed('similar posts of every post', lambda: neighbour_rows(matrix, matrix.likers))
+    recommended, recommend_time = timed('recommendations of every user',
+                                        lambda: recommendations(matrix, neighbours, matrix.histories))
+    store_mb = (sum(array_bytes(row) for row in neighbours.values()) + array_bytes(recommended.values())) / 2 ** 20
+    print(f"{'packed SimilarPosts and RecommendedPosts':<50} {store_mb:10.1f} MB")
+    full = build_matrix + similar_time + recommend_time
+
+    rng = random.Random(2)
+    changed = rng.sample(sorted(matrix.likers), int(len(matrix.likers) * args.changed))
+    users = {user_id for post_id in changed for user_id in matrix.likers[post_id]}
+
+    def incremental():
+        neighbours.update(neighbour_rows(matrix, changed))
+        recommendations(matrix, neighbours, users)
+
+    _result, incremental_time = timed(f'refresh {len(changed)} posts and {len(users)} users', incremental)
+    incremental_time += build_matrix
+    print(f"{'full build, matrix included':<50} {full:10.2f} s")
+    print(f"{'incremental refresh, matrix included':<50} {incremental_time:10.2f} s")
+    print(f"{'peak RSS':<50} {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:10.1f} MB")
+
+    missed = []
+    if full > args.target_full_s:
+        missed.append(f"full build {full:.0f} s exceeds the {args.target_full_s:.0f} s target")
+    if incremental_time > args.target_incremental_s:
+        missed.append(f"incremental refresh {incremental_time:.0f} s exceeds the {args.target_incremental_s:.0f} s target")
+    for message in missed:
+        print(message)
+    if missed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
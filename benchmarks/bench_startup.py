@@ -0,0 +1,119 @@
+"""Cold start of management commands and gunicorn workers.
+
+Every measurement runs in a fresh interpreter:
+
+- `manage.py check`, as any management command would start;
+- `manage.py collect_orphan_tags --dry-run`, a periodic command that skips
+  the system checks;
+- worker boot: loading app.wsgi, as a worker does without preload_app;
+- warm-up: core.startup.warm_up(), which the master runs once with preload_app;
+- the first request of a worker, with and without warm-up.
+
+With --importtime the slowest imports of loading the app are listed, from
+`python -X importtime`. Exits with status 1 if a command or worker boot
+misses its target, or if loading the app imports Pillow.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from app.wsgi import application
+booted = time.perf_counter()
+warm_up_time = 0
+if {warm_up}:
+    from core.startup import warm_up
+    warm_up_time = warm_up()
+from django.test import Client
+client = Client(HTTP_HOST='localhost')
+request_start = time.perf_counter()
+# Answered 401 without touching the database, after routing and authentication.
+response = client.get('/api/feed/')
+assert response.status_code == 401, response.status_code
+print(json.dumps({{
+    'boot': booted - start,
+    'warm_up': warm_up_time,
+    'first_request': time.perf_counter() - request_start,
+    'pil_loaded': 'PIL' in sys.modules,
+}}))
+"""
+
+
+def run(args):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'app.settings'))
+    return subprocess.run([sys.executable, *args], cwd=PROJECT_ROOT, env=env, check=True,
+                          capture_output=True, text=True)
+
+
+def wall_time(args):
+    start = time.perf_counter()
+    run(args)
+    return time.perf_counter() - start
+
+
+def worker_times(warm_up):
+    return json.loads(run(['-c', WORKER_SCRIPT.format(warm_up=warm_up)]).stdout)
+
+
+def slowest_imports(count):
+    stderr = run(['-X', 'importtime', '-c', 'from app.wsgi import application; import app.urls']).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _self, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.rstrip()))
+    for cumulative, name in sorted(rows, reverse=True)[:count]:
+        print(f"  {cumulative / 1000:8.1f} ms {name}")
+
+
+def median_ms(values):
+    return statistics.median(values) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--importtime', type=int, default=0, metavar='N', help='list the N slowest imports')
+    parser.add_argument('--target-command-ms', type=float, default=1500.0)
+    parser.add_argument('--target-boot-ms', type=float, default=1000.0)
+    args = parser.parse_args()
+
+    command = median_ms([wall_time(['manage.py', 'check']) for _ in range(args.runs)])
+    periodic = median_ms([wall_time(['manage.py', 'collect_orphan_tags', '--dry-run']) for _ in range(args.runs)])
+    cold = [worker_times(False) for _ in range(args.runs)]
+    warm = [worker_times(True) for _ in range(args.runs)]
+    boot = median_ms([times['boot'] for times in cold])
+    print(f"{'manage.py check':<50} {command:8.1f} ms")
+    print(f"{'manage.py collect_orphan_tags --dry-run':<50} {periodic:8.1f} ms")
+    print(f"{'worker boot (load app.wsgi)':<50} {boot:8.1f} ms")
+    print(f"{'warm-up':<50} {median_ms([times['warm_up'] for times in warm]):8.1f} ms")
+    print(f"{'first request, cold worker':<50} {median_ms([times['first_request'] for times in cold]):8.1f} ms")
+    print(f"{'first request, warmed-up worker':<50} {median_ms([times['first_request'] for times in warm]):8.1f} ms")
+    if args.importtime:
+        print("slowest imports:")
+        slowest_imports(args.importtime)
+
+    missed = []
+    if any(times['pil_loaded'] for times in cold):
+        missed.append("Pillow is imported when the app loads")
+    if command > args.target_command_ms:
+        missed.append(f"manage.py check {command:.0f} ms exceeds the {args.target_command_ms:.0f} ms target")
+    if boot > args.target_boot_ms:
+        missed.append(f"worker boot {boot:.0f} ms exceeds the {args.target_boot_ms:.0f} ms target")
+    for message in missed:
+        print(message)
+    if missed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Per-request overhead of TokenBucketThrottle with the configured bucket store."""
+from benchmarks.common import report, setup_django
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import AnonymousUser  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+from rest_framework.request import Request  # noqa: E402
+
+from user.throttling import TokenBucketThrottle  # noqa: E402
+from user.views import UserLikePostView  # noqa: E402
+
+
+class BenchUser:
+    pk = 1
+    is_authenticated = True
+
+
+def main():
+    print(f"bucket store: {settings.THROTTLE_BUCKET_STORE}")
+    settings.THROTTLE_USER_BUCKET = {'capacity': 10 ** 9, 'refill_rate': 10 ** 9}
+    settings.THROTTLE_IP_BUCKET = {'capacity': 10 ** 9, 'refill_rate': 10 ** 9}
+    throttle = TokenBucketThrottle()
+    view = UserLikePostView()
+    factory = RequestFactory()
+
+    free_request = Request(factory.get('/api/posts/'))
+    free_request.user = AnonymousUser()
+    like_request = Request(factory.post('/api/posts/1/like/'))
+    like_request.user = BenchUser()
+
+    report('allow_request, free request (no bucket lookup)',
+           lambda: throttle.allow_request(free_request, view))
+    report('allow_request, like (user + IP bucket)',
+           lambda: throttle.allow_request(like_request, view))
+
+
+if __name__ == '__main__':
+    main()
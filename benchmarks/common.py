@@ -0,0 +1,37 @@
+"""Shared helpers for the benchmark suite.
+
+Benchmarks are run from the project root as modules, for example
+``python -m benchmarks.bench_metrics``.
+"""
+import os
+import timeit
+
+import django
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+    django.setup()
+
+
+def report(name, func, number=10000, repeat=5):
+    """Print and return the best per-call time of func in seconds."""
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    print(f"{name:<50} {best * 1e6:10.2f} us/op")
+    return best
+
+
+def create_feed_fixture(posts_per_author=20, authors=5):
+    """Create (once) a reader following several authors with posts; return the reader's token."""
+    from rest_framework.authtoken.models import Token
+    from user.models import Post, User
+
+    reader, created = User.objects.get_or_create(email='bench-reader@example.com')
+    if created:
+        for author_index in range(authors):
+            author = User.objects.create(email=f'bench-author{author_index}@example.com')
+            reader.following.add(author)
+            Post.objects.bulk_create(
+                Post(user=author, text=f'Benchmark post {i}') for i in range(posts_per_author))
+    token, _ = Token.objects.get_or_create(user=reader)
+    return token.key
@@ -1,12 +1,35 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
-from user.models import User
+from user.deletion import schedule_account_deletion
+from user.models import AccountDeletion, Post, PostTag, User
 
-class UserAdmin(BaseUserAdmin):
+from .pagination import ApproximateCountPaginator
+
+
+def related_count(queryset, field):
+    """Count the rows of queryset whose field points at the outer row.
+
+    A correlated subquery is only evaluated for the rows of the page shown,
+    unlike Count() over a join, which aggregates the whole table.
+    """
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(count=Count('*'))
+    return Coalesce(Subquery(counts.values('count')), 0)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables too large to count exactly (see pagination.py)."""
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+
+
+class UserAdmin(LargeTableAdmin, BaseUserAdmin):
     """Define the admin pages for users."""
     ordering = ['id']
-    list_display = ['email', 'bio']
+    list_display = ['email', 'bio', 'is_active', 'post_count', 'follower_count']
+    search_fields = ['email']
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         ('Personal Info', {'fields': ('profile_picture', 'bio')}),
@@ -14,6 +37,7 @@ class UserAdmin(BaseUserAdmin):
         ('Important dates', {'fields': ('last_login', 'date_joined')}),
     )
 
+    actions = ['delete_in_background']
     filter_horizontal = ()
     list_filter = ()
     add_fieldsets = (
@@ -27,4 +51,65 @@ class UserAdmin(BaseUserAdmin):
             ),
         }),
     )
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            post_count=related_count(Post.objects.all(), 'user'),
+            follower_count=related_count(User.followers.through.objects.all(), 'to_user'),
+        )
+
+    @admin.display(description='Posts', ordering='post_count')
+    def post_count(self, user):
+        return user.post_count
+
+    @admin.display(description='Followers', ordering='follower_count')
+    def follower_count(self, user):
+        return user.follower_count
+
+    @admin.action(description='Delete selected users in the background')
+    def delete_in_background(self, request, queryset):
+        for user in queryset:
+            schedule_account_deletion(user)
+        self.message_user(request, f"{len(queryset)} accounts scheduled for deletion.")
+
+
+class AccountDeletionAdmin(admin.ModelAdmin):
+    """Read-only progress of background account deletions."""
+    list_display = ['email', 'user_id', 'status', 'stage', 'deleted_rows', 'deleted_files', 'created', 'finished']
+    list_filter = ['status']
+    search_fields = ['email']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class PostTagInline(admin.TabularInline):
+    model = PostTag
+    raw_id_fields = ['tag']
+    extra = 0
+
+
+class PostAdmin(LargeTableAdmin):
+    """Admin pages for posts."""
+    ordering = ['-id']
+    list_display = ['id', 'text', 'user', 'date_created', 'like_count']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    inlines = [PostTagInline]
+    search_fields = ['text']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            like_count=related_count(Post.likes.through.objects.all(), 'post'))
+
+    @admin.display(description='Likes', ordering='like_count')
+    def like_count(self, post):
+        return post.like_count
+
+
 admin.site.register(User, UserAdmin)
+admin.site.register(Post, PostAdmin)
+admin.site.register(AccountDeletion, AccountDeletionAdmin)
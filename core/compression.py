@@ -0,0 +1,242 @@
+"""Negotiated gzip and Brotli compression of responses.
+
+CompressionMiddleware compresses text and JSON responses of at least
+COMPRESSION_MIN_SIZE bytes with Brotli, if the brotli package is installed
+and the client accepts it, or else gzip. Streamed responses are compressed
+chunk by chunk and flushed after each chunk, so event streams stay live.
+
+HTML responses are left uncompressed. They are the admin and browsable
+API pages, which hold CSRF tokens next to reflected input such as search
+terms, and compressing them would leak those tokens through the response
+size (BREACH). Unlike Django's GZipMiddleware, which pads the gzip header
+randomly instead, this keeps the compressed output cacheable.
+
+Compressing a response costs far more CPU than hashing it, so compressed
+bodies are kept in a per-process LRU of COMPRESSION_CACHE_SIZE bytes,
+keyed by the response's ETag (set from the body's hash if the view did not
+set one), content type and encoding. Repeated responses, such as an unchanged feed or
+profile, are then compressed only once. The time spent and bytes saved are
+exported per route (see metrics.py).
+"""
+import hashlib
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.http import quote_etag
+
+from .metrics import COMPRESSION_DURATION, COMPRESSION_SAVED_BYTES, record_cache, route_label
+
+try:
+    import brotli
+except ImportError:
+    # Optional; without it only gzip is offered.
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+UNCOMPRESSED_TYPES = ('text/html', 'application/xhtml+xml')
+
+
+def accepted_encodings(header):
+    """Return the content codings of an Accept-Encoding header that have a non-zero quality."""
+    accepted = set()
+    for item in header.split(','):
+        coding, _separator, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _separator, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if quality > 0:
+            accepted.add(coding)
+    return accepted
+
+
+def choose_encoding(header):
+    """Return 'br', 'gzip' or None for an Accept-Encoding header."""
+    accepted = accepted_encodings(header)
+    if brotli is not None and accepted & {'br', '*'}:
+        return 'br'
+    if accepted & {'gzip', '*'}:
+        return 'gzip'
+    return None
+
+
+def is_compressible(response):
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    return (
+        not response.has_header('Content-Encoding')
+        and response.status_code != 206
+        and 'no-transform' not in response.get('Cache-Control', '')
+        and (content_type.startswith(COMPRESSIBLE_TYPES) or content_type.endswith(('+json', '+xml')))
+        and content_type not in UNCOMPRESSED_TYPES
+    )
+
+
+class StreamCompressor:
+    """Compresses a body piece by piece; every piece is flushed so it can be sent at once."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        else:
+            # wbits=31 writes a gzip header; its mtime is 0, so output is deterministic.
+            self._compressor = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=True):
+        if self.encoding == 'br':
+            output = self._compressor.process(data)
+            return output + self._compressor.flush() if flush else output
+        output = self._compressor.compress(data)
+        return output + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else output
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress(body, encoding):
+    compressor = StreamCompressor(encoding)
+    return compressor.compress(body, flush=False) + compressor.finish()
+
+
+def compress_stream(chunks, encoding):
+    compressor = StreamCompressor(encoding)
+    for chunk in chunks:
+        output = compressor.compress(chunk)
+        if output:
+            yield output
+    yield compressor.finish()
+
+
+async def acompress_stream(chunks, encoding):
+    compressor = StreamCompressor(encoding)
+    async for chunk in chunks:
+        output = compressor.compress(chunk)
+        if output:
+            yield output
+    yield compressor.finish()
+
+
+class CompressedBodyCache:
+    """LRU of compressed bodies bounded by their total size, guarded by a lock."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._lock = threading.Lock()
+        self._bodies = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is not None:
+                self._bodies.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_size:
+            return
+        with self._lock:
+            previous = self._bodies.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._bodies[key] = body
+            self.size += len(body)
+            while self.size > self.max_size:
+                _key, evicted = self._bodies.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
+            self.size = 0
+
+
+@lru_cache(maxsize=None)
+def get_compressed_cache():
+    """Return the process-wide cache of compressed bodies."""
+    return CompressedBodyCache(settings.COMPRESSION_CACHE_SIZE)
+
+
+class CompressionMiddleware:
+    """Compress responses with the best encoding the client accepts."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        if not is_compressible(response):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_stream(response.streaming_content, encoding)
+            else:
+                response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            original_size = len(response.content)
+            if original_size < settings.COMPRESSION_MIN_SIZE:
+                return response
+            body = self.compressed_body(request, response, encoding)
+            if len(body) >= original_size:
+                return response
+            COMPRESSION_SAVED_BYTES.labels(route_label(request), encoding).inc(original_size - len(body))
+            response.content = body
+            response['Content-Length'] = str(len(body))
+
+        # The compressed body is not byte-for-byte the one the ETag was made for.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    def compressed_body(self, request, response, encoding):
+        if not response.has_header('ETag'):
+            # SHA-1 rather than the MD5 of set_response_etag(): it is several
+            # times faster here, and hashing is the whole cost of a cache hit.
+            response['ETag'] = quote_etag(hashlib.sha1(response.content).hexdigest())
+        # Views may set the same ETag on representations of different types.
+        key = (response['ETag'], response.get('Content-Type', ''), encoding)
+        cache = get_compressed_cache()
+        body = cache.get(key)
+        record_cache('compressed_bodies', body is not None)
+        if body is None:
+            start = time.perf_counter()
+            body = compress(response.content, encoding)
+            COMPRESSION_DURATION.labels(route_label(request), encoding).observe(time.perf_counter() - start)
+            cache.put(key, body)
+        return body
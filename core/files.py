@@ -0,0 +1,102 @@
+"""File responses supporting conditional and Range requests."""
+import os
+import re
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, quote_etag
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def make_etag(modified_time, size):
+    """Return an ETag for a file from its modification time (a timestamp) and size."""
+    return quote_etag(f"{int(modified_time * 1e9):x}-{size:x}")
+
+
+def parse_range(header, size):
+    """Return (start, end) inclusive for a single byte range header, or None if it cannot be satisfied.
+
+    Multiple ranges are not supported; callers send the whole file instead.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        length = int(end)
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        return None
+    return start, end
+
+
+def _read_range(open_file, start, length):
+    with open_file() as range_file:
+        range_file.seek(start)
+        while length > 0:
+            chunk = range_file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _file_response(request, open_file, size, modified_time, content_type=None, filename=None,
+                   as_attachment=False, cache_control=None):
+    etag = make_etag(modified_time, size)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(modified_time),
+        'Accept-Ranges': 'bytes',
+    }
+    if cache_control:
+        headers['Cache-Control'] = cache_control
+
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        range_header = request.headers.get('Range')
+        if_range = request.headers.get('If-Range')
+        if range_header and (not if_range or if_range == etag):
+            byte_range = parse_range(range_header, size)
+            if byte_range is None:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f"bytes */{size}"
+                return response
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _read_range(open_file, start, end - start + 1), status=206,
+                content_type=content_type or 'application/octet-stream')
+            response['Content-Range'] = f"bytes {start}-{end}/{size}"
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response = FileResponse(open_file(), content_type=content_type,
+                                    as_attachment=as_attachment, filename=filename or '')
+            response['Content-Length'] = str(size)
+    for header, value in headers.items():
+        response[header] = value
+    if as_attachment and filename and response.status_code == 206:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def ranged_file_response(request, path, **kwargs):
+    """Serve a local file with ETag, If-None-Match, Range and If-Range support.
+
+    Keyword arguments are content_type, filename, as_attachment and cache_control.
+    """
+    stat = os.stat(path)
+    return _file_response(request, lambda: open(path, 'rb'), stat.st_size, stat.st_mtime, **kwargs)
+
+
+def ranged_storage_response(request, storage, name, **kwargs):
+    """Serve a file from a storage backend, like ranged_file_response."""
+    return _file_response(
+        request, lambda: storage.open(name, 'rb'), storage.size(name),
+        storage.get_modified_time(name).timestamp(), **kwargs)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.profiling import make_profile_token
+
+
+class Command(BaseCommand):
+    """Print a signed value for the X-Profile request header."""
+    help = 'Generate a signed X-Profile header value to profile a single request.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_profile_token())
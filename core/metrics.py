@@ -0,0 +1,202 @@
+"""Prometheus metrics for the API.
+
+Metrics are collected per process. When PROMETHEUS_MULTIPROC_DIR is set in
+the environment (it must be shared by all gunicorn workers and emptied on
+deploy), the exposition view aggregates the values written by every worker.
+"""
+import os
+import time
+from contextlib import ExitStack, asynccontextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route.',
+    ['route', 'method'], buckets=LATENCY_BUCKETS)
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Response body size by route.',
+    ['route'], buckets=SIZE_BUCKETS)
+REQUEST_ERRORS = Counter(
+    'http_request_errors_total', 'Responses with a 4xx or 5xx status by route.',
+    ['route', 'method', 'status'])
+DB_QUERY_DURATION = Histogram(
+    'db_query_duration_seconds', 'Duration of single database queries by route.',
+    ['route'], buckets=LATENCY_BUCKETS)
+DB_QUERIES_PER_REQUEST = Histogram(
+    'db_queries_per_request', 'Number of database queries per request by route.',
+    ['route'], buckets=QUERY_COUNT_BUCKETS)
+IMAGE_PROCESSING_DURATION = Histogram(
+    'image_processing_duration_seconds', 'Time spent in prepare_image.',
+    buckets=LATENCY_BUCKETS)
+IMAGE_DEDUP = Counter(
+    'image_dedup_total', 'Post images stored, by the stored image they share (none when stored anew).',
+    ['match'])
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups by cache name and result (hit or miss).',
+    ['cache', 'result'])
+COMPRESSION_DURATION = Histogram(
+    'http_compression_duration_seconds', 'Time spent compressing response bodies by route and encoding.',
+    ['route', 'encoding'], buckets=LATENCY_BUCKETS)
+COMPRESSION_SAVED_BYTES = Counter(
+    'http_compression_saved_bytes_total', 'Bytes saved by compressing response bodies by route and encoding.',
+    ['route', 'encoding'])
+
+DB_POOL_SIZE = Gauge(
+    'db_pool_size', 'Connections currently managed by the pool.',
+    ['alias'], multiprocess_mode='livesum')
+DB_POOL_AVAILABLE = Gauge(
+    'db_pool_available', 'Idle connections available in the pool.',
+    ['alias'], multiprocess_mode='livesum')
+DB_POOL_WAITING = Gauge(
+    'db_pool_requests_waiting', 'Requests waiting for a pooled connection.',
+    ['alias'], multiprocess_mode='livesum')
+DB_POOL_REQUESTS = Counter(
+    'db_pool_requests_total', 'Connections requested from the pool.', ['alias'])
+DB_POOL_WAIT = Counter(
+    'db_pool_request_wait_seconds_total', 'Time spent waiting for a pooled connection.', ['alias'])
+DB_POOL_ERRORS = Counter(
+    'db_pool_connection_errors_total', 'Failed connection attempts by the pool.', ['alias'])
+DB_POOL_LOST = Counter(
+    'db_pool_connections_lost_total', 'Connections found broken by the checkout health check.', ['alias'])
+
+
+def record_cache(cache_name, hit):
+    """Count a cache lookup; hit ratios are computed from this counter."""
+    CACHE_REQUESTS.labels(cache_name, 'hit' if hit else 'miss').inc()
+
+
+def route_label(request):
+    """Return the URL pattern that matched the request, to keep label cardinality bounded."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.route or match.view_name
+
+
+def update_pool_metrics():
+    """Export the statistics of this process' connection pools."""
+    for connection in connections.all():
+        pool = getattr(connection, 'pool', None)
+        if pool is None:
+            continue
+        alias = connection.alias
+        stats = pool.pop_stats()
+        DB_POOL_SIZE.labels(alias).set(stats.get('pool_size', 0))
+        DB_POOL_AVAILABLE.labels(alias).set(stats.get('pool_available', 0))
+        DB_POOL_WAITING.labels(alias).set(stats.get('requests_waiting', 0))
+        DB_POOL_REQUESTS.labels(alias).inc(stats.get('requests_num', 0))
+        DB_POOL_WAIT.labels(alias).inc(stats.get('requests_wait_ms', 0) / 1000)
+        DB_POOL_ERRORS.labels(alias).inc(stats.get('connections_errors', 0))
+        DB_POOL_LOST.labels(alias).inc(stats.get('connections_lost', 0))
+
+
+def render_metrics():
+    """Return the exposition body and its content type."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def install_execute_wrappers(stack, wrapper_for):
+    """Enter wrapper_for(connection) on every connection of this thread."""
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(wrapper_for(connection)))
+
+
+@asynccontextmanager
+async def request_execute_wrappers(wrapper_for):
+    """Wrap the queries of an async request.
+
+    The async ORM runs queries through sync_to_async(), which under ASGI uses
+    one thread per request. Connections are per thread, so the wrappers are
+    installed on that thread's connections rather than the event loop's.
+    """
+    stack = ExitStack()
+    await sync_to_async(install_execute_wrappers)(stack, wrapper_for)
+    try:
+        yield
+    finally:
+        await sync_to_async(stack.close)()
+
+
+class QueryTimer:
+    """Database execute wrapper that records the duration of every query."""
+
+    def __init__(self):
+        self.durations = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.durations.append(time.perf_counter() - start)
+
+
+class MetricsMiddleware:
+    """Record latency, response size, errors and DB queries for every request."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pool_metrics_updated = 0
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        query_timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            install_execute_wrappers(stack, lambda connection: query_timer)
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, query_timer.durations)
+        return response
+
+    async def __acall__(self, request):
+        query_timer = QueryTimer()
+        start = time.perf_counter()
+        async with request_execute_wrappers(lambda connection: query_timer):
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, query_timer.durations)
+        return response
+
+    def record(self, request, response, duration, query_durations):
+        route = route_label(request)
+        REQUEST_LATENCY.labels(route, request.method).observe(duration)
+        if not response.streaming:
+            RESPONSE_SIZE.labels(route).observe(len(response.content))
+        if response.status_code >= 400:
+            REQUEST_ERRORS.labels(route, request.method, str(response.status_code)).inc()
+        DB_QUERIES_PER_REQUEST.labels(route).observe(len(query_durations))
+        query_histogram = DB_QUERY_DURATION.labels(route)
+        for query_duration in query_durations:
+            query_histogram.observe(query_duration)
+
+        if time.monotonic() - self.pool_metrics_updated >= settings.DB_POOL_METRICS_INTERVAL:
+            self.pool_metrics_updated = time.monotonic()
+            update_pool_metrics()
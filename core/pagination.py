@@ -0,0 +1,135 @@
+"""Pagination without exact COUNT(*) over very large tables.
+
+ApproximateCountPaginator counts at most APPROXIMATE_COUNT_CAP rows, which
+is exact for selective filters and bounded for the rest. An unfiltered
+PostgreSQL table larger than APPROXIMATE_COUNT_THRESHOLD rows is counted
+from pg_class.reltuples instead, and a capped count that hits the cap is
+replaced by the planner's estimate. Pages past an estimated count are
+still served, so every row stays reachable.
+
+It is used by the admin changelists (core/admin.py) and, through
+ApproximateCountPagination, by the API.
+"""
+import json
+
+from django.conf import settings
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+
+def is_unfiltered(queryset):
+    query = queryset.query
+    return not query.where and not query.distinct and query.group_by is None and not query.is_sliced
+
+
+def table_estimate(queryset):
+    """Return PostgreSQL's estimate of the rows in the queryset's table, or -1 if never analyzed.
+
+    A partitioned table has no estimate of its own, so those of its
+    partitions are added up."""
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CASE WHEN t.relkind = 'p' THEN ("
+            "  SELECT coalesce(sum(p.reltuples) FILTER (WHERE p.reltuples >= 0), -1) FROM pg_inherits i"
+            "  JOIN pg_class p ON p.oid = i.inhrelid WHERE i.inhparent = t.oid"
+            ") ELSE t.reltuples END::bigint FROM pg_class t WHERE t.oid = %s::regclass",
+            [connection.ops.quote_name(queryset.model._meta.db_table)],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else -1
+
+
+def planner_estimate(queryset):
+    """Return the PostgreSQL planner's estimate of the rows of queryset."""
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def approximate_count(queryset):
+    """Return (count, exact) for queryset without counting more than APPROXIMATE_COUNT_CAP rows."""
+    postgresql = connections[queryset.db].vendor == 'postgresql'
+    if postgresql and is_unfiltered(queryset):
+        estimate = table_estimate(queryset)
+        if estimate >= settings.APPROXIMATE_COUNT_THRESHOLD:
+            return estimate, False
+    cap = settings.APPROXIMATE_COUNT_CAP
+    count = queryset.order_by().values('pk')[:cap + 1].count()
+    if count <= cap:
+        return count, True
+    if postgresql:
+        return max(planner_estimate(queryset), count), False
+    return count, False
+
+
+class ApproximatePage(Page):
+
+    def has_next(self):
+        if self.paginator.count_is_exact:
+            return super().has_next()
+        return len(self.object_list) == self.paginator.per_page
+
+
+class ApproximateCountPaginator(Paginator):
+    """Paginator whose count is approximate when exact counting would be expensive."""
+    count_is_exact = True
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+        count, self.count_is_exact = approximate_count(self.object_list)
+        return count
+
+    def validate_number(self, number):
+        self.count  # Sets count_is_exact.
+        if self.count_is_exact:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_is_exact:
+            return super().page(number)
+        # The count may be too low, so the last page is not cut at it.
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+    def _get_page(self, *args, **kwargs):
+        return ApproximatePage(*args, **kwargs)
+
+
+class ApproximateCountPagination(PageNumberPagination):
+    """Page-number pagination for the API, opted into with ?page_size=N.
+
+    Without page_size lists stay unpaginated, as before.
+    """
+    django_paginator_class = ApproximateCountPaginator
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_is_exact': self.page.paginator.count_is_exact,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
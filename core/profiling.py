@@ -0,0 +1,232 @@
+"""Sampling profiler hooks for production requests.
+
+A configurable fraction of requests, plus any request carrying a signed
+``X-Profile`` header, is profiled in place. Each profile is written to
+``PROFILER_DIR/requests`` (oldest files are rotated out) and merged into a
+per-view aggregate in ``PROFILER_DIR/views`` that can be fed straight to
+flamegraph.pl or speedscope.
+"""
+import cProfile
+import os
+import pstats
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_TOKEN_SALT = 'core.profiling'
+PROFILE_TOKEN_VALUE = 'profile'
+
+_aggregate_lock = threading.Lock()
+
+
+def make_profile_token():
+    """Return a signed value for the X-Profile header."""
+    return signing.TimestampSigner(salt=PROFILE_TOKEN_SALT).sign(PROFILE_TOKEN_VALUE)
+
+
+def is_valid_profile_token(token):
+    """Check a X-Profile header value against the signing key and max age."""
+    try:
+        value = signing.TimestampSigner(salt=PROFILE_TOKEN_SALT).unsign(
+            token, max_age=settings.PROFILER_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return value == PROFILE_TOKEN_VALUE
+
+
+class StackSampler:
+    """Samples the call stack of one thread at a fixed interval."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+
+def read_collapsed(path):
+    """Read a collapsed-stack file into a Counter."""
+    stacks = Counter()
+    if os.path.exists(path):
+        with open(path) as collapsed_file:
+            for line in collapsed_file:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    stacks[stack] += int(count)
+    return stacks
+
+
+def write_collapsed(stacks, path):
+    """Atomically write a Counter of stacks in collapsed-stack format."""
+    directory = os.path.dirname(path)
+    with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as tmp_file:
+        for stack, count in stacks.most_common():
+            tmp_file.write(f"{stack} {count}\n")
+    os.replace(tmp_file.name, path)
+
+
+def rotate_files(directory, max_files):
+    """Delete the oldest files in directory so that at most max_files remain."""
+    entries = [os.path.join(directory, name) for name in os.listdir(directory)]
+    if len(entries) <= max_files:
+        return
+    entries.sort(key=os.path.getmtime)
+    for path in entries[:len(entries) - max_files]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ProfilingMiddleware:
+    """Profile sampled or explicitly requested requests.
+
+    When PROFILER_ENABLED is off the middleware removes itself from the
+    chain, so there is no cost at all; when it is on, unprofiled requests
+    pay for one random() call and one header lookup.
+
+    Under ASGI the profile covers the event loop thread, so it also holds
+    whatever other requests the loop ran in the meantime, and only one
+    request is profiled at a time.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILER_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.profiling_loop = False
+        self.sample_rate = settings.PROFILER_SAMPLE_RATE
+        self.output_format = settings.PROFILER_FORMAT
+        self.requests_dir = os.path.join(settings.PROFILER_DIR, 'requests')
+        self.views_dir = os.path.join(settings.PROFILER_DIR, 'views')
+        os.makedirs(self.requests_dir, exist_ok=True)
+        os.makedirs(self.views_dir, exist_ok=True)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        stop = self.start_profile()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile = stop()
+        self.save_profile(request, profile)
+        return response
+
+    async def __acall__(self, request):
+        if self.profiling_loop or not self.should_profile(request):
+            return await self.get_response(request)
+
+        self.profiling_loop = True
+        stop = self.start_profile()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile = stop()
+            self.profiling_loop = False
+        await sync_to_async(self.save_profile)(request, profile)
+        return response
+
+    def start_profile(self):
+        """Start profiling this thread; return a function that stops and returns the profile."""
+        if self.output_format == 'pstats':
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+            def stop():
+                profiler.disable()
+                return profiler
+        else:
+            sampler = StackSampler(threading.get_ident(), settings.PROFILER_INTERVAL)
+            sampler.start()
+
+            def stop():
+                sampler.stop()
+                return sampler.stacks
+        return stop
+
+    def save_profile(self, request, profile):
+        if self.output_format == 'pstats':
+            self.save_pstats(request, profile)
+        else:
+            self.save_collapsed(request, profile)
+
+    def should_profile(self, request):
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        token = request.META.get(PROFILE_HEADER)
+        return bool(token) and is_valid_profile_token(token)
+
+    def view_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unresolved'
+        return match.view_name or match._func_path
+
+    def request_file_path(self, view_name, extension):
+        filename = f"{time.time_ns()}-{os.getpid()}-{view_name.replace(':', '.')}.{extension}"
+        return os.path.join(self.requests_dir, filename)
+
+    def save_collapsed(self, request, stacks):
+        if not stacks:
+            return
+        view_name = self.view_name(request)
+        write_collapsed(stacks, self.request_file_path(view_name, 'collapsed'))
+        aggregate_path = os.path.join(self.views_dir, f"{view_name.replace(':', '.')}.collapsed")
+        with _aggregate_lock:
+            aggregate = read_collapsed(aggregate_path)
+            aggregate.update(stacks)
+            write_collapsed(aggregate, aggregate_path)
+        rotate_files(self.requests_dir, settings.PROFILER_MAX_FILES)
+
+    def save_pstats(self, request, profiler):
+        view_name = self.view_name(request)
+        profiler.dump_stats(self.request_file_path(view_name, 'pstats'))
+        aggregate_path = os.path.join(self.views_dir, f"{view_name.replace(':', '.')}.pstats")
+        with _aggregate_lock:
+            stats = pstats.Stats(profiler)
+            if os.path.exists(aggregate_path):
+                stats.add(aggregate_path)
+            stats.dump_stats(aggregate_path)
+        rotate_files(self.requests_dir, settings.PROFILER_MAX_FILES)
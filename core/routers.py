@@ -0,0 +1,139 @@
+"""Primary/replica database routing with read-your-writes stickiness.
+
+Reads go to a random replica from DATABASE_REPLICAS whose replication lag is
+under REPLICA_MAX_LAG seconds, and to the primary otherwise. Once a request
+writes, its remaining reads use the primary. ReplicaPinningMiddleware also
+pins the client (identified by its token or session cookie) to the primary
+for READ_YOUR_WRITES_WINDOW seconds, so a follow-up GET sees the post, like,
+follow or profile edit it has just made.
+"""
+import contextvars
+import hashlib
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+
+PRIMARY_ALIAS = 'default'
+PIN_CACHE_PREFIX = 'replica-pin'
+
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+_pinned = contextvars.ContextVar('pinned_to_primary', default=False)
+_wrote = contextvars.ContextVar('wrote_to_primary', default=False)
+_lag_cache = {}
+
+
+def measure_lag(alias):
+    """Return the replication lag of a replica in seconds."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(REPLICA_LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+def replica_lag(alias):
+    """Return the lag of a replica, measured at most every REPLICA_LAG_CHECK_INTERVAL seconds.
+
+    A replica that cannot be reached is reported with infinite lag.
+    """
+    checked_at, lag = _lag_cache.get(alias, (None, 0))
+    now = time.monotonic()
+    if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return lag
+    try:
+        lag = measure_lag(alias)
+    except DatabaseError:
+        lag = float('inf')
+    _lag_cache[alias] = (now, lag)
+    return lag
+
+
+def client_pin_key(request):
+    """Return the cache key pinning this client to the primary, or None for anonymous clients."""
+    credential = (request.META.get('HTTP_AUTHORIZATION')
+                  or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not credential:
+        return None
+    digest = hashlib.sha256(credential.encode()).hexdigest()
+    return f"{PIN_CACHE_PREFIX}:{digest}"
+
+
+class PrimaryReplicaRouter:
+    """Send writes to the primary and reads to a healthy replica."""
+
+    def db_for_read(self, model, **hints):
+        if _pinned.get() or _wrote.get():
+            return PRIMARY_ALIAS
+        replicas = [
+            alias for alias in settings.DATABASE_REPLICAS
+            if replica_lag(alias) <= settings.REPLICA_MAX_LAG
+        ]
+        if not replicas:
+            return PRIMARY_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return PRIMARY_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive schema changes through replication.
+        return db == PRIMARY_ALIAS
+
+
+class ReplicaPinningMiddleware:
+    """Keep a client's reads on the primary for a while after it writes."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        pin_key = client_pin_key(request)
+        pinned_token = _pinned.set(bool(pin_key and cache.get(pin_key)))
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if pin_key and _wrote.get():
+                cache.set(pin_key, True, settings.READ_YOUR_WRITES_WINDOW)
+        finally:
+            _pinned.reset(pinned_token)
+            _wrote.reset(wrote_token)
+        return response
+
+    async def __acall__(self, request):
+        # Queries run through sync_to_async(), which copies the context
+        # variables set by db_for_write() back into this one.
+        pin_key = client_pin_key(request)
+        pinned_token = _pinned.set(bool(pin_key and await cache.aget(pin_key)))
+        wrote_token = _wrote.set(False)
+        try:
+            response = await self.get_response(request)
+            if pin_key and _wrote.get():
+                await cache.aset(pin_key, True, settings.READ_YOUR_WRITES_WINDOW)
+        finally:
+            _pinned.reset(pinned_token)
+            _wrote.reset(wrote_token)
+        return response
@@ -0,0 +1,231 @@
+"""Slow query log with deferred EXPLAIN capture.
+
+Queries slower than SLOW_QUERY_THRESHOLD seconds are captured together with
+their bind parameters and the view that issued them. The EXPLAIN runs later
+on a background thread, using that thread's own connection, so the request
+never waits for it. Captures are stored in a fixed number of slot files
+under SLOW_QUERY_DIR, and the oldest capture is overwritten once the ring
+is full.
+
+Bind parameters and query string values hold personal data such as emails,
+search terms and token keys. They are kept in memory only until the EXPLAIN
+has run. On disk, and therefore in the admin, each parameter is reduced to
+its type (and length, for strings), the query string to its keys, and the
+string literals that PostgreSQL prints in plan filters to ''.
+"""
+import fcntl
+import json
+import logging
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from .metrics import install_execute_wrappers, request_execute_wrappers
+
+logger = logging.getLogger(__name__)
+
+# A quoted SQL literal, with '' for a quote inside it.
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN (ANALYZE, BUFFERS) ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+
+class SlowQueryRing:
+    """Bounded on-disk ring of slow query captures shared by all workers."""
+
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = size
+
+    def _slot_path(self, slot):
+        return os.path.join(self.directory, f"slot-{slot:05d}.json")
+
+    def _next_sequence(self):
+        # The counter file is locked so concurrent workers never claim the same slot.
+        with open(os.path.join(self.directory, 'sequence'), 'a+') as sequence_file:
+            fcntl.flock(sequence_file, fcntl.LOCK_EX)
+            sequence_file.seek(0)
+            sequence = int(sequence_file.read() or 0)
+            sequence_file.seek(0)
+            sequence_file.truncate()
+            sequence_file.write(str(sequence + 1))
+        return sequence
+
+    def append(self, capture):
+        os.makedirs(self.directory, exist_ok=True)
+        sequence = self._next_sequence()
+        capture = dict(capture, sequence=sequence)
+        with tempfile.NamedTemporaryFile('w', dir=self.directory, delete=False) as tmp_file:
+            json.dump(capture, tmp_file, default=str)
+        os.replace(tmp_file.name, self._slot_path(sequence % self.size))
+
+    def entries(self):
+        """Return the stored captures, newest first."""
+        captures = []
+        for slot in range(self.size):
+            try:
+                with open(self._slot_path(slot)) as slot_file:
+                    captures.append(json.load(slot_file))
+            except (FileNotFoundError, ValueError):
+                continue
+        return sorted(captures, key=lambda capture: capture['sequence'], reverse=True)
+
+
+def get_ring():
+    return SlowQueryRing(settings.SLOW_QUERY_DIR, settings.SLOW_QUERY_RING_SIZE)
+
+
+def explain(capture):
+    """Run EXPLAIN for a captured SELECT on the alias it was executed on."""
+    sql = capture['sql']
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    connection = connections[capture['alias']]
+    prefix = EXPLAIN_PREFIXES.get(connection.vendor, 'EXPLAIN ')
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, capture['params'])
+        plan = '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    # Plans show the parameters inlined, e.g. Filter: (text ~~ '%term%'::text).
+    return STRING_LITERAL.sub("''", plan)
+
+
+def describe_param(value):
+    """Return the type of a bind parameter, with the length of strings and bytes."""
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def redact_params(params):
+    if isinstance(params, dict):
+        return {name: describe_param(value) for name, value in params.items()}
+    return [describe_param(value) for value in params]
+
+
+def redacted_path(request):
+    """Return the request path with the values of its query string left out."""
+    if not request.GET:
+        return request.path
+    return request.path + '?' + '&'.join(f"{key}=" for key in request.GET)
+
+
+def explain_and_store(capture):
+    try:
+        capture['explain'] = explain(capture)
+    except Exception as e:
+        capture['explain'] = f"EXPLAIN failed: {e}"
+    capture['params'] = redact_params(capture['params'])
+    get_ring().append(capture)
+
+
+class ExplainWorker:
+    """Background thread that explains and stores captures off the request path."""
+
+    def __init__(self, max_pending=100):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, capture):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        try:
+            self.queue.put_nowait(capture)
+        except queue.Full:
+            logger.warning("Slow query backlog is full, dropping capture of %s.", capture['view'])
+
+    def _run(self):
+        while True:
+            capture = self.queue.get()
+            close_old_connections()
+            try:
+                explain_and_store(capture)
+            except Exception:
+                logger.exception("Could not store slow query capture.")
+
+
+explain_worker = ExplainWorker()
+
+
+class SlowQueryRecorder:
+    """Database execute wrapper that keeps queries over the threshold."""
+
+    def __init__(self, alias, threshold):
+        self.alias = alias
+        self.threshold = threshold
+        self.captures = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            if duration >= self.threshold and not many:
+                self.captures.append({
+                    'alias': self.alias,
+                    'sql': sql,
+                    'params': params if isinstance(params, dict) else list(params or ()),
+                    'duration': duration,
+                    'captured_at': timezone.now().isoformat(timespec='seconds'),
+                })
+
+
+class SlowQueryMiddleware:
+    """Capture slow queries of each request and hand them to the explain worker."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        recorders = []
+        with ExitStack() as stack:
+            install_execute_wrappers(stack, self.recorder_factory(recorders))
+            response = self.get_response(request)
+        self.submit(request, recorders)
+        return response
+
+    async def __acall__(self, request):
+        recorders = []
+        async with request_execute_wrappers(self.recorder_factory(recorders)):
+            response = await self.get_response(request)
+        self.submit(request, recorders)
+        return response
+
+    def recorder_factory(self, recorders):
+        threshold = settings.SLOW_QUERY_THRESHOLD
+
+        def recorder_for(connection):
+            recorder = SlowQueryRecorder(connection.alias, threshold)
+            recorders.append(recorder)
+            return recorder
+        return recorder_for
+
+    def submit(self, request, recorders):
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else 'unresolved'
+        for recorder in recorders:
+            for capture in recorder.captures:
+                capture.update(view=view_name, path=redacted_path(request))
+                explain_worker.submit(capture)
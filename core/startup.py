@@ -0,0 +1,39 @@
+"""Warm-up of a freshly loaded app before it serves requests.
+
+Django imports views, DRF settings classes and Pillow on first use, so
+the first requests of a new worker are slow. warm_up() does that work up
+front. With gunicorn's preload_app it runs once in the master, before the
+workers fork, so they start warm and share the imported modules'
+memory (see gunicorn.conf.py). Otherwise each worker runs it after loading
+the app.
+"""
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """Import what requests would import lazily; return the seconds taken.
+
+    Must not open database connections or start threads, since it may run
+    in the gunicorn master before forking.
+    """
+    start = time.perf_counter()
+
+    from django.urls import get_resolver
+    from rest_framework.settings import api_settings
+
+    # Imports every view and builds the reverse lookup tables.
+    get_resolver().reverse_dict
+    for setting in ('DEFAULT_AUTHENTICATION_CLASSES', 'DEFAULT_PERMISSION_CLASSES',
+                    'DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES'):
+        getattr(api_settings, setting)
+
+    # Deferred by user.models so that management commands do not pay for it.
+    from PIL import Image
+    Image.preinit()
+
+    elapsed = time.perf_counter() - start
+    logger.info("App warmed up in %.0f ms.", elapsed * 1000)
+    return elapsed
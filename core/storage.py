@@ -0,0 +1,96 @@
+"""Storage backends for media files.
+
+Media files are addressed by relative keys (e.g. 'post_images/3f/a2/<hex>.jpg')
+and only accessed through the storage API, so the backend set in
+STORAGES['default'] can be swapped: Django's FileSystemStorage under
+MEDIA_ROOT, an S3-compatible backend such as django-storages'
+S3Storage, or LocalObjectStorage below for development and tests.
+"""
+import os
+import tempfile
+from datetime import datetime, timezone
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.encoding import filepath_to_uri
+
+
+@deconstructible
+class LocalObjectStorage(Storage):
+    """Local stand-in with the semantics of an S3-compatible object store.
+
+    Keys are opaque strings, writes replace an object atomically (a key is
+    never renamed to avoid a collision) and there is no local path, so code
+    that works against it does not depend on local disk.
+    """
+
+    def __init__(self, location=None, base_url=None):
+        self._location = location
+        self._base_url = base_url
+
+    @property
+    def location(self):
+        return os.path.abspath(self._location or settings.OBJECT_STORAGE_ROOT)
+
+    @property
+    def base_url(self):
+        return self._base_url or settings.MEDIA_URL
+
+    def _object_path(self, name):
+        if not name or name.startswith('/') or '..' in name.split('/'):
+            raise SuspiciousFileOperation(f"Invalid object key {name!r}.")
+        return os.path.join(self.location, *name.split('/'))
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode:
+            raise ValueError("Objects are written with save().")
+        return File(open(self._object_path(name), mode), name=name)
+
+    def _save(self, name, content):
+        path = self._object_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    temp_file.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        # Like S3, writing to an existing key overwrites it.
+        return name
+
+    def delete(self, name):
+        try:
+            os.remove(self._object_path(name))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, name):
+        return os.path.isfile(self._object_path(name))
+
+    def listdir(self, path):
+        directory = self._object_path(path) if path else self.location
+        directories, files = [], []
+        for entry in os.scandir(directory):
+            if entry.name.startswith('.upload-'):
+                continue
+            (directories if entry.is_dir() else files).append(entry.name)
+        return directories, files
+
+    def size(self, name):
+        return os.path.getsize(self._object_path(name))
+
+    def url(self, name):
+        return urljoin(self.base_url, filepath_to_uri(name))
+
+    def get_modified_time(self, name):
+        return datetime.fromtimestamp(os.path.getmtime(self._object_path(name)), tz=timezone.utc)
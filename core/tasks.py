@@ -0,0 +1,37 @@
+"""Minimal in-process background jobs.
+
+Jobs run on a small thread pool once the current transaction commits. They
+keep their own progress in the database, so a job interrupted by a restart
+is picked up again by its management command. With BACKGROUND_TASKS_EAGER
+on (as in tests) jobs run immediately in the calling thread.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return ThreadPoolExecutor(max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix='background')
+
+
+def _run(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception("Background job %s failed.", func.__qualname__)
+    finally:
+        connections.close_all()
+
+
+def run_in_background(func, *args, **kwargs):
+    """Run func(*args, **kwargs) on the background pool after the current transaction commits."""
+    if settings.BACKGROUND_TASKS_EAGER:
+        func(*args, **kwargs)
+        return
+    transaction.on_commit(lambda: get_executor().submit(_run, func, args, kwargs))
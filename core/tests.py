@@ -1,3 +1,482 @@
-from django.test import TestCase
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+
+from . import compression
+from .compression import CompressionMiddleware, accepted_encodings, get_compressed_cache
+from .metrics import MetricsMiddleware, record_cache, update_pool_metrics
+from .pagination import ApproximateCountPaginator, planner_estimate
+from .profiling import ProfilingMiddleware, make_profile_token, read_collapsed
+from .routers import PrimaryReplicaRouter, ReplicaPinningMiddleware
+from .startup import warm_up
+from .storage import LocalObjectStorage
+from .slow_queries import SlowQueryMiddleware, SlowQueryRing, explain_and_store, get_ring
+
+
+def slow_view(request):
+    time.sleep(0.05)
+    return HttpResponse('ok')
+
+
+async def async_slow_view(request):
+    time.sleep(0.05)
+    return HttpResponse('ok')
+
+
+class ProfilingMiddlewareTests(SimpleTestCase):
+    """Tests for the sampling profiler middleware."""
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        self.factory = RequestFactory()
+
+    def _middleware(self, view=slow_view, **overrides):
+        options = {
+            'PROFILER_ENABLED': True,
+            'PROFILER_SAMPLE_RATE': 0,
+            'PROFILER_DIR': self.profile_dir,
+            'PROFILER_INTERVAL': 0.001,
+            'PROFILER_FORMAT': 'collapsed',
+        }
+        options.update(overrides)
+        with override_settings(**options):
+            return ProfilingMiddleware(view)
+
+    def _request_files(self):
+        return os.listdir(os.path.join(self.profile_dir, 'requests'))
+
+    def test_disabled_middleware_is_not_used(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            self._middleware(PROFILER_ENABLED=False)
+
+    def test_unsampled_request_is_not_profiled(self):
+        middleware = self._middleware()
+        middleware(self.factory.get('/'))
+        self.assertEqual(self._request_files(), [])
+
+    def test_sampled_request_writes_collapsed_stacks(self):
+        middleware = self._middleware(PROFILER_SAMPLE_RATE=1)
+        middleware(self.factory.get('/'))
+        middleware(self.factory.get('/'))
+        self.assertEqual(len(self._request_files()), 2)
+        aggregate = read_collapsed(os.path.join(self.profile_dir, 'views', 'unresolved.collapsed'))
+        self.assertTrue(any('slow_view' in stack for stack in aggregate))
+
+    def test_signed_header_is_profiled(self):
+        middleware = self._middleware()
+        middleware(self.factory.get('/', HTTP_X_PROFILE=make_profile_token()))
+        self.assertEqual(len(self._request_files()), 1)
+
+    def test_forged_header_is_ignored(self):
+        middleware = self._middleware()
+        middleware(self.factory.get('/', HTTP_X_PROFILE='profile:forged:signature'))
+        self.assertEqual(self._request_files(), [])
+
+    def test_async_request_is_profiled_on_the_event_loop(self):
+        middleware = self._middleware(async_slow_view, PROFILER_SAMPLE_RATE=1)
+        self.assertTrue(iscoroutinefunction(middleware))
+        async_to_sync(middleware)(AsyncRequestFactory().get('/'))
+        self.assertEqual(len(self._request_files()), 1)
+        aggregate = read_collapsed(os.path.join(self.profile_dir, 'views', 'unresolved.collapsed'))
+        self.assertTrue(any('async_slow_view' in stack for stack in aggregate))
+
+    def test_request_files_are_rotated(self):
+        middleware = self._middleware(PROFILER_SAMPLE_RATE=1, PROFILER_FORMAT='pstats')
+        with override_settings(PROFILER_MAX_FILES=2):
+            for _ in range(4):
+                middleware(self.factory.get('/'))
+        self.assertEqual(len(self._request_files()), 2)
+        self.assertTrue(os.path.exists(os.path.join(self.profile_dir, 'views', 'unresolved.pstats')))
+
+
+@override_settings(METRICS_TOKEN='scrape-secret', METRICS_ALLOWED_IPS=['10.0.0.0/8'])
+class MetricsEndpointTests(TestCase):
+    """Tests for the Prometheus metrics endpoint."""
+    def _scrape(self, token='scrape-secret'):
+        return self.client.get(reverse('metrics'), HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_metrics_require_token_or_allowed_address(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self._scrape('wrong').status_code, 403)
+        forwarded = self.client.get(reverse('metrics'), HTTP_X_FORWARDED_FOR='10.1.2.3')
+        self.assertEqual(forwarded.status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.1.2.3').status_code, 200)
+        self.assertEqual(self._scrape().status_code, 200)
+        with override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=[]):
+            self.assertEqual(self._scrape('').status_code, 403)
+
+    def test_metrics_report_request_latency_and_errors(self):
+        self.client.post(reverse('user-registration'), {'email': 'bad'})
+        response = self._scrape()
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('http_request_duration_seconds_bucket{le="0.005",method="POST",route="api/register/"}', body)
+        self.assertIn('http_request_errors_total{method="POST",route="api/register/",status="400"}', body)
+        self.assertIn('db_queries_per_request_bucket', body)
+
+    def test_async_requests_count_their_queries(self):
+        async def view(request):
+            await get_user_model().objects.acount()
+            return HttpResponse('ok')
+
+        def queries():
+            return REGISTRY.get_sample_value('db_queries_per_request_sum', {'route': 'unresolved'}) or 0
+
+        middleware = MetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        before = queries()
+        async_to_sync(middleware)(AsyncRequestFactory().get('/'))
+        self.assertEqual(queries() - before, 1)
+
+    def test_metrics_report_cache_lookups(self):
+        record_cache('test-cache', hit=True)
+        body = self._scrape().content.decode()
+        self.assertIn('cache_requests_total{cache="test-cache",result="hit"}', body)
+
+    def test_metrics_report_pool_statistics(self):
+        pooled_connection = mock.Mock(alias='pooled')
+        pooled_connection.pool.pop_stats.return_value = {
+            'pool_size': 4, 'pool_available': 3, 'requests_num': 7, 'requests_wait_ms': 1500,
+        }
+        with mock.patch('core.metrics.connections') as connections:
+            connections.all.return_value = [pooled_connection, mock.Mock(pool=None)]
+            update_pool_metrics()
+        body = self._scrape().content.decode()
+        self.assertIn('db_pool_size{alias="pooled"} 4.0', body)
+        self.assertIn('db_pool_available{alias="pooled"} 3.0', body)
+        self.assertIn('db_pool_request_wait_seconds_total{alias="pooled"} 1.5', body)
+
+
+class SlowQueryLogTests(TestCase):
+    """Tests for the slow query recorder and its on-disk ring."""
+    def setUp(self):
+        self.slow_query_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.slow_query_dir)
+        settings_override = override_settings(SLOW_QUERY_DIR=self.slow_query_dir, SLOW_QUERY_RING_SIZE=3)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_ring_keeps_newest_captures(self):
+        ring = SlowQueryRing(self.slow_query_dir, 3)
+        for i in range(5):
+            ring.append({'sql': f'SELECT {i}'})
+        self.assertEqual([capture['sql'] for capture in ring.entries()], ['SELECT 4', 'SELECT 3', 'SELECT 2'])
+
+    def test_queries_over_threshold_are_submitted(self):
+        def view(request):
+            list(get_user_model().objects.filter(email='user@example.com'))
+            return HttpResponse('ok')
+
+        with override_settings(SLOW_QUERY_THRESHOLD=0), \
+                mock.patch('core.slow_queries.explain_worker.submit') as submit:
+            SlowQueryMiddleware(view)(RequestFactory().get('/api/feed/?text__icontains=x'))
+        capture = submit.call_args.args[0]
+        self.assertIn('SELECT', capture['sql'])
+        self.assertEqual(capture['params'], ['user@example.com'])
+        self.assertEqual(capture['path'], '/api/feed/?text__icontains=')
+
+    def test_queries_of_async_views_are_submitted(self):
+        async def view(request):
+            await get_user_model().objects.filter(email='user@example.com').aexists()
+            return HttpResponse('ok')
+
+        middleware = SlowQueryMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with override_settings(SLOW_QUERY_THRESHOLD=0), \
+                mock.patch('core.slow_queries.explain_worker.submit') as submit:
+            async_to_sync(middleware)(AsyncRequestFactory().get('/'))
+        self.assertIn('user@example.com', submit.call_args.args[0]['params'])
+
+    def test_queries_under_threshold_are_ignored(self):
+        def view(request):
+            get_user_model().objects.count()
+            return HttpResponse('ok')
+
+        with mock.patch('core.slow_queries.explain_worker.submit') as submit:
+            SlowQueryMiddleware(view)(RequestFactory().get('/'))
+        submit.assert_not_called()
+
+    def test_capture_is_explained_and_shown_in_admin(self):
+        explain_and_store({
+            'alias': 'default', 'sql': 'SELECT id FROM user_post WHERE text LIKE %s',
+            'params': ['%secret%'], 'duration': 1.5, 'view': 'posts-list', 'path': '/api/posts/',
+            'captured_at': '2026-01-01T00:00:00+00:00',
+        })
+        capture = get_ring().entries()[0]
+        self.assertTrue(capture['explain'])
+        self.assertNotIn('EXPLAIN failed', capture['explain'])
+        self.assertEqual(capture['params'], ['str[8]'])
+
+        admin_user = get_user_model().objects.create_user(email='admin@example.com', password='password')
+        admin_user.is_staff = True
+        admin_user.save()
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin-slow-queries'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'posts-list')
+        self.assertNotContains(response, 'secret')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_MAX_LAG=5, READ_YOUR_WRITES_WINDOW=10)
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    """Tests for replica routing and read-your-writes stickiness."""
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        cache.clear()
+        lag_patcher = mock.patch('core.routers.replica_lag', return_value=0)
+        self.replica_lag = lag_patcher.start()
+        self.addCleanup(lag_patcher.stop)
+
+    def _request(self, token='Token abc', write=False):
+        reads = []
+
+        def view(request):
+            if write:
+                self.router.db_for_write(None)
+            reads.append(self.router.db_for_read(None))
+            return HttpResponse('ok')
+
+        ReplicaPinningMiddleware(view)(self.factory.get('/', HTTP_AUTHORIZATION=token))
+        return reads[0]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self._request(), 'replica')
+
+    def test_writes_go_to_primary(self):
+        self.assertEqual(self.router.db_for_write(None), 'default')
+
+    def test_reads_after_write_in_same_request_use_primary(self):
+        self.assertEqual(self._request(write=True), 'default')
+
+    def test_client_is_pinned_to_primary_after_write(self):
+        self._request(write=True)
+        self.assertEqual(self._request(), 'default')
+        self.assertEqual(self._request(token='Token other'), 'replica')
+
+    def test_async_write_pins_client_to_primary(self):
+        async def view(request):
+            await sync_to_async(self.router.db_for_write)(None)
+            return HttpResponse(self.router.db_for_read(None))
+
+        middleware = ReplicaPinningMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(AsyncRequestFactory().get('/', headers={'Authorization': 'Token abc'}))
+        self.assertEqual(response.content, b'default')
+        self.assertEqual(self._request(), 'default')
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        self.replica_lag.return_value = 30
+        self.assertEqual(self._request(), 'default')
+
+
+class LocalObjectStorageTests(SimpleTestCase):
+    """Tests for the local stand-in for S3-compatible object storage."""
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.storage = LocalObjectStorage(location=root, base_url='/media/')
+
+    def test_save_open_and_overwrite(self):
+        name = 'post_images/ab/cd/object.jpg'
+        self.assertEqual(self.storage.save(name, ContentFile(b'first')), name)
+        self.assertEqual(self.storage.save(name, ContentFile(b'second')), name)
+        with self.storage.open(name) as stored:
+            self.assertEqual(stored.read(), b'second')
+        self.assertEqual(self.storage.size(name), 6)
+        self.assertEqual(self.storage.url(name), '/media/post_images/ab/cd/object.jpg')
+        self.assertEqual(self.storage.listdir('post_images/ab/cd'), ([], ['object.jpg']))
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+    def test_has_no_local_paths(self):
+        with self.assertRaises(NotImplementedError):
+            self.storage.path('post_images/object.jpg')
+
+    def test_rejects_keys_outside_the_bucket(self):
+        with self.assertRaises(SuspiciousFileOperation):
+            self.storage.save('../outside.jpg', ContentFile(b'data'))
+
+
+@override_settings(APPROXIMATE_COUNT_CAP=5)
+class ApproximateCountPaginationTests(TestCase):
+    """Tests for the capped-count paginator used by the admin and the API."""
+    def setUp(self):
+        from user.models import Post
+        self.user = get_user_model().objects.create_user(email='user@example.com', password='password')
+        Post.objects.bulk_create(Post(user=self.user, text=f'Post {i}') for i in range(8))
+        self.posts = Post.objects.order_by('id')
+
+    def _capped_count(self, queryset):
+        # Counting stops at the cap plus one row, and PostgreSQL replaces
+        # such a count with the planner's estimate when that is higher.
+        if connection.vendor == 'postgresql':
+            return max(planner_estimate(queryset), 6)
+        return 6
+
+    def test_small_results_are_counted_exactly(self):
+        paginator = ApproximateCountPaginator(self.posts.filter(text='Post 1'), 2)
+        self.assertEqual(paginator.count, 1)
+        self.assertTrue(paginator.count_is_exact)
+
+    def test_large_results_are_capped(self):
+        paginator = ApproximateCountPaginator(self.posts, 3)
+        self.assertEqual(paginator.count, self._capped_count(self.posts))
+        self.assertFalse(paginator.count_is_exact)
+        # Rows past the capped count stay reachable.
+        last_page = paginator.page(3)
+        self.assertEqual([post.text for post in last_page], ['Post 6', 'Post 7'])
+        self.assertFalse(last_page.has_next())
+        self.assertTrue(paginator.page(2).has_next())
+
+    def test_api_pagination_is_opt_in(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(len(client.get('/api/posts/').data), 8)
+        response = client.get('/api/posts/', {'page_size': 3, 'page': 3})
+        self.assertEqual(response.data['count'], self._capped_count(self.posts))
+        self.assertFalse(response.data['count_is_exact'])
+        self.assertEqual([post['text'] for post in response.data['results']], ['Post 6', 'Post 7'])
+        self.assertIsNone(response.data['next'])
+
+    def test_admin_changelists(self):
+        self.user.is_staff = True
+        self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.get('/admin/user/user/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_list[0].post_count, 8)
+        response = self.client.get('/admin/user/post/', {'q': 'Post'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, self._capped_count(response.context['cl'].queryset))
+        self.assertEqual(response.context['cl'].result_list[0].like_count, 0)
+
+
+class StartupTests(SimpleTestCase):
+    """Tests for deferred imports and the worker warm-up."""
+
+    def test_loading_the_app_does_not_import_pillow(self):
+        script = 'import sys; from app.wsgi import application; import app.urls; print("PIL" in sys.modules)'
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                cwd=settings.BASE_DIR)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_warm_up_imports_views_and_pillow(self):
+        self.assertGreater(warm_up(), 0)
+        self.assertIn('PIL.Image', sys.modules)
+        self.assertIn('user.views', sys.modules)
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+    """Tests for negotiated response compression."""
+    body = b'{"text": "A post about compression."}' * 100
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        get_compressed_cache().clear()
+        self.addCleanup(get_compressed_cache().clear)
+
+    def _get(self, response, accept_encoding='gzip, deflate'):
+        middleware = CompressionMiddleware(lambda request: response)
+        return middleware(self.factory.get('/', HTTP_ACCEPT_ENCODING=accept_encoding))
+
+    def _json(self, body=None):
+        return HttpResponse(self.body if body is None else body, content_type='application/json')
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip;q=0.5, br;q=0, identity'), {'gzip', 'identity'})
+        self.assertEqual(accepted_encodings(''), set())
+
+    @mock.patch.object(compression, 'brotli', None)
+    def test_gzip_round_trip(self):
+        response = self._get(self._json())
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), self.body)
+
+    def test_small_and_binary_bodies_are_not_compressed(self):
+        self.assertFalse(self._get(self._json(b'{}')).has_header('Content-Encoding'))
+        image = HttpResponse(self.body, content_type='image/jpeg')
+        self.assertFalse(self._get(image).has_header('Content-Encoding'))
+
+    def test_html_is_not_compressed(self):
+        # HTML pages carry CSRF tokens next to reflected input (BREACH).
+        page = HttpResponse(b'<p>A post about compression.</p>' * 100, content_type='text/html; charset=utf-8')
+        response = self._get(page)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('Vary'))
+
+    @mock.patch.object(compression, 'brotli', None)
+    def test_cache_key_includes_content_type(self):
+        text = b'A post about compression. ' * 100
+        json_response, plain = self._json(), HttpResponse(text, content_type='text/plain')
+        json_response['ETag'] = plain['ETag'] = '"shared"'
+        self._get(json_response)
+        self.assertEqual(gzip.decompress(self._get(plain).content), text)
+
+    @mock.patch.object(compression, 'brotli', None)
+    def test_async_response_is_compressed(self):
+        async def view(request):
+            return self._json()
+
+        middleware = CompressionMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(AsyncRequestFactory().get('/', headers={'Accept-Encoding': 'gzip'}))
+        self.assertEqual(gzip.decompress(response.content), self.body)
+
+    def test_refused_encodings_are_respected(self):
+        for accept_encoding in ('', 'identity', 'gzip;q=0, br;q=0'):
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self._get(self._json(), accept_encoding)
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertEqual(response.content, self.body)
+                self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_compressed_bodies_are_cached_by_etag(self):
+        with mock.patch.object(compression, 'compress', wraps=compression.compress) as compress:
+            first = self._get(self._json())
+            second = self._get(self._json())
+            self._get(self._json(self.body + b' '))
+        self.assertEqual(compress.call_count, 2)
+        self.assertEqual(first.content, second.content)
+
+    @mock.patch.object(compression, 'brotli', None)
+    def test_streaming_response_is_compressed_per_chunk(self):
+        chunks = [b'data: %d\n\n' % number for number in range(50)]
+        response = self._get(StreamingHttpResponse(iter(chunks), content_type='text/event-stream'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        pieces = list(response.streaming_content)
+        self.assertGreater(len(pieces), 1)
+        # Each flushed piece decompresses on its own, so events are not held back.
+        decompressor = compression.zlib.decompressobj(31)
+        self.assertEqual(decompressor.decompress(pieces[0]), chunks[0])
+        self.assertEqual(gzip.decompress(b''.join(pieces)), b''.join(chunks))
+
+    @skipUnless(compression.brotli, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        response = self._get(self._json(), 'gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(response.content), self.body)
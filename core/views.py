@@ -1,3 +1,44 @@
+import hmac
+import ipaddress
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.contrib import admin
 from django.shortcuts import render
+from django.views.decorators.http import require_GET
+
+from .metrics import render_metrics
+from .slow_queries import get_ring
+
+
+def is_metrics_scraper(request):
+    """Check the request's bearer token or its address against the metrics settings."""
+    token = settings.METRICS_TOKEN
+    scheme, _, credential = request.headers.get('Authorization', '').partition(' ')
+    if token and scheme.lower() == 'bearer' and hmac.compare_digest(credential.encode(), token.encode()):
+        return True
+    # REMOTE_ADDR only: forwarded headers can be set by anyone.
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_IPS)
+
+
+@require_GET
+def metrics_view(request):
+    """Expose metrics in the Prometheus text format to configured scrapers."""
+    if not is_metrics_scraper(request):
+        return HttpResponseForbidden()
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
+
 
-# Create your views here.
+def slow_query_list_view(request):
+    """Admin page listing captured slow queries, newest first."""
+    context = dict(
+        admin.site.each_context(request),
+        title='Slow queries',
+        captures=get_ring().entries(),
+    )
+    return render(request, 'admin/slow_queries.html', context)
@@ -0,0 +1,280 @@
+"""Native async implementations of the read hot paths.
+
+These views return the same payloads as their DRF counterparts in views.py,
+but use the async ORM so that an ASGI server does not tie up a thread per
+request. They are routed instead of the DRF views when ASYNC_READ_VIEWS is
+on. Independent queries of one request are awaited together with
+asyncio.gather.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.translation import gettext as _
+from django.views import View
+
+from rest_framework.authtoken.models import Token
+from rest_framework.fields import DateTimeField
+
+from .events import get_broker
+from .feed import bounds_error, feed_bounds, feed_page, is_delta_request
+from .likes import liked_among
+from .models import User, Post
+from .ranking import author_affinities, candidate_posts, in_order, rank
+from .tokens import read_access_token, user_from_access_token
+from .views import PostViewSet
+
+
+date_field = DateTimeField()
+
+
+async def fetch(queryset):
+    """Evaluate a queryset with the async ORM."""
+    return [row async for row in queryset]
+
+
+async def authenticate_token(request):
+    """Async equivalent of SignedTokenAuthentication and rest_framework's TokenAuthentication."""
+    keyword, _separator, key = request.headers.get('Authorization', '').partition(' ')
+    if keyword == 'Bearer' and key:
+        # Usually no query at all; the revocation filter syncs from the database now and then.
+        payload = await sync_to_async(read_access_token)(key)
+        user = user_from_access_token(payload) if payload else None
+        return user if user is not None and user.is_active else None
+    if keyword != 'Token' or not key:
+        return None
+    try:
+        token = await Token.objects.select_related('user').aget(key=key)
+    except Token.DoesNotExist:
+        return None
+    if not token.user.is_active:
+        return None
+    return token.user
+
+
+def file_url(request, value):
+    """Represent a file the way rest_framework's FileField does."""
+    if not value:
+        return None
+    return request.build_absolute_uri(value.url)
+
+
+async def serialize_posts(request, posts):
+    """Serialize posts like PostSerializer, loading tags in one query."""
+    post_ids = [post.id for post in posts]
+    tag_rows, liked_post_ids = await asyncio.gather(
+        fetch(Post.tags.through.objects.filter(post_id__in=post_ids)
+              .values_list('post_id', 'tag_id', 'tag__user_id', 'tag__name')),
+        sync_to_async(liked_among)(request.user, post_ids),
+    )
+    tags = {post_id: [] for post_id in post_ids}
+    for post_id, tag_id, tag_user_id, tag_name in tag_rows:
+        tags[post_id].append({'id': tag_id, 'user': tag_user_id, 'name': tag_name})
+
+    return [
+        {
+            'id': post.id,
+            'text': post.text,
+            'image': file_url(request, post.image),
+            'date_created': date_field.to_representation(post.date_created),
+            'user': post.user_id,
+            'tags': tags[post.id],
+            'liked_by_me': post.id in liked_post_ids,
+        }
+        for post in posts
+    ]
+
+
+async def fetch_posts(request, queryset):
+    """Evaluate a Post queryset and serialize it."""
+    posts = await fetch(queryset)
+    return posts, await serialize_posts(request, posts)
+
+
+async def load_user_relations(request, user_ids):
+    """Load followers, following and serialized posts of users, all at once."""
+    followers_of, following_of, (posts, serialized_posts) = await asyncio.gather(
+        fetch(User.followers.through.objects.filter(from_user_id__in=user_ids)
+              .values_list('from_user_id', 'to_user_id')),
+        fetch(User.followers.through.objects.filter(to_user_id__in=user_ids)
+              .values_list('to_user_id', 'from_user_id')),
+        fetch_posts(request, Post.objects.filter(user_id__in=user_ids)),
+    )
+    followers = {user_id: [] for user_id in user_ids}
+    for user_id, follower_id in followers_of:
+        followers[user_id].append(follower_id)
+    following = {user_id: [] for user_id in user_ids}
+    for user_id, followed_id in following_of:
+        following[user_id].append(followed_id)
+    posts_by_user = {user_id: [] for user_id in user_ids}
+    for post, data in zip(posts, serialized_posts):
+        posts_by_user[post.user_id].append(data)
+    return followers, following, posts_by_user
+
+
+def serialize_users(request, users, relations):
+    """Serialize users like UserSerializer from preloaded relations."""
+    followers, following, posts_by_user = relations
+    return [
+        {
+            'id': user.id,
+            'email': user.email,
+            'profile_picture': file_url(request, user.profile_picture),
+            'bio': user.bio,
+            'is_staff': user.is_staff,
+            'followers': followers[user.id],
+            'following': following[user.id],
+            'posts': posts_by_user[user.id],
+        }
+        for user in users
+    ]
+
+
+def not_found():
+    return JsonResponse({'detail': _('Not found.')}, status=404)
+
+
+class AsyncTokenAuthView(View):
+    """Base view authenticating with a DRF token before dispatching.
+
+    Methods other than GET and HEAD are delegated to sync_view, if set, so a
+    view can replace the read half of an existing DRF route.
+    """
+    sync_view = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Authentication is by token, like the DRF views this replaces.
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        if self.sync_view is not None and request.method not in ('GET', 'HEAD'):
+            return await sync_to_async(self.sync_view)(request, *args, **kwargs)
+        request.user = await authenticate_token(request)
+        if request.user is None:
+            return JsonResponse(
+                {'detail': _('Authentication credentials were not provided.')}, status=401)
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class FollowingFeedAsyncView(AsyncTokenAuthView):
+    """Async version of FollowingFeedView."""
+
+    async def get(self, request):
+        mode = request.GET.get('mode', 'latest')
+        if mode == 'top':
+            now = timezone.now()
+            candidates, affinities = await asyncio.gather(
+                fetch(candidate_posts(request.user, now)),
+                fetch(author_affinities(request.user)),
+            )
+            ids = rank(candidates, affinities, now, limit=settings.FEED_TOP_SIZE)
+            posts = in_order(ids, await fetch(Post.objects.filter(id__in=ids)))
+        elif mode == 'latest' and is_delta_request(request.GET):
+            try:
+                since_id, max_id, limit = feed_bounds(request.GET)
+            except ValueError:
+                return JsonResponse({'error': bounds_error()}, status=400)
+            posts = await fetch(feed_page(request.user, since_id, max_id)[:limit])
+        elif mode == 'latest':
+            posts = await fetch(Post.objects.filter(user__in=request.user.following.all())
+                                .order_by('-date_created', '-id'))
+        else:
+            return JsonResponse({'error': _('Unknown feed mode.')}, status=400)
+        return JsonResponse(await serialize_posts(request, posts), safe=False)
+
+
+class UserProfileAsyncView(AsyncTokenAuthView):
+    """Async version of UserProfileView."""
+
+    async def get(self, request, id):
+        # The user row is loaded together with its relations, which only need the id.
+        user, relations = await asyncio.gather(
+            User.objects.filter(id=id).afirst(),
+            load_user_relations(request, [id]),
+        )
+        if user is None:
+            return not_found()
+        data, = serialize_users(request, [user], relations)
+        return JsonResponse(data)
+
+
+class PostDetailAsyncView(AsyncTokenAuthView):
+    """Async version of PostViewSet.retrieve; writes go to the viewset."""
+    sync_view = staticmethod(PostViewSet.as_view({
+        'put': 'update',
+        'patch': 'partial_update',
+        'delete': 'destroy',
+    }))
+
+    async def get(self, request, pk):
+        try:
+            post = await Post.objects.aget(pk=pk)
+        except Post.DoesNotExist:
+            return not_found()
+        data, = await serialize_posts(request, [post])
+        return JsonResponse(data)
+
+
+class UserLikesListAsyncView(AsyncTokenAuthView):
+    """Async version of UserLikesListView."""
+
+    async def get(self, request):
+        posts = await fetch(request.user.liked_posts.all())
+        return JsonResponse(await serialize_posts(request, posts), safe=False)
+
+
+class PostLikesListAsyncView(AsyncTokenAuthView):
+    """Async version of PostLikesListView."""
+
+    async def get(self, request, post_id):
+        if not await Post.objects.filter(id=post_id).aexists():
+            return not_found()
+        users = await fetch(User.objects.filter(liked_posts__id=post_id))
+        relations = await load_user_relations(request, [user.id for user in users])
+        return JsonResponse(serialize_users(request, users, relations), safe=False)
+
+
+class FeedEventsView(AsyncTokenAuthView):
+    """Server-Sent Events stream of new posts by the accounts the user follows.
+
+    Events arriving close together are sent as one message whose data is a
+    list of posts. Reconnecting clients send the Last-Event-ID header (or a
+    last_event_id parameter) to receive what they missed; a "reset" event
+    tells them to refetch the feed instead, also when the broker does not
+    recognise the id (it was issued before a restart or by another worker).
+    """
+
+    async def get(self, request):
+        last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id') or None
+        broker = get_broker()
+        subscription = broker.subscribe(request.user.id, last_event_id)
+        response = StreamingHttpResponse(
+            self.stream(broker, subscription), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self, broker, subscription):
+        try:
+            if subscription.reset:
+                yield 'event: reset\ndata: {}\n\n'
+            batches = subscription.batches(
+                window=settings.FEED_EVENTS_BATCH_WINDOW,
+                max_size=settings.FEED_EVENTS_BATCH_SIZE,
+                heartbeat=settings.FEED_EVENTS_HEARTBEAT,
+            )
+            async for batch in batches:
+                if not batch:
+                    yield ': keepalive\n\n'
+                    continue
+                last_id = batch[-1][0]
+                posts = json.dumps([event for _event_id, event in batch])
+                yield f"id: {last_id}\nevent: posts\ndata: {posts}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
@@ -0,0 +1,28 @@
+from django.utils.translation import gettext as _
+
+from rest_framework import authentication, exceptions
+
+from .tokens import read_access_token, user_from_access_token
+
+
+class SignedTokenAuthentication(authentication.BaseAuthentication):
+    """Authenticate `Authorization: Bearer <access token>` without a database lookup."""
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid access token header.'))
+
+        payload = read_access_token(auth[1].decode(errors='replace'))
+        if payload is None:
+            raise exceptions.AuthenticationFailed(_('Invalid or expired access token.'))
+        user = user_from_access_token(payload)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return user, payload
+
+    def authenticate_header(self, request):
+        return self.keyword
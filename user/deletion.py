@@ -0,0 +1,161 @@
+"""Account deletion in bounded batches.
+
+Deleting a user in one go cascades through all of its posts, likes and
+follows in a single transaction. Instead, schedule_account_deletion
+deactivates the account and revokes its tokens at once, and
+run_account_deletion removes its rows ACCOUNT_DELETION_BATCH_SIZE at a time,
+one short transaction per batch, deleting media files along the way.
+Progress is kept in AccountDeletion. Every stage only deletes what is left,
+so an interrupted job resumes from its current stage (see the
+run_account_deletions command).
+"""
+import logging
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from core.tasks import run_in_background
+
+from .exports import delete_export
+from .models import AccountDeletion, AuthorAffinity, DataExport, ImageBlob, Post, Tag, User
+from .tokens import revoke_user_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def schedule_account_deletion(user):
+    """Deactivate the user now and delete the account in the background; return its AccountDeletion."""
+    with transaction.atomic():
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        Token.objects.filter(user=user).delete()
+        revoke_user_tokens(user)
+        deletion, _created = AccountDeletion.objects.get_or_create(
+            user_id=user.pk, defaults={'email': user.email})
+        run_in_background(run_account_deletion, deletion.id)
+    return deletion
+
+
+def record_progress(deletion, rows=0, files=0):
+    AccountDeletion.objects.filter(id=deletion.id).update(
+        deleted_rows=F('deleted_rows') + rows,
+        deleted_files=F('deleted_files') + files,
+        updated=timezone.now(),
+    )
+
+
+def delete_files(names):
+    """Delete files from default_storage; return how many names were given."""
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except (OSError, SuspiciousFileOperation):
+            logger.warning("Could not delete %s of a deleted account.", name)
+    return len(names)
+
+
+def delete_in_batches(deletion, queryset):
+    """Delete the rows of queryset, one batch per transaction."""
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.values_list('pk', flat=True)[:settings.ACCOUNT_DELETION_BATCH_SIZE])
+            if not ids:
+                return
+            deleted, _per_model = queryset.model.objects.filter(pk__in=ids).delete()
+        record_progress(deletion, rows=deleted)
+
+
+def delete_likes(deletion):
+    delete_in_batches(deletion, Post.likes.through.objects.filter(user_id=deletion.user_id))
+
+
+def delete_follows(deletion):
+    user_id = deletion.user_id
+    delete_in_batches(deletion, User.followers.through.objects.filter(
+        Q(from_user_id=user_id) | Q(to_user_id=user_id)))
+
+
+def delete_affinities(deletion):
+    user_id = deletion.user_id
+    delete_in_batches(deletion, AuthorAffinity.objects.filter(Q(user_id=user_id) | Q(author_id=user_id)))
+
+
+def release_tags(deletion):
+    # Tags outlive their creator, as with on_delete=SET_NULL.
+    tags = Tag.objects.filter(user_id=deletion.user_id)
+    while True:
+        ids = list(tags.values_list('pk', flat=True)[:settings.ACCOUNT_DELETION_BATCH_SIZE])
+        if not ids:
+            return
+        updated = Tag.objects.filter(pk__in=ids).update(user=None)
+        record_progress(deletion, rows=updated)
+
+
+def delete_posts(deletion):
+    posts = Post.objects.filter(user_id=deletion.user_id).order_by('pk')
+    while True:
+        batch = list(posts.values_list('pk', 'image')[:settings.ACCOUNT_DELETION_BATCH_SIZE])
+        if not batch:
+            return
+        # Images may be shared with other posts: deleting the posts releases
+        # them, and their files go with their last reference (see images.py).
+        # Files without a blob left after the delete are the ones deleted.
+        names = {image for _pk, image in batch if image}
+        ids = [pk for pk, _image in batch]
+        # Other users' likes and the tag links are unbounded per post, so they
+        # go in batches of their own; the post's score is a single row.
+        delete_in_batches(deletion, Post.likes.through.objects.filter(post_id__in=ids))
+        delete_in_batches(deletion, Post.tags.through.objects.filter(post_id__in=ids))
+        with transaction.atomic():
+            deleted, _per_model = Post.objects.filter(pk__in=ids).delete()
+            kept = set(ImageBlob.objects.filter(name__in=names).values_list('name', flat=True))
+        record_progress(deletion, rows=deleted, files=len(names - kept))
+
+
+def delete_exports(deletion):
+    for export in DataExport.objects.filter(user_id=deletion.user_id).iterator():
+        delete_export(export)
+        record_progress(deletion, rows=1, files=1)
+
+
+def delete_user(deletion):
+    user = User.objects.filter(pk=deletion.user_id).first()
+    if user is None:
+        return
+    files = delete_files([user.profile_picture.name] if user.profile_picture else [])
+    # Only small relations (tokens, groups) are left to cascade.
+    deleted, _per_model = user.delete()
+    record_progress(deletion, rows=deleted, files=files)
+
+
+STAGES = [
+    ('likes', delete_likes),
+    ('follows', delete_follows),
+    ('affinities', delete_affinities),
+    ('tags', release_tags),
+    ('posts', delete_posts),
+    ('exports', delete_exports),
+    ('user', delete_user),
+]
+
+
+def run_account_deletion(deletion_id):
+    """Run, or resume, an account deletion from its current stage."""
+    updated = AccountDeletion.objects.filter(
+        id=deletion_id, status__in=[AccountDeletion.PENDING, AccountDeletion.RUNNING],
+    ).update(status=AccountDeletion.RUNNING)
+    if not updated:
+        return
+    deletion = AccountDeletion.objects.get(id=deletion_id)
+    stage_names = [name for name, _stage in STAGES]
+    start = stage_names.index(deletion.stage) if deletion.stage in stage_names else 0
+    for name, stage in STAGES[start:]:
+        AccountDeletion.objects.filter(id=deletion_id).update(stage=name, updated=timezone.now())
+        stage(deletion)
+    AccountDeletion.objects.filter(id=deletion_id).update(
+        status=AccountDeletion.DONE, stage='', finished=timezone.now(), updated=timezone.now())
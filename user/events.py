@@ -0,0 +1,199 @@
+"""Live feed events for followers of an account that publishes a post.
+
+Events are fanned out when a post is created (see signals.py) to every
+follower's channel and streamed to connected clients by FeedEventsView. The
+broker class is set by FEED_EVENTS_BROKER. The default InMemoryBroker only
+reaches clients connected to the same process; a shared broker must provide
+the same publish/subscribe/unsubscribe interface.
+
+Event ids are opaque strings. A client may reconnect to another worker, or
+to the same one after a restart, so an InMemoryBroker id is its boot id
+followed by a sequence number, and an id from any other broker instance is
+not taken for one of its own: the client is told to resync instead.
+
+The stream needs an ASGI server: under WSGI the response is consumed in
+full before anything is sent, so the route is only registered when
+FEED_EVENTS_STREAM is set (see urls.py).
+"""
+import asyncio
+import itertools
+import secrets
+import threading
+from collections import OrderedDict, defaultdict, deque
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+OVERFLOW = object()
+
+
+class Subscription:
+    """Events pending for one connected client.
+
+    Events are queued on the client's event loop. If more than queue_size
+    events are pending the client is too slow; the subscription ends and the
+    client resumes from its last event id when it reconnects.
+    """
+
+    def __init__(self, user_id, loop, queue_size):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue_size = queue_size
+        self.queue = asyncio.Queue()
+        self.reset = False
+        self.overflowed = False
+
+    def deliver(self, event_id, event):
+        """Queue an event; safe to call from any thread."""
+        try:
+            self.loop.call_soon_threadsafe(self._put, (event_id, event))
+        except RuntimeError:
+            # The client's event loop is gone.
+            self.overflowed = True
+
+    def _put(self, item):
+        if self.overflowed:
+            return
+        if self.queue.qsize() >= self.queue_size:
+            self.overflowed = True
+            item = OVERFLOW
+        self.queue.put_nowait(item)
+
+    async def batches(self, window, max_size, heartbeat):
+        """Yield lists of (event_id, event), batching events that arrive within window seconds.
+
+        An empty list is yielded after heartbeat seconds without events.
+        """
+        while True:
+            try:
+                item = await asyncio.wait_for(self.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield []
+                continue
+            if item is OVERFLOW:
+                return
+            batch = [item]
+            deadline = self.loop.time() + window
+            while len(batch) < max_size:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is OVERFLOW:
+                    yield batch
+                    return
+                batch.append(item)
+            yield batch
+
+
+class InMemoryBroker:
+    """Process-local broker keeping the last history_size events of each user for resuming.
+
+    Histories are kept for the max_users users that received events most
+    recently. A client resuming after its user's history was dropped, or
+    after any history was dropped past its last event id, is told to resync.
+    """
+
+    def __init__(self, history_size=100, queue_size=200, max_users=10000):
+        self.history_size = history_size
+        self.queue_size = queue_size
+        self.max_users = max_users
+        self.boot_id = secrets.token_hex(6)
+        self._lock = threading.Lock()
+        self._sequence = itertools.count(1)
+        self._history = OrderedDict()
+        self._evicted_up_to = {}
+        # Newest sequence of any dropped history.
+        self._forgotten_up_to = 0
+        self._subscriptions = defaultdict(set)
+
+    def event_id(self, sequence):
+        return f"{self.boot_id}-{sequence}"
+
+    def sequence(self, event_id):
+        """Return the sequence number of one of this broker's event ids, or None."""
+        boot_id, _, sequence = event_id.partition('-')
+        if boot_id != self.boot_id or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+    def publish(self, user_ids, event):
+        """Send an event to the channels of the given users and return its id."""
+        with self._lock:
+            sequence = next(self._sequence)
+            event_id = self.event_id(sequence)
+            for user_id in user_ids:
+                history = self._user_history(user_id)
+                if len(history) == self.history_size:
+                    self._evicted_up_to[user_id] = history[0][0]
+                history.append((sequence, event))
+                for subscription in self._subscriptions.get(user_id, ()):
+                    subscription.deliver(event_id, event)
+        return event_id
+
+    def _user_history(self, user_id):
+        """Return a user's history, dropping the least recently used ones over max_users."""
+        history = self._history.get(user_id)
+        if history is not None:
+            self._history.move_to_end(user_id)
+            return history
+        while len(self._history) >= self.max_users:
+            dropped_id, dropped = self._history.popitem(last=False)
+            self._evicted_up_to.pop(dropped_id, None)
+            if dropped:
+                self._forgotten_up_to = max(self._forgotten_up_to, dropped[-1][0])
+        history = self._history[user_id] = deque(maxlen=self.history_size)
+        if self._forgotten_up_to:
+            self._evicted_up_to[user_id] = self._forgotten_up_to
+        return history
+
+    def subscribe(self, user_id, last_event_id=None):
+        """Subscribe the calling event loop to a user's channel.
+
+        Events newer than last_event_id are replayed first. If some of them
+        are no longer in the history, or last_event_id was not issued by this
+        broker, subscription.reset is set and the client should refetch its
+        feed.
+        """
+        subscription = Subscription(user_id, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                last_sequence = self.sequence(last_event_id)
+                if last_sequence is None:
+                    subscription.reset = True
+                else:
+                    history = self._history.get(user_id)
+                    if history is None:
+                        subscription.reset = last_sequence < self._forgotten_up_to
+                        history = ()
+                    else:
+                        subscription.reset = last_sequence < self._evicted_up_to.get(user_id, 0)
+                    for sequence, event in history:
+                        if sequence > last_sequence:
+                            subscription.queue.put_nowait((self.event_id(sequence), event))
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """Return the process-wide broker configured by FEED_EVENTS_BROKER."""
+    broker_class = import_string(settings.FEED_EVENTS_BROKER)
+    return broker_class(
+        history_size=settings.FEED_EVENTS_HISTORY,
+        queue_size=settings.FEED_EVENTS_QUEUE_SIZE,
+        max_users=settings.FEED_EVENTS_MAX_USERS,
+    )
@@ -0,0 +1,235 @@
+"""Personal data export.
+
+An export is a zip archive of NDJSON files (profile, posts with their tags,
+likes, followers, following) and the user's images, copied straight from
+default_storage. Querysets are read in chunks of DATA_EXPORT_CHUNK_SIZE rows
+and every archive member is written as a stream, so memory use does not grow
+with the amount of data. The archive is built under DATA_EXPORT_DIR in the
+background and downloaded with Range support, so interrupted downloads can
+be resumed.
+
+A worker claims an export with a lease of DATA_EXPORT_LEASE seconds,
+renewed while it writes, so the background task and `manage.py
+run_data_exports` never build the same archive at once. An export whose
+worker died is claimed again once its lease has expired, and a worker that
+finds its lease taken over stops.
+"""
+import json
+import logging
+import os
+import secrets
+import shutil
+import time
+from datetime import timedelta
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+
+from core.tasks import run_in_background
+
+from .models import DataExport, Post, Tag
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+
+def export_path(export):
+    return os.path.join(settings.DATA_EXPORT_DIR, export.filename)
+
+
+class LeaseLost(Exception):
+    """Another worker claimed the export after this one's lease expired."""
+
+
+class ExportLease:
+    """A worker's claim on a running export."""
+
+    def __init__(self, export_id, token):
+        self.export_id = export_id
+        self.token = token
+        self.renewed_at = time.monotonic()
+
+    def held(self):
+        return DataExport.objects.filter(id=self.export_id, lease_token=self.token)
+
+    def renew(self):
+        """Extend the lease once half of it has passed; raise LeaseLost if it was taken over."""
+        if time.monotonic() - self.renewed_at < settings.DATA_EXPORT_LEASE / 2:
+            return
+        expires = timezone.now() + timedelta(seconds=settings.DATA_EXPORT_LEASE)
+        if not self.held().update(lease_expires=expires):
+            raise LeaseLost(self.export_id)
+        self.renewed_at = time.monotonic()
+
+
+def claim_export(export_id):
+    """Claim a pending export, or a running one whose lease expired; return its lease or None."""
+    now = timezone.now()
+    token = secrets.token_hex(16)
+    claimable = (
+        Q(status=DataExport.PENDING)
+        | Q(status=DataExport.RUNNING, lease_expires__lt=now)
+        | Q(status=DataExport.RUNNING, lease_expires=None)
+    )
+    updated = DataExport.objects.filter(claimable, id=export_id).update(
+        status=DataExport.RUNNING, lease_token=token,
+        lease_expires=now + timedelta(seconds=settings.DATA_EXPORT_LEASE),
+    )
+    return ExportLease(export_id, token) if updated else None
+
+
+def write_ndjson(archive, name, rows, lease):
+    """Write rows as an NDJSON member of the archive, one row at a time."""
+    encoder = DjangoJSONEncoder()
+    with archive.open(name, 'w', force_zip64=True) as member:
+        for row in rows:
+            member.write(encoder.encode(row).encode())
+            member.write(b'\n')
+            lease.renew()
+
+
+def write_file(archive, name, storage_name):
+    """Copy a file from default_storage into the archive; return False if it is missing."""
+    try:
+        with default_storage.open(storage_name, 'rb') as source, \
+                archive.open(name, 'w', force_zip64=True) as member:
+            shutil.copyfileobj(source, member, IMAGE_CHUNK_SIZE)
+    except (FileNotFoundError, SuspiciousFileOperation):
+        logger.warning("Skipping missing file %s in data export.", storage_name)
+        return False
+    return True
+
+
+def archive_image_name(folder, storage_name):
+    return f"images/{folder}/{os.path.basename(storage_name)}"
+
+
+def user_posts(user):
+    tags = Prefetch('tags', queryset=Tag.objects.only('id', 'name'))
+    posts = Post.objects.filter(user=user).order_by('id').prefetch_related(tags)
+    for post in posts.iterator(chunk_size=settings.DATA_EXPORT_CHUNK_SIZE):
+        yield post
+
+
+def related_users(queryset):
+    return queryset.order_by('id').values('id', 'email').iterator(chunk_size=settings.DATA_EXPORT_CHUNK_SIZE)
+
+
+def build_export(export, lease):
+    """Write the archive of an export; the file appears only once it is complete."""
+    path = export_path(export)
+    # Per lease, so a worker that lost its lease never writes another's file.
+    partial_path = f"{path}.{lease.token}.partial"
+    os.makedirs(settings.DATA_EXPORT_DIR, exist_ok=True)
+
+    try:
+        write_archive(export, partial_path, lease)
+    except BaseException:
+        try:
+            os.remove(partial_path)
+        except FileNotFoundError:
+            pass
+        raise
+    os.replace(partial_path, path)
+    return os.path.getsize(path)
+
+
+def write_archive(export, partial_path, lease):
+    user = export.user
+    chunk_size = settings.DATA_EXPORT_CHUNK_SIZE
+    with ZipFile(partial_path, 'w', compression=ZIP_DEFLATED) as archive:
+        profile = {
+            'id': user.id,
+            'email': user.email,
+            'bio': user.bio,
+            'profile_picture': archive_image_name('profile', user.profile_picture.name) if user.profile_picture else None,
+        }
+        archive.writestr('profile.json', json.dumps(profile))
+
+        def posts():
+            for post in user_posts(user):
+                yield {
+                    'id': post.id,
+                    'text': post.text,
+                    'date_created': post.date_created,
+                    'image': archive_image_name('posts', post.image.name) if post.image else None,
+                    'tags': [tag.name for tag in post.tags.all()],
+                }
+
+        write_ndjson(archive, 'posts.ndjson', posts(), lease)
+        likes = (
+            Post.likes.through.objects.filter(user=user).order_by('post_id')
+            .values('post_id', 'post__user_id', 'post__text').iterator(chunk_size=chunk_size)
+        )
+        write_ndjson(archive, 'likes.ndjson', (
+            {'post': like['post_id'], 'author': like['post__user_id'], 'text': like['post__text']}
+            for like in likes
+        ), lease)
+        write_ndjson(archive, 'followers.ndjson', related_users(user.followers.all()), lease)
+        write_ndjson(archive, 'following.ndjson', related_users(user.following.all()), lease)
+
+        if user.profile_picture:
+            write_file(archive, profile['profile_picture'], user.profile_picture.name)
+        # Deduplicated uploads share a file, which goes into the archive once.
+        images = (
+            Post.objects.filter(user=user).exclude(image='').order_by('image')
+            .values_list('image', flat=True).distinct().iterator(chunk_size=chunk_size)
+        )
+        for storage_name in images:
+            write_file(archive, archive_image_name('posts', storage_name), storage_name)
+            lease.renew()
+
+
+def run_export(export_id):
+    """Build a claimable export and record the outcome; return False if another worker holds it."""
+    lease = claim_export(export_id)
+    if lease is None:
+        return False
+    export = DataExport.objects.select_related('user').get(id=export_id)
+    try:
+        size = build_export(export, lease)
+    except LeaseLost:
+        logger.warning("Data export %s was taken over by another worker.", export_id)
+        return False
+    except Exception:
+        lease.held().update(status=DataExport.FAILED, finished=timezone.now())
+        raise
+    lease.held().update(status=DataExport.DONE, size=size, finished=timezone.now())
+    return True
+
+
+def request_export(user):
+    """Return the user's unfinished export, or start a new one."""
+    export = (
+        DataExport.objects.filter(user=user, status__in=[DataExport.PENDING, DataExport.RUNNING])
+        .order_by('-created').first()
+    )
+    if export is None:
+        export = DataExport.objects.create(user=user)
+        run_in_background(run_export, export.id)
+    return export
+
+
+def expire_exports():
+    """Delete exports finished more than DATA_EXPORT_RETENTION seconds ago; return how many."""
+    cutoff = timezone.now() - timedelta(seconds=settings.DATA_EXPORT_RETENTION)
+    expired = DataExport.objects.filter(finished__lt=cutoff)
+    count = 0
+    for export in expired.iterator():
+        delete_export(export)
+        count += 1
+    return count
+
+
+def delete_export(export):
+    try:
+        os.remove(export_path(export))
+    except FileNotFoundError:
+        pass
+    export.delete()
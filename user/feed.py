@@ -0,0 +1,87 @@
+"""Delta polling of the latest feed.
+
+Clients keep the ids of the newest and oldest posts they have.
+/api/feed/?since_id=N returns only the posts newer than N, and ?max_id=N
+only those older than N, newest first and at most ?limit= (FEED_PAGE_SIZE
+by default). /api/feed/new/?since_id=N, with GET or HEAD, counts the newer
+posts, up to FEED_NEW_POSTS_MAX_COUNT, without loading them.
+
+Every follow row keeps the id of the followed author's newest post,
+indexed together with the follower. Whether a feed has anything newer than
+since_id is then one index lookup, and posts are only counted when it does.
+The ids are set when a follow is added, when posts are imported, and, on
+the background pool once the creating transaction has committed, when a post
+is created (see signals.py). A popular author's post touches many follow
+rows, so they are updated in batches of FEED_HEAD_BATCH_SIZE, each in its
+own short transaction, rather than locked by the request that creates the
+post. Counts are therefore eventually consistent: for a moment after a post
+is committed, its author's followers may still be told nothing is new.
+
+Post ids follow creation order, so they order these pages; imported posts
+are dated in the past but still come after the posts created before them.
+"""
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.translation import gettext as _
+
+from .models import Follow, Post
+
+PARAMETERS = ('since_id', 'max_id')
+
+
+def is_delta_request(params):
+    return any(name in params for name in PARAMETERS)
+
+
+def feed_bounds(params):
+    """Return (since_id, max_id, limit) from query parameters; raise ValueError if one is invalid."""
+    since_id, max_id = (int(params[name]) if name in params else None for name in PARAMETERS)
+    limit = int(params.get('limit', settings.FEED_PAGE_SIZE))
+    if (since_id is not None and since_id < 0) or (max_id is not None and max_id < 1) \
+            or not 1 <= limit <= settings.FEED_PAGE_SIZE:
+        raise ValueError
+    return since_id, max_id, limit
+
+
+def bounds_error():
+    return _('since_id and max_id must be post ids, and limit between 1 and %(max)d.') % {
+        'max': settings.FEED_PAGE_SIZE}
+
+
+def feed_page(user, since_id=None, max_id=None):
+    """Return the latest feed of user between the ids, newest first."""
+    posts = Post.objects.filter(user__in=user.following.all())
+    if since_id is not None:
+        posts = posts.filter(id__gt=since_id)
+    if max_id is not None:
+        posts = posts.filter(id__lt=max_id)
+    return posts.order_by('-id')
+
+
+def has_new_posts(user, since_id):
+    return Follow.objects.filter(to_user=user, latest_post_id__gt=since_id).exists()
+
+
+def count_new_posts(user, since_id):
+    """Return how many posts of the user's feed are newer than since_id, up to FEED_NEW_POSTS_MAX_COUNT."""
+    if not has_new_posts(user, since_id):
+        return 0
+    return feed_page(user, since_id).order_by()[:settings.FEED_NEW_POSTS_MAX_COUNT].count()
+
+
+def record_new_post(author_id, post_id):
+    """Record post_id as the newest post of the author in the follows of their followers."""
+    behind = Follow.objects.filter(from_user_id=author_id, latest_post_id__lt=post_id)
+    while True:
+        # Updated follows no longer match, so every batch takes the next ones.
+        follow_ids = list(behind.values_list('id', flat=True)[:settings.FEED_HEAD_BATCH_SIZE])
+        if not follow_ids:
+            return
+        Follow.objects.filter(id__in=follow_ids, latest_post_id__lt=post_id).update(latest_post_id=post_id)
+
+
+def set_latest_post_ids(follows):
+    """Set the latest post id of follows from their authors' posts."""
+    latest = Post.objects.filter(user_id=OuterRef('from_user_id')).order_by('-id').values('id')[:1]
+    follows.update(latest_post_id=Coalesce(Subquery(latest), 0))
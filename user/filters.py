@@ -1,6 +1,15 @@
 import django_filters
-from .models import Post
-from django.db.models import Count
+from .models import Post, PostLike
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def likes_count():
+    # A correlated count rather than Count('likes'): on PostgreSQL posts are
+    # partitioned and cannot be grouped by id alone (see partitions.py).
+    counts = PostLike.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(count=Count('*'))
+    return Coalesce(Subquery(counts.values('count')), 0)
+
 
 class PostFilter(django_filters.FilterSet):
     """Filter for Post object."""
@@ -30,7 +39,7 @@ class PostFilter(django_filters.FilterSet):
         except:
             return queryset.none()
             
-        queryset = queryset.annotate(likes_count=Count('likes')).filter(likes_count=value)
+        queryset = queryset.annotate(likes_count=likes_count()).filter(likes_count=value)
         return queryset.distinct()
 
     def filter_likes_count__gte(self, queryset, name, value):
@@ -39,7 +48,7 @@ class PostFilter(django_filters.FilterSet):
         except:
             return queryset.none()
             
-        queryset = queryset.annotate(likes_count=Count('likes')).filter(likes_count__gte=value)
+        queryset = queryset.annotate(likes_count=likes_count()).filter(likes_count__gte=value)
         return queryset.distinct()
 
     def filter_likes_count__lte(self, queryset, name, value):
@@ -48,5 +57,5 @@ class PostFilter(django_filters.FilterSet):
         except:
             return queryset.none()
             
-        queryset = queryset.annotate(likes_count=Count('likes')).filter(likes_count__lte=value)
+        queryset = queryset.annotate(likes_count=likes_count()).filter(likes_count__lte=value)
         return queryset.distinct()
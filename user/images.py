@@ -0,0 +1,247 @@
+"""Content-addressed storage of post images.
+
+Users often post the same picture: a meme shared by many accounts is
+uploaded, resized and stored once per post. Instead, every stored post
+image is an ImageBlob, and a new upload shares the blob of:
+
+- the upload it was first stored from, by SHA-256 of the uploaded bytes,
+  so a file uploaded again is not even decoded;
+- an image with the same dHash, or one at most IMAGE_DEDUP_MAX_DISTANCE
+  bits away, so copies that were re-encoded, resized or slightly
+  compressed by another app are shared too;
+- the same stored bytes, by SHA-256.
+
+The dHash is a 64-bit hash of the resized image's brightness gradients. It
+is stored as four 16-bit segments in indexed columns: two hashes at most d
+bits apart differ by at most d // 4 bits in one of their segments, so near
+duplicates are found by looking up 1 + 16 values per segment (for d < 8)
+instead of comparing every hash. A candidate must also have the same
+dimensions and a 16 x 16 colour fingerprint whose pixels differ by at most
+IMAGE_DEDUP_MAX_PIXEL_DIFFERENCE on average, since flat or recoloured
+images can share a dHash. A None IMAGE_DEDUP_MAX_DISTANCE only shares
+exact copies.
+
+Each post holds one reference to its blob. release_image() drops it when
+the post is deleted or its image replaced, and the file goes with the last
+reference. Images stored before blobs existed have none and are deleted as
+before. `manage.py image_dedup_report` prints the bytes saved.
+
+A new file is written before its ImageBlob row, inside the transaction that
+saves the post. Post.save() runs that transaction under
+delete_stored_images_on_error(), so when it rolls back, the files it stored
+are deleted with it.
+"""
+import contextvars
+import hashlib
+from contextlib import contextmanager
+from functools import partial
+from itertools import combinations
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from core.metrics import IMAGE_DEDUP, IMAGE_PROCESSING_DURATION
+
+from .models import (
+    POST_IMAGES_UPLOAD_PATH,
+    PROFILE_PIC_SIZE_TUPLE,
+    ImageBlob,
+    encode_image,
+    sharded_filename,
+)
+
+SEGMENTS = 4
+SEGMENT_BITS = 16
+FINGERPRINT_SIZE = (16, 16)
+# Rows read per near-duplicate lookup; more only happens for hashes shared
+# by many different images, such as those of flat images.
+MAX_CANDIDATES = 50
+
+_stored_names = contextvars.ContextVar('stored_image_names', default=None)
+
+
+def file_digest(image_file):
+    digest = hashlib.sha256()
+    for chunk in image_file.chunks():
+        digest.update(chunk)
+    image_file.seek(0)
+    return digest.hexdigest()
+
+
+def reduced_image(img):
+    """Return the 16 x 16 RGB reduction of a PIL image both hashes are computed from."""
+    # Reducing the resized image once is most of the hashing time.
+    from PIL import Image
+
+    return img.convert('RGB').resize(FINGERPRINT_SIZE, Image.Resampling.BOX)
+
+
+def dhash(reduced):
+    """Return the 64-bit difference hash of a reduced image.
+
+    Each bit compares two horizontally adjacent pixels of its 9 x 8
+    greyscale reduction."""
+    from PIL import Image
+
+    pixels = reduced.convert('L').resize((9, 8), Image.Resampling.BOX).tobytes()
+    value = 0
+    for row in range(0, 72, 9):
+        for column in range(row, row + 8):
+            value = value << 1 | (pixels[column] < pixels[column + 1])
+    return value
+
+
+def fingerprint(reduced):
+    return reduced.tobytes()
+
+
+def segments(value):
+    mask = (1 << SEGMENT_BITS) - 1
+    return [value >> (SEGMENT_BITS * index) & mask for index in range(SEGMENTS)]
+
+
+def probes(segment, radius):
+    """Return the segment values at most radius bits away from segment."""
+    values = []
+    for distance in range(radius + 1):
+        for bits in combinations(range(SEGMENT_BITS), distance):
+            flipped = segment
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+
+def pixel_difference(first, second):
+    return sum(abs(a - b) for a, b in zip(first, second)) / len(first)
+
+
+def find_similar(value, print_, size):
+    """Return the stored image nearest to a dHash, fingerprint and size, or None."""
+    max_distance = settings.IMAGE_DEDUP_MAX_DISTANCE
+    if max_distance is None:
+        return None
+    radius = max_distance // SEGMENTS
+    query = Q()
+    for index, segment in enumerate(segments(value)):
+        query |= Q(**{f'dhash_{index}__in': probes(segment, radius)})
+    best, best_distance = None, max_distance + 1
+    candidates = ImageBlob.objects.filter(query, width=size[0], height=size[1]).only(
+        'name', 'dhash_0', 'dhash_1', 'dhash_2', 'dhash_3', 'fingerprint')
+    for blob in candidates[:MAX_CANDIDATES]:
+        distance = (value ^ blob.dhash).bit_count()
+        if (distance < best_distance and pixel_difference(print_, bytes(blob.fingerprint))
+                <= settings.IMAGE_DEDUP_MAX_PIXEL_DIFFERENCE):
+            best, best_distance = blob, distance
+    return best
+
+
+def acquire(blob):
+    """Add a reference to blob; return False if its last one was released meanwhile."""
+    return ImageBlob.objects.filter(pk=blob.pk).update(references=F('references') + 1) == 1
+
+
+def share(blob, match):
+    if blob is not None and acquire(blob):
+        IMAGE_DEDUP.labels(match).inc()
+        return True
+    return False
+
+
+@contextmanager
+def delete_stored_images_on_error():
+    """Delete the files newly stored by store_post_image() in the block if it raises.
+
+    Enter it outside the transaction.atomic() block that records them, so
+    the files are deleted once their ImageBlob rows are rolled back."""
+    names = []
+    token = _stored_names.set(names)
+    try:
+        yield
+    except BaseException:
+        for name in names:
+            default_storage.delete(name)
+        raise
+    finally:
+        _stored_names.reset(token)
+
+
+def store_post_image(image_file, size_tuple=PROFILE_PIC_SIZE_TUPLE):
+    """Store a resized copy of an uploaded post image, or share a stored one; return its name.
+
+    The caller owns one reference to the image, dropped with release_image()."""
+    # Pillow is imported lazily, as in prepare_image().
+    from PIL import Image
+
+    source = file_digest(image_file)
+    blob = ImageBlob.objects.filter(source_sha256=source).only('name').first()
+    if share(blob, 'upload'):
+        return blob.name
+
+    with IMAGE_PROCESSING_DURATION.time():
+        img = Image.open(image_file)
+        img.thumbnail(size_tuple)
+        reduced = reduced_image(img)
+        value, print_ = dhash(reduced), fingerprint(reduced)
+        blob = find_similar(value, print_, img.size)
+        if share(blob, 'similar'):
+            return blob.name
+        output = encode_image(img)
+
+    data = output.getvalue()
+    digest = hashlib.sha256(data).hexdigest()
+    name = default_storage.save(f"{POST_IMAGES_UPLOAD_PATH}/{sharded_filename()}", File(output))
+    try:
+        with transaction.atomic():
+            ImageBlob.objects.create(
+                name=name, sha256=digest, source_sha256=source,
+                **{f'dhash_{index}': segment for index, segment in enumerate(segments(value))},
+                width=img.width, height=img.height, fingerprint=print_, size=len(data),
+            )
+    except IntegrityError:
+        # The same bytes are stored already, or were by a concurrent upload.
+        # Rare enough not to be looked up before storing.
+        default_storage.delete(name)
+        blob = ImageBlob.objects.filter(sha256=digest).only('name').first()
+        if share(blob, 'content'):
+            return blob.name
+        return store_post_image(image_file, size_tuple)
+    IMAGE_DEDUP.labels('none').inc()
+    stored = _stored_names.get()
+    if stored is not None:
+        stored.append(name)
+    return name
+
+
+def release_image(name):
+    """Drop a reference to a stored post image; the last one deletes its file once committed."""
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(name=name).only('references').first()
+        if blob is not None and blob.references > 1:
+            ImageBlob.objects.filter(pk=blob.pk).update(references=F('references') - 1)
+            return
+        if blob is not None:
+            blob.delete()
+        transaction.on_commit(partial(default_storage.delete, name))
+
+
+def dedup_report(top=10):
+    """Summarize the stored post images and the bytes their sharing saves.
+
+    Bytes saved count every reference after the first as a copy of the
+    stored image that would have been stored otherwise."""
+    totals = ImageBlob.objects.aggregate(
+        images=Count('pk'),
+        post_images=Sum('references', default=0),
+        stored_bytes=Sum('size', default=0),
+        referenced_bytes=Sum(F('size') * F('references'), default=0),
+    )
+    totals['saved_bytes'] = totals.pop('referenced_bytes') - totals['stored_bytes']
+    totals['top_shared'] = list(
+        ImageBlob.objects.filter(references__gt=1).order_by('-references')
+        .values('name', 'references', 'size')[:top]
+    )
+    return totals
@@ -0,0 +1,206 @@
+"""Bulk import of posts from NDJSON.
+
+Each line is a JSON object::
+
+    {"text": "...", "tags": ["travel"], "date_created": "2023-05-01T12:00:00Z", "image": "<base64>"}
+
+Only "text" is required. Lines are read as a stream and handled in batches of
+POST_IMPORT_BATCH_SIZE: records are validated, the tags of the whole batch
+are resolved (and missing ones created) with two queries, then posts and
+post-tag rows are inserted with bulk_create. Images are stored as they are
+read and resized in the background. Imported posts bypass Post.save and its
+signals, so followers are not notified of them.
+"""
+import base64
+import binascii
+import json
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, router, transaction
+from django.db.models import Min
+from django.utils.dateparse import parse_datetime
+
+from core.tasks import run_in_background
+
+from .feed import record_new_post
+from .images import release_image, store_post_image
+from .models import Post, Tag
+
+
+IMPORT_IMAGES_PATH = 'imports'
+MAX_ERRORS = 100
+TEXT_MAX_LENGTH = Post._meta.get_field('text').max_length
+TAG_MAX_LENGTH = Tag._meta.get_field('name').max_length
+
+
+class RecordError(ValueError):
+    pass
+
+
+class ImportResult:
+    """Counts of an import and the first MAX_ERRORS invalid lines."""
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def as_dict(self):
+        return {'imported': self.imported, 'failed': self.failed, 'errors': self.errors}
+
+
+def parse_record(line):
+    """Validate one NDJSON line; return (text, tag names, date_created, image bytes)."""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise RecordError('Invalid JSON.')
+    if not isinstance(record, dict):
+        raise RecordError('Expected a JSON object.')
+
+    text = record.get('text')
+    if not isinstance(text, str) or not text.strip():
+        raise RecordError('"text" must be a non-empty string.')
+    if len(text) > TEXT_MAX_LENGTH:
+        raise RecordError(f'"text" is longer than {TEXT_MAX_LENGTH} characters.')
+
+    tags = record.get('tags') or []
+    if not isinstance(tags, list) or not all(isinstance(tag, str) and tag.strip() for tag in tags):
+        raise RecordError('"tags" must be a list of non-empty strings.')
+    if any(len(tag) > TAG_MAX_LENGTH for tag in tags):
+        raise RecordError(f'Tag names are limited to {TAG_MAX_LENGTH} characters.')
+
+    date_created = record.get('date_created')
+    if date_created is not None:
+        date_created = parse_datetime(date_created) if isinstance(date_created, str) else None
+        if date_created is None:
+            raise RecordError('"date_created" must be an ISO 8601 date and time.')
+
+    image = record.get('image')
+    if image is not None:
+        try:
+            image = base64.b64decode(image, validate=True)
+        except (binascii.Error, TypeError):
+            raise RecordError('"image" must be base64 encoded.')
+        if not image or len(image) > settings.POST_IMPORT_MAX_IMAGE_SIZE:
+            raise RecordError('"image" is empty or too large.')
+
+    return text, list(dict.fromkeys(tags)), date_created, image
+
+
+def resolve_tags(names, user):
+    """Return {name: tag id}, creating the tags that do not exist yet."""
+    # Tag names are not unique; like PostSerializer, use the oldest tag of a name.
+    tag_ids = dict(
+        Tag.objects.filter(name__in=names).values('name').annotate(id=Min('id')).values_list('name', 'id')
+    )
+    missing = [Tag(name=name, user=user) for name in names if name not in tag_ids]
+    if missing:
+        for tag in Tag.objects.bulk_create(missing):
+            tag_ids[tag.name] = tag.id
+    return tag_ids
+
+
+def insert_post_tags(rows):
+    """Insert (post id, tag id) rows into the post-tag table.
+
+    The rows are sent with executemany; building a through model instance
+    for each of them would cost more than the insert itself.
+    """
+    through = Post.tags.through
+    connection = connections[router.db_for_write(through)]
+    quote_name = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}, {}) VALUES (%s, %s)'.format(
+        quote_name(through._meta.db_table),
+        quote_name(through._meta.get_field('post').column),
+        quote_name(through._meta.get_field('tag').column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, list(rows))
+
+
+def import_batch(user, records):
+    """Insert a batch of validated records; return the ids of the new posts and their queued images."""
+    names = {name for _text, tags, _date, _image in records for name in tags}
+    with transaction.atomic():
+        tag_ids = resolve_tags(names, user) if names else {}
+        posts = Post.objects.bulk_create([Post(user_id=user.id, text=text) for text, *_rest in records])
+        # date_created is auto_now_add, which bulk_create applies; restore the imported dates.
+        dated = []
+        for post, (_text, _tags, date_created, _image) in zip(posts, records):
+            if date_created is not None:
+                post.date_created = date_created
+                dated.append(post)
+        if dated:
+            Post.objects.bulk_update(dated, ['date_created'])
+        insert_post_tags(
+            (post.id, tag_ids[name])
+            for post, (_text, tags, _date, _image) in zip(posts, records)
+            for name in tags
+        )
+        if posts:
+            record_new_post(user.id, max(post.id for post in posts))
+    images = [
+        (post.id, image_name)
+        for post, (_text, _tags, _date, image_name) in zip(posts, records)
+        if image_name
+    ]
+    return [post.id for post in posts], images
+
+
+def import_posts(user, lines, batch_size=None):
+    """Import posts for user from an iterable of NDJSON lines (str or bytes)."""
+    batch_size = batch_size or settings.POST_IMPORT_BATCH_SIZE
+    result = ImportResult()
+    batch = []
+
+    def flush():
+        post_ids, images = import_batch(user, batch)
+        result.imported += len(post_ids)
+        if images:
+            run_in_background(process_imported_images, images)
+        batch.clear()
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            text, tags, date_created, image = parse_record(line)
+        except RecordError as error:
+            result.add_error(line_number, str(error))
+            continue
+        image_name = None
+        if image is not None:
+            # Store the upload now so only its name is held until the batch is inserted.
+            image_name = default_storage.save(
+                os.path.join(IMPORT_IMAGES_PATH, f"{uuid.uuid4().hex}"), ContentFile(image))
+        batch.append((text, tags, date_created, image_name))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return result
+
+
+def process_imported_images(images):
+    """Store or share queued images and attach them to their posts, as Post.save does for uploads."""
+    for post_id, image_name in images:
+        try:
+            with default_storage.open(image_name, 'rb') as image_file:
+                name = store_post_image(image_file)
+        except (OSError, ValueError):
+            # Not an image PIL can read; drop it and keep the post.
+            default_storage.delete(image_name)
+            continue
+        if not Post.objects.filter(id=post_id).update(image=name):
+            release_image(name)
+        default_storage.delete(image_name)
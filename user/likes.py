@@ -0,0 +1,90 @@
+"""Which posts a user has liked, for the liked_by_me field of post payloads.
+
+Each user's liked post ids are kept in the cache as one sorted array of
+64-bit integers (8 bytes a like), loaded from the database on first use.
+Flags for a whole page of posts then take one cache read and a binary
+search per post, instead of shipping every post's likes or querying per
+post.
+
+The array is stored with the user's generation, a counter that
+UserLikePostView increments once a like or unlike is committed, and is only
+used while that generation is current. Patching the array instead would
+lose one of two concurrent likes, and a reader that loaded the likes just
+before a like committed could store them after it was patched. Either way
+liked_by_me would stay wrong until the entry expired.
+
+Users with more than LIKED_POSTS_INDEX_MAX_SIZE likes are not cached; their
+flags take one query per page. A like made outside UserLikePostView shows
+up once the entry expires after LIKED_POSTS_INDEX_TIMEOUT seconds.
+"""
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Post
+
+
+def index_key(user_id):
+    return f'liked-posts:{user_id}'
+
+
+def generation_key(user_id):
+    return f'liked-posts-generation:{user_id}'
+
+
+def load_liked_post_ids(user_id):
+    """Return the user's liked post ids from the database as a sorted array, or None if too many."""
+    limit = settings.LIKED_POSTS_INDEX_MAX_SIZE
+    ids = array('q', Post.likes.through.objects.filter(user_id=user_id)
+                .order_by('post_id').values_list('post_id', flat=True)[:limit + 1])
+    return ids if len(ids) <= limit else None
+
+
+def liked_post_ids(user_id):
+    """Return the user's liked post ids as a sorted array, or None if they are not indexed."""
+    key, counter_key = index_key(user_id), generation_key(user_id)
+    values = cache.get_many([key, counter_key])
+    generation = values.get(counter_key)
+    if generation is None:
+        # Starting from the time rather than 0 keeps a counter that was
+        # evicted from matching the generation of an entry that was not.
+        generation = time.time_ns()
+        if not cache.add(counter_key, generation, None):
+            generation = cache.get(counter_key, generation)
+    entry = values.get(key)
+    if entry is not None and entry[0] == generation:
+        ids = array('q')
+        ids.frombytes(entry[1])
+        return ids
+    ids = load_liked_post_ids(user_id)
+    if ids is not None:
+        cache.set(key, (generation, ids.tobytes()), settings.LIKED_POSTS_INDEX_TIMEOUT)
+    return ids
+
+
+def contains(ids, post_id):
+    index = bisect_left(ids, post_id)
+    return index < len(ids) and ids[index] == post_id
+
+
+def liked_among(user, post_ids):
+    """Return the set of post_ids that user has liked."""
+    if not post_ids or user is None or not user.is_authenticated:
+        return set()
+    ids = liked_post_ids(user.id)
+    if ids is None:
+        return set(Post.likes.through.objects.filter(user_id=user.id, post_id__in=post_ids)
+                   .values_list('post_id', flat=True))
+    return {post_id for post_id in post_ids if contains(ids, post_id)}
+
+
+def invalidate_index(user_id):
+    """Make the user's cached index stale; call once a like or unlike is committed."""
+    try:
+        cache.incr(generation_key(user_id))
+    except ValueError:
+        # No counter: the next read starts a new generation anyway.
+        pass
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from user.tag_gc import collect_orphan_tags, orphan_tag_report
+
+
+class Command(BaseCommand):
+    """Delete tags that no post uses."""
+    help = 'Delete orphan tags older than TAG_GC_GRACE_PERIOD, or report them with --dry-run.'
+    # Run periodically; system checks, which import every view, are left to deploys.
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted.')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            report = orphan_tag_report()
+            self.stdout.write(
+                f"{report['collectable']} of {report['orphans']} orphan tags would be deleted "
+                f"({report['tags']} tags in total)."
+            )
+            for owner in report['top_owners']:
+                self.stdout.write(f"  {owner['user__email'] or '(no owner)'}: {owner['orphans']}")
+            return
+        deleted = collect_orphan_tags(options['batch_size'])
+        self.stdout.write(f"Deleted {deleted} orphan tags.")
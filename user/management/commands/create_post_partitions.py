@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from user.partitions import ensure_partitions, uses_partitions
+
+
+class Command(BaseCommand):
+    """Create the upcoming monthly partitions of the posts table."""
+    help = 'Create the partitions of the posts table up to POST_PARTITIONS_AHEAD months ahead.'
+    # Run periodically; system checks, which import every view, are left to deploys.
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=None, help='Months to create beyond the current one.')
+
+    def handle(self, *args, **options):
+        if not uses_partitions():
+            self.stdout.write("The posts table is not partitioned on this database.")
+            return
+        created = ensure_partitions(ahead=options['ahead'])
+        self.stdout.write(f"Created {len(created)} partitions{': ' if created else '.'}{', '.join(created)}")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from user.images import dedup_report
+
+
+class Command(BaseCommand):
+    """Report the storage saved by sharing post images."""
+    help = 'Print stored post images, their references and the bytes sharing them saves.'
+    # Run periodically; system checks, which import every view, are left to deploys.
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Number of most shared images to list.')
+
+    def handle(self, *args, **options):
+        report = dedup_report(options['top'])
+        self.stdout.write(
+            f"{report['images']} stored images for {report['post_images']} post images: "
+            f"{report['stored_bytes']} bytes stored, {report['saved_bytes']} bytes saved."
+        )
+        for image in report['top_shared']:
+            self.stdout.write(f"  {image['name']}: {image['references']} posts, {image['size']} bytes")
@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user.imports import import_posts
+from user.models import User
+
+
+class Command(BaseCommand):
+    """Import posts for a user from an NDJSON file."""
+    help = 'Import posts from an NDJSON file (or - for standard input) for the user with the given email.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email')
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['email']} does not exist.")
+
+        if options['path'] == '-':
+            result = import_posts(user, sys.stdin.buffer, options['batch_size'])
+        else:
+            with open(options['path'], 'rb') as ndjson_file:
+                result = import_posts(user, ndjson_file, options['batch_size'])
+
+        for error in result.errors:
+            self.stderr.write(f"Line {error['line']}: {error['error']}")
+        self.stdout.write(f"Imported {result.imported} posts, {result.failed} lines failed.")
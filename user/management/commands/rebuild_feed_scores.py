@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from user.ranking import rebuild_scores
+
+
+class Command(BaseCommand):
+    """Recompute the top feed scores from the likes table."""
+    help = 'Recompute post scores and author affinities of the top feed from existing likes.'
+
+    def handle(self, *args, **options):
+        posts, affinities = rebuild_scores()
+        self.stdout.write(f"Scored {posts} posts and {affinities} author affinities.")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from user.recommendations import refresh_recommendations
+
+
+class Command(BaseCommand):
+    """Recompute post recommendations from the likes table."""
+    help = 'Recompute similar posts and recommendations changed since the last run, or all of them with --full.'
+    # Run periodically; system checks, which import every view, are left to deploys.
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every post and user.')
+
+    def handle(self, *args, **options):
+        posts, users = refresh_recommendations(full=options['full'])
+        self.stdout.write(f"Recomputed similar posts of {posts} posts and recommendations of {users} users.")
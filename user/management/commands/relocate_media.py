@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from user.media import MEDIA_FIELDS, relocate_media, unsharded_files
+
+
+class Command(BaseCommand):
+    """Move media files stored under flat or absolute names to sharded storage keys."""
+    help = 'Copy unsharded media files to sharded keys in the default storage, in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the files to move.')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            for model, field_name, directory in MEDIA_FIELDS:
+                count = unsharded_files(model, field_name, directory).count()
+                self.stdout.write(f"{directory}: {count} files to move.")
+            return
+        results = relocate_media(workers=options['workers'], batch_size=options['batch_size'])
+        for directory, (moved, missing) in results.items():
+            self.stdout.write(f"{directory}: moved {moved} files, {missing} missing.")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from user.deletion import run_account_deletion
+from user.models import AccountDeletion
+
+
+class Command(BaseCommand):
+    """Resume unfinished account deletions and report their progress."""
+    help = 'Run pending or interrupted account deletions.'
+    # Run periodically; system checks, which import every view, are left to deploys.
+    requires_system_checks = []
+
+    def handle(self, *args, **options):
+        unfinished = AccountDeletion.objects.exclude(status=AccountDeletion.DONE).values_list('id', flat=True)
+        for deletion_id in list(unfinished):
+            run_account_deletion(deletion_id)
+            deletion = AccountDeletion.objects.get(id=deletion_id)
+            self.stdout.write(
+                f"{deletion.email}: {deletion.status}, {deletion.deleted_rows} rows "
+                f"and {deletion.deleted_files} files deleted."
+            )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from user.exports import expire_exports, run_export
+from user.models import DataExport
+
+
+class Command(BaseCommand):
+    """Build unfinished data exports and delete expired ones."""
+    help = 'Build pending or abandoned data exports and delete expired archives.'
+    # Run periodically; system checks, which import every view, are left to deploys.
+    requires_system_checks = []
+
+    def handle(self, *args, **options):
+        unfinished = DataExport.objects.filter(
+            status__in=[DataExport.PENDING, DataExport.RUNNING]).values_list('id', flat=True)
+        for export_id in list(unfinished):
+            if run_export(export_id):
+                self.stdout.write(f"Built export {export_id}.")
+        expired = expire_exports()
+        self.stdout.write(f"Deleted {expired} expired exports.")
@@ -0,0 +1,175 @@
+"""Delivery of user media files.
+
+MediaView checks that a file belongs to a post or profile picture of an
+active account, then leaves the transfer to the front proxy: with
+MEDIA_SERVE_METHOD 'x-accel-redirect' nginx serves the file from an internal
+location at MEDIA_ACCEL_REDIRECT_PREFIX, with 'x-sendfile' Apache (mod_xsendfile)
+or lighttpd serve it from its path. With 'django' the file is streamed by
+the app itself, with Range, ETag and cache headers, as are files of storage
+backends without local paths.
+
+Files stored before media keys were sharded are moved by relocate_media().
+"""
+import mimetypes
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.utils.encoding import iri_to_uri
+
+from core.files import ranged_file_response, ranged_storage_response
+
+from .models import (
+    POST_IMAGES_UPLOAD_PATH,
+    PROFILE_PICS_UPLOAD_PATH,
+    Post,
+    User,
+    sharded_filename,
+)
+
+
+def is_public_media(name):
+    """Return whether the file is the image of a post or profile of an active user."""
+    return (
+        Post.objects.filter(image=name, user__is_active=True).exists()
+        or User.objects.filter(profile_picture=name, is_active=True).exists()
+    )
+
+
+def cache_control():
+    return f"private, max-age={settings.MEDIA_CACHE_MAX_AGE}"
+
+
+def media_response(request, name):
+    """Return a response delivering the media file stored under name."""
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    try:
+        if not default_storage.exists(name):
+            raise Http404
+        path = default_storage.path(name)
+    except SuspiciousFileOperation:
+        raise Http404
+    except NotImplementedError:
+        # Not on local disk, so out of the proxy's reach; stream it from the storage.
+        return ranged_storage_response(
+            request, default_storage, name, content_type=content_type, cache_control=cache_control())
+
+    method = settings.MEDIA_SERVE_METHOD
+    if method == 'django':
+        return ranged_file_response(request, path, content_type=content_type, cache_control=cache_control())
+
+    # The proxy handles Range and conditional requests itself.
+    response = HttpResponse(content_type=content_type)
+    if method == 'x-accel-redirect':
+        relative_path = os.path.relpath(path, settings.MEDIA_ROOT)
+        response['X-Accel-Redirect'] = iri_to_uri(
+            settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + relative_path.replace(os.sep, '/'))
+    elif method == 'x-sendfile':
+        response['X-Sendfile'] = path
+    else:
+        raise ValueError(f"Unknown MEDIA_SERVE_METHOD {method!r}.")
+    response['Cache-Control'] = cache_control()
+    return response
+
+
+def sharded_name_regex(directory):
+    return rf'^{directory}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[^/]+$'
+
+
+MEDIA_FIELDS = [
+    (Post, 'image', POST_IMAGES_UPLOAD_PATH),
+    (User, 'profile_picture', PROFILE_PICS_UPLOAD_PATH),
+]
+
+
+def unsharded_files(model, field_name, directory):
+    """Return the rows whose file is still stored under a flat or absolute name."""
+    return (
+        model.objects.exclude(**{field_name: ''})
+        .exclude(**{f'{field_name}__regex': sharded_name_regex(directory)})
+    )
+
+
+def keyset_batches(rows, batch_size):
+    """Yield lists of rows from a pk-ordered values_list, one page query at a time."""
+    last_pk = None
+    while True:
+        page = rows if last_pk is None else rows.filter(pk__gt=last_pk)
+        batch = list(page[:batch_size])
+        if not batch:
+            return
+        last_pk = batch[-1][0]
+        yield batch
+
+
+def relocate_batch(model, field_name, directory, rows, source):
+    """Copy the files of (pk, name) rows to sharded keys in default_storage; return (moved, missing)."""
+    moved = missing = 0
+    for pk, name in rows:
+        try:
+            with source.open(name, 'rb') as source_file:
+                extension = os.path.splitext(name)[1] or '.jpg'
+                new_name = default_storage.save(f"{directory}/{sharded_filename(extension)}", source_file)
+        except (FileNotFoundError, SuspiciousFileOperation):
+            missing += 1
+            continue
+        # Only switch rows whose file did not change meanwhile.
+        if model.objects.filter(pk=pk, **{field_name: name}).update(**{field_name: new_name}):
+            source.delete(name)
+            moved += 1
+        else:
+            default_storage.delete(new_name)
+    return moved, missing
+
+
+def _relocate_batch_in_thread(*args):
+    try:
+        return relocate_batch(*args)
+    finally:
+        connections.close_all()
+
+
+def relocate_media(workers=8, batch_size=100, source=None):
+    """Move every unsharded media file to a sharded key, batch_size rows per task on workers threads.
+
+    With workers=0 everything runs in the calling thread.
+
+    Files are read from source (FileSystemStorage under MEDIA_ROOT by default,
+    where the legacy names live) and written to default_storage, so this also
+    moves media to a new storage backend. Returns {directory: (moved, missing)}.
+    """
+    source = source or FileSystemStorage(location=settings.MEDIA_ROOT)
+    results = {}
+    for model, field_name, directory in MEDIA_FIELDS:
+        moved = missing = 0
+        rows = unsharded_files(model, field_name, directory).order_by('pk').values_list('pk', field_name)
+        if not workers:
+            for batch in keyset_batches(rows, batch_size):
+                batch_moved, batch_missing = relocate_batch(model, field_name, directory, batch, source)
+                moved += batch_moved
+                missing += batch_missing
+            results[directory] = (moved, missing)
+            continue
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+
+            def collect(done):
+                nonlocal moved, missing
+                for future in done:
+                    batch_moved, batch_missing = future.result()
+                    moved += batch_moved
+                    missing += batch_missing
+
+            for batch in keyset_batches(rows, batch_size):
+                # Keep a bounded number of batches in flight.
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(_relocate_batch_in_thread, model, field_name, directory, batch, source))
+            collect(wait(pending).done)
+        results[directory] = (moved, missing)
+    return results
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0004_account_deletion'),
+    ]
+
+    operations = [
+        # Added without auto_now_add first so that existing tags are left null
+        # instead of being stamped with the time of the migration.
+        migrations.AddField(
+            model_name='tag',
+            name='created',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+    ]
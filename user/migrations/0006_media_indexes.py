@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0005_tag_created'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, upload_to='post_images'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='profile_picture',
+            field=models.ImageField(blank=True, db_index=True, upload_to='profile_pictures'),
+        ),
+    ]
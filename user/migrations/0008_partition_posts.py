@@ -0,0 +1,216 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:03
+
+from datetime import datetime, timezone as dt_timezone
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def next_month(moment):
+    moment = moment.astimezone(dt_timezone.utc)
+    year, month = divmod(moment.year * 12 + moment.month, 12)
+    return datetime(year, month + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_posts(apps, schema_editor):
+    """Turn user_post into a table range-partitioned by date_created.
+
+    The existing table is renamed and attached as the partition
+    user_post_legacy for every date up to the next month, so its rows are
+    not copied. Its primary key becomes a unique index on
+    (id, date_created), built here unless one exists already; on a large
+    table create it beforehand with
+    CREATE UNIQUE INDEX CONCURRENTLY ON user_post (id, date_created)
+    and it is used as is. See user/partitions.py and the README.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    quote_name = schema_editor.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conrelid::regclass::text FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = 'user_post'::regclass"
+        )
+        referencing = [row[0] for row in cursor.fetchall()]
+        if referencing:
+            raise RuntimeError(f"Foreign keys of {', '.join(referencing)} still reference user_post.")
+
+        cursor.execute('LOCK TABLE user_post IN ACCESS EXCLUSIVE MODE')
+        cursor.execute('SELECT coalesce(max(id), 0), max(date_created) FROM user_post')
+        max_id, latest = cursor.fetchone()
+        cursor.execute(
+            "SELECT i.relname, pg_get_indexdef(i.oid), x.indisprimary FROM pg_index x "
+            "JOIN pg_class i ON i.oid = x.indexrelid WHERE x.indrelid = 'user_post'::regclass"
+        )
+        indexes = cursor.fetchall()
+        primary_key = next(name for name, _definition, primary in indexes if primary)
+        prebuilt = next((name for name, definition, _primary in indexes
+                         if definition.startswith('CREATE UNIQUE INDEX')
+                         and definition.endswith('USING btree (id, date_created)')), None)
+        indexes = [index for index in indexes if index[0] != prebuilt]
+        if prebuilt is None:
+            prebuilt = 'user_post_id_date_created_uniq'
+            cursor.execute(f'CREATE UNIQUE INDEX {prebuilt} ON user_post (id, date_created)')
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = 'user_post'::regclass AND contype = 'f'"
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            "SELECT attidentity FROM pg_attribute WHERE attrelid = 'user_post'::regclass AND attname = 'id'")
+        identity = cursor.fetchone()[0] != ''
+        cursor.execute("SELECT pg_get_serial_sequence('user_post', 'id')")
+        sequence = cursor.fetchone()[0]
+
+        # Partitions cannot have identity columns (before PostgreSQL 17), so
+        # ids come from a plain sequence owned by the partitioned table.
+        if identity:
+            cursor.execute('ALTER TABLE user_post ALTER COLUMN id DROP IDENTITY')
+            sequence = 'user_post_id_seq'
+            cursor.execute(f'CREATE SEQUENCE {sequence}')
+            cursor.execute('SELECT setval(%s, %s, %s)', [sequence, max(max_id, 1), max_id > 0])
+        else:
+            cursor.execute('ALTER TABLE user_post ALTER COLUMN id DROP DEFAULT')
+
+        # The indexes keep working on the legacy partition under new names;
+        # the partitioned table gets the original ones.
+        cursor.execute('ALTER TABLE user_post RENAME TO user_post_legacy')
+        for name, _definition, _primary in indexes:
+            cursor.execute(f'ALTER INDEX {quote_name(name)} RENAME TO {quote_name(("legacy_" + name)[:63])}')
+        # The unique index on (id, date_created) becomes the partition's
+        # primary key, which attaching it to the partitioned table's then
+        # reuses instead of building another.
+        cursor.execute(f'ALTER TABLE user_post_legacy DROP CONSTRAINT {quote_name(("legacy_" + primary_key)[:63])}')
+        cursor.execute(
+            f'ALTER TABLE user_post_legacy ADD CONSTRAINT user_post_legacy_pkey PRIMARY KEY USING INDEX {prebuilt}')
+
+        cursor.execute(
+            'CREATE TABLE user_post (LIKE user_post_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            'PARTITION BY RANGE (date_created)'
+        )
+        cursor.execute(f"ALTER TABLE user_post ALTER COLUMN id SET DEFAULT nextval('{sequence}'::regclass)")
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY user_post.id')
+        # A primary key of a partitioned table must include the partition key.
+        cursor.execute('ALTER TABLE user_post ADD CONSTRAINT user_post_pkey PRIMARY KEY (id, date_created)')
+        for _name, definition, primary in indexes:
+            if not primary:
+                cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE user_post ADD CONSTRAINT {quote_name(name)} {definition}')
+
+        upper = next_month(max(timezone.now(), latest or timezone.now()))
+        cursor.execute(
+            f"ALTER TABLE user_post ATTACH PARTITION user_post_legacy FOR VALUES FROM (MINVALUE) TO ('{upper.isoformat()}')")
+        cursor.execute('CREATE TABLE user_post_default PARTITION OF user_post DEFAULT')
+        for _month in range(settings.POST_PARTITIONS_AHEAD):
+            start, upper = upper, next_month(upper)
+            cursor.execute(
+                f"CREATE TABLE user_post_p{start:%Y_%m} PARTITION OF user_post "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{upper.isoformat()}')"
+            )
+
+
+def unpartition_posts(apps, schema_editor):
+    """Turn the partitioned user_post back into a plain table.
+
+    Unlike partition_posts(), this copies every row, and the table stays
+    locked while it does. Ids keep coming from the same sequence.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    quote_name = schema_editor.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute('LOCK TABLE user_post IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(
+            "SELECT pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE x.indrelid = 'user_post'::regclass AND NOT x.indisprimary"
+        )
+        indexes = [row[0].replace(' ON ONLY ', ' ON ') for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = 'user_post'::regclass AND contype = 'f'"
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute("SELECT pg_get_serial_sequence('user_post', 'id')")
+        sequence = cursor.fetchone()[0]
+
+        cursor.execute('CREATE TABLE user_post_plain (LIKE user_post INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute('INSERT INTO user_post_plain SELECT * FROM user_post')
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY user_post_plain.id')
+        cursor.execute('DROP TABLE user_post')
+        cursor.execute('ALTER TABLE user_post_plain RENAME TO user_post')
+        cursor.execute('ALTER TABLE user_post ADD CONSTRAINT user_post_pkey PRIMARY KEY (id)')
+        for definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE user_post ADD CONSTRAINT {quote_name(name)} {definition}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0007_feed_scores'),
+    ]
+
+    operations = [
+        # The existing m2m tables become explicit through models, so that
+        # their foreign keys to posts can be altered below.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PostLike',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='user.post')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'user_post_likes',
+                        'unique_together': {('post', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='post',
+                    name='likes',
+                    field=models.ManyToManyField(blank=True, related_name='liked_posts', through='user.PostLike', to=settings.AUTH_USER_MODEL),
+                ),
+                migrations.CreateModel(
+                    name='PostTag',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='user.post')),
+                        ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='user.tag')),
+                    ],
+                    options={
+                        'db_table': 'user_post_tags',
+                        'unique_together': {('post', 'tag')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='post',
+                    name='tags',
+                    field=models.ManyToManyField(blank=True, related_name='posts', through='user.PostTag', to='user.tag'),
+                ),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='postlike',
+            name='post',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='user.post'),
+        ),
+        migrations.AlterField(
+            model_name='posttag',
+            name='post',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='user.post'),
+        ),
+        migrations.AlterField(
+            model_name='postscore',
+            name='post',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='user.post'),
+        ),
+        migrations.RunPython(partition_posts, unpartition_posts),
+    ]
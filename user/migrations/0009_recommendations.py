@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0008_partition_posts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendedPosts',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('post_ids', models.BinaryField()),
+                ('updated', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SimilarPosts',
+            fields=[
+                ('post', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='user.post')),
+                ('post_ids', models.BinaryField()),
+                ('similarities', models.BinaryField()),
+                ('updated', models.DateTimeField()),
+            ],
+        ),
+    ]
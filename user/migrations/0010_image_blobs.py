@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0009_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('source_sha256', models.CharField(db_index=True, max_length=64)),
+                ('dhash_0', models.PositiveIntegerField(db_index=True)),
+                ('dhash_1', models.PositiveIntegerField(db_index=True)),
+                ('dhash_2', models.PositiveIntegerField(db_index=True)),
+                ('dhash_3', models.PositiveIntegerField(db_index=True)),
+                ('width', models.PositiveSmallIntegerField()),
+                ('height', models.PositiveSmallIntegerField()),
+                ('fingerprint', models.BinaryField()),
+                ('size', models.PositiveIntegerField()),
+                ('references', models.PositiveIntegerField(default=1)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def set_latest_post_ids(apps, schema_editor):
+    Follow = apps.get_model('user', 'Follow')
+    Post = apps.get_model('user', 'Post')
+    latest = Post.objects.filter(user_id=OuterRef('from_user_id')).order_by('-id').values('id')[:1]
+    Follow.objects.update(latest_post_id=Coalesce(Subquery(latest), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0010_image_blobs'),
+    ]
+
+    operations = [
+        # The existing follows table becomes an explicit through model, so
+        # that it can hold the followed author's latest post id.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Follow',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('from_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                        ('to_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'user_user_followers',
+                        'unique_together': {('from_user', 'to_user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='user',
+                    name='followers',
+                    field=models.ManyToManyField(blank=True, related_name='following', through='user.Follow', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='follow',
+            name='latest_post_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', 'id'], name='user_post_user_id_id_idx'),
+        ),
+        migrations.RunPython(set_latest_post_ids, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['to_user', 'latest_post_id'], name='user_follow_feed_head_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0011_feed_heads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataexport',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dataexport',
+            name='lease_token',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0012_data_export_lease'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='user',
+            options={'verbose_name_plural': 'Users'},
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(max_length=255),
+        ),
+    ]
@@ -1,16 +1,16 @@
 import os
 import uuid
+from functools import partial
 from io import BytesIO
 
-from PIL import Image
-
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from django.core.files import File
 from django.core.files.storage import default_storage
 from django.core.validators import FileExtensionValidator, MinLengthValidator
 from django.core.exceptions import ValidationError
 import uuid
-from app import settings
+from core.metrics import IMAGE_PROCESSING_DURATION
 
 
 # Constants at the module level, may be moved to constants.py in the future
@@ -21,26 +21,45 @@ PROFILE_PIC_SIZE_TUPLE = (300, 300)
 
 def prepare_image(image, size_tuple=PROFILE_PIC_SIZE_TUPLE):
     """Helper function to resize the image and return a BytesIO object."""
-    img = Image.open(image)
-    img.thumbnail(size_tuple)
+    # Pillow is slow to import and only needed for uploads, so it is not
+    # imported with the models (see core/startup.py).
+    from PIL import Image
+
+    with IMAGE_PROCESSING_DURATION.time():
+        img = Image.open(image)
+        img.thumbnail(size_tuple)
+        return encode_image(img)
+
+
+def encode_image(img):
+    """Helper function to encode a PIL image as the JPEG stored for uploads."""
     output = BytesIO()
     img.save(output, format='JPEG', quality=80)
     output.seek(0)
     return output
 
 
-def save_image_to_location(image, destination):
-    """Helper function to save the image to the given location using default_storage."""
-    with default_storage.open(destination, 'wb') as destination_file:
-        destination_file.write(image.getvalue())
+def sharded_filename(extension='.jpg'):
+    """Helper function to generate a random file name under two levels of hashed
+    subdirectories, e.g. '3f/a2/3fa2...jpg', so no directory grows too large."""
+    digest = uuid.uuid4().hex
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{extension}"
 
 
-def move_image_to_permanent_location(image, destination):
-    """Helper function to move the image to its final destination using default_storage."""
-    with default_storage.open(image, 'rb') as temp_file:
-        save_image_to_location(temp_file, destination)
-    # Delete the temporary file
-    default_storage.delete(image)
+def store_resized_image(field_file, size_tuple=PROFILE_PIC_SIZE_TUPLE):
+    """Helper function to store a resized copy of a new upload, instead of the original,
+    under a sharded storage key relative to the field's upload_to directory."""
+    resized = prepare_image(field_file, size_tuple)
+    field_file.save(sharded_filename(), File(resized), save=False)
+
+
+def replace_stored_file(instance, field_name):
+    """Helper function to delete the file an instance's new upload replaces, once saved."""
+    if instance.pk is None:
+        return
+    previous = type(instance).objects.filter(pk=instance.pk).values_list(field_name, flat=True).first()
+    if previous:
+        transaction.on_commit(partial(default_storage.delete, previous))
 
 
 def generate_image_filename(instance, filename):
@@ -92,56 +111,121 @@ class User(AbstractBaseUser, PermissionsMixin):
     """Custom User model for the social media app."""
 
     email = models.EmailField(unique=True)
-    profile_picture = models.ImageField(upload_to=PROFILE_PICS_UPLOAD_PATH, blank=True)
+    profile_picture = models.ImageField(upload_to=PROFILE_PICS_UPLOAD_PATH, blank=True, db_index=True)
     bio = models.CharField(max_length=255, blank=True)
     is_staff = models.BooleanField(default=False)
-    followers = models.ManyToManyField('self', symmetrical=False, blank=True, related_name='following')
+    # Cleared as soon as the account is scheduled for deletion (see deletion.py).
+    is_active = models.BooleanField(default=True)
+    # Bumped to invalidate every signed access token issued to the user.
+    permissions_version = models.PositiveIntegerField(default=0)
+    followers = models.ManyToManyField('self', symmetrical=False, blank=True, related_name='following',
+                                       through='Follow')
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
+    # Fields signed access tokens carry; changing one revokes them (see signals.py).
+    ACCESS_FIELDS = ('is_active', 'is_staff', 'is_superuser')
 
     def __str__(self):
         return self.email
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        user._loaded_access = user.access_values()
+        return user
+
+    def access_values(self):
+        """Return the loaded values of ACCESS_FIELDS, without loading deferred ones."""
+        return {name: self.__dict__[name] for name in self.ACCESS_FIELDS if name in self.__dict__}
+
     def save(self, *args, **kwargs):
+        # Only a newly assigned upload is resized and stored.
+        if self.profile_picture and not self.profile_picture._committed:
+            replace_stored_file(self, 'profile_picture')
+            store_resized_image(self.profile_picture)
         super().save(*args, **kwargs)
 
-        if self.profile_picture:
-            temp_image = prepare_image(self.profile_picture.path)
-            permanent_file_path = os.path.join(settings.MEDIA_ROOT, PROFILE_PICS_UPLOAD_PATH, f"{self.id}.jpg")
-            save_image_to_location(temp_image, permanent_file_path)
-            move_image_to_permanent_location(self.profile_picture.path, permanent_file_path)
-            self.profile_picture.name = permanent_file_path
+    class Meta:
+        verbose_name_plural = 'Users'
+
+
+class Follow(models.Model):
+    """to_user follows from_user.
 
-            self.save(update_fields=['profile_picture'])
+    latest_post_id is the id of from_user's newest post, indexed with the
+    follower so that checking a feed for new posts is one index lookup;
+    see feed.py."""
+    from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    latest_post_id = models.BigIntegerField(default=0)
 
     class Meta:
-        verbose_name_plural = 'Users'
+        db_table = 'user_user_followers'
+        unique_together = [('from_user', 'to_user')]
+        indexes = [
+            models.Index(fields=['to_user', 'latest_post_id'], name='user_follow_feed_head_idx'),
+        ]
 
 
 class Post(models.Model):
     """Post model for the social media app."""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     text = models.CharField(max_length=255, blank=False)
-    image = models.ImageField(upload_to=POST_IMAGES_UPLOAD_PATH, blank=True)
+    image = models.ImageField(upload_to=POST_IMAGES_UPLOAD_PATH, blank=True, db_index=True)
     date_created = models.DateTimeField(auto_now_add=True)
-    tags = models.ManyToManyField('Tag', blank=True, related_name='posts')
-    likes = models.ManyToManyField(User, blank=True, related_name='liked_posts')
+    tags = models.ManyToManyField('Tag', blank=True, related_name='posts', through='PostTag')
+    likes = models.ManyToManyField(User, blank=True, related_name='liked_posts', through='PostLike')
+
+    class Meta:
+        indexes = [
+            # Posts of followed authors newer than a given id (see feed.py).
+            models.Index(fields=['user', 'id'], name='user_post_user_id_id_idx'),
+        ]
 
     def __str__(self):
         return self.text
 
     def save(self, *args, **kwargs):
+        # Only a newly assigned upload is resized and stored, or shares the
+        # copy of an identical or near-identical image (see images.py).
+        if self.image and not self.image._committed:
+            from .images import delete_stored_images_on_error, release_image, store_post_image
+
+            with delete_stored_images_on_error(), transaction.atomic():
+                previous = None
+                if self.pk is not None:
+                    previous = Post.objects.filter(pk=self.pk).values_list('image', flat=True).first()
+                self.image = store_post_image(self.image)
+                super().save(*args, **kwargs)
+                if previous:
+                    release_image(previous)
+            return
         super().save(*args, **kwargs)
 
-        if self.image:
-            temp_image = prepare_image(self.image.path)
-            permanent_file_path = os.path.join(settings.MEDIA_ROOT, POST_IMAGES_UPLOAD_PATH, f"{self.id}.jpg")
-            save_image_to_location(temp_image, permanent_file_path)
-            move_image_to_permanent_location(self.image.path, permanent_file_path)
-            self.image.name = permanent_file_path
 
-            self.save(update_fields=['image'])
+class PostTag(models.Model):
+    """A tag of a post.
+
+    On PostgreSQL posts are partitioned by date_created (see partitions.py),
+    and their primary key includes it, so post ids cannot be referenced by a
+    database constraint; deletes cascade through the ORM only."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+', db_constraint=False)
+    tag = models.ForeignKey('Tag', on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        db_table = 'user_post_tags'
+        unique_together = [('post', 'tag')]
+
+
+class PostLike(models.Model):
+    """A like of a post; see PostTag."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+', db_constraint=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        db_table = 'user_post_likes'
+        unique_together = [('post', 'user')]
 
 
 class Tag(models.Model):
@@ -150,6 +234,149 @@ class Tag(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True,
                             related_name='tags')
     name = models.CharField(max_length=255, blank=False)
+    # Null for tags created before this field existed.
+    created = models.DateTimeField(auto_now_add=True, null=True)
 
     def __str__(self):
         return self.name
+
+
+class DecayedScore(models.Model):
+    """A sum of events, each worth 1 when recorded and halving every half-life.
+
+    Stored as its value at `updated`; see ranking.py."""
+    value = models.FloatField(default=0)
+    updated = models.DateTimeField()
+
+    class Meta:
+        abstract = True
+
+
+class PostScore(DecayedScore):
+    """Recency-decayed likes of a post."""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='score',
+                                db_constraint=False)
+
+
+class AuthorAffinity(DecayedScore):
+    """Recency-decayed likes a user gave to an author's posts."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'], name='unique_author_affinity'),
+        ]
+
+
+class SimilarPosts(models.Model):
+    """The posts most liked by the same users as a post, best first.
+
+    Stored as packed arrays of post ids and similarities; see recommendations.py."""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='+',
+                                db_constraint=False)
+    post_ids = models.BinaryField()
+    similarities = models.BinaryField()
+    updated = models.DateTimeField()
+
+
+class RecommendedPosts(models.Model):
+    """The posts recommended to a user, best first, as a packed array of ids."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    post_ids = models.BinaryField()
+    updated = models.DateTimeField()
+
+
+class ImageBlob(models.Model):
+    """A stored post image, shared by every post whose upload was the same or a near-identical picture.
+
+    The dHash of the image is kept as four indexed 16-bit segments; see images.py."""
+    name = models.CharField(max_length=100, unique=True)
+    sha256 = models.CharField(max_length=64, unique=True)
+    # Of the upload the image was first stored from.
+    source_sha256 = models.CharField(max_length=64, db_index=True)
+    dhash_0 = models.PositiveIntegerField(db_index=True)
+    dhash_1 = models.PositiveIntegerField(db_index=True)
+    dhash_2 = models.PositiveIntegerField(db_index=True)
+    dhash_3 = models.PositiveIntegerField(db_index=True)
+    width = models.PositiveSmallIntegerField()
+    height = models.PositiveSmallIntegerField()
+    fingerprint = models.BinaryField()
+    size = models.PositiveIntegerField()
+    references = models.PositiveIntegerField(default=1)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def dhash(self):
+        return self.dhash_0 | self.dhash_1 << 16 | self.dhash_2 << 32 | self.dhash_3 << 48
+
+
+class RefreshToken(models.Model):
+    """Long-lived token exchanged for signed access tokens, stored hashed."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='refresh_tokens')
+    token_hash = models.CharField(max_length=64, unique=True)
+    created = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    revoked = models.BooleanField(default=False)
+
+
+class RevokedAccessToken(models.Model):
+    """Revoked access token id, or user permissions version, kept until the tokens expire."""
+    key = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+
+class DataExport(models.Model):
+    """Archive of a user's own data, built in the background (see exports.py)."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='data_exports')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    size = models.PositiveBigIntegerField(default=0)
+    # The worker building a running export holds it until lease_expires.
+    lease_token = models.CharField(max_length=32, blank=True)
+    lease_expires = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def filename(self):
+        return f"export-{self.user_id}-{self.pk}.zip"
+
+
+class AccountDeletion(models.Model):
+    """Progress of deleting an account in the background (see deletion.py)."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+    ]
+
+    # Not a foreign key: the record outlives the user row.
+    user_id = models.PositiveBigIntegerField(unique=True)
+    email = models.EmailField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    stage = models.CharField(max_length=20, blank=True)
+    deleted_rows = models.PositiveBigIntegerField(default=0)
+    deleted_files = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.email} ({self.status})"
@@ -0,0 +1,147 @@
+"""Monthly range partitions of the posts table (PostgreSQL only).
+
+Migration 0008 turns user_post into a table partitioned by date_created.
+The rows it held stay where they are, attached as the partition
+user_post_legacy, which covers every date up to the month after the
+migration. Later posts go to one partition per calendar month (UTC), named
+user_post_pYYYY_MM. Filters on date_created then only scan the months they
+cover, and a month can be detached or dropped as a whole.
+
+ensure_partitions(), run periodically by `manage.py create_post_partitions`,
+creates the partitions of the current month and the next
+POST_PARTITIONS_AHEAD months. Posts outside every month partition land in
+user_post_default. This happens if the command did not run in time, or for
+posts dated in the far future. The next run moves them into the partitions
+it creates.
+
+The primary key of a partitioned table must include the partition key, so
+it is (id, date_created) and post ids cannot be referenced by foreign key
+constraints. Likes, tags and scores refer to posts without one, and
+deletes cascade through the ORM as before. For the same reason PostgreSQL
+rejects queries grouping posts by id alone, which is what Django emits for
+annotate(Count(...)) over posts; count in a correlated subquery or group
+the related table instead.
+"""
+import json
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .models import Post
+
+TABLE = Post._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def uses_partitions(using=None):
+    """Return whether the posts table of the database is partitioned."""
+    connection = connections[using or router.db_for_write(Post)]
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def month_start(moment):
+    moment = moment.astimezone(dt_timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(start, months):
+    month = start.month - 1 + months
+    return start.replace(year=start.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(start):
+    return f'{TABLE}_p{start:%Y_%m}'
+
+
+def bound(moment):
+    # Bounds are literals in DDL, which takes no query parameters.
+    return f"'{moment.isoformat()}'"
+
+
+def partitions(cursor):
+    """Return {name: bound expression} for the partitions of the posts table."""
+    cursor.execute(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass",
+        [TABLE],
+    )
+    return dict(cursor.fetchall())
+
+
+def covered_until(bounds):
+    """Return the highest upper bound of the range partitions, or None."""
+    uppers = [datetime.fromisoformat(match.group(1)) for match in map(UPPER_BOUND.search, bounds) if match]
+    return max(uppers, default=None)
+
+
+def create_partition(cursor, start, has_default):
+    """Create the partition of the month starting at start.
+
+    Posts of that month in the default partition are moved into it first,
+    since a partition cannot be attached over rows the default one holds.
+    """
+    name = partition_name(start)
+    lower, upper = bound(start), bound(add_months(start, 1))
+    quote_name = cursor.db.ops.quote_name
+    if not has_default:
+        cursor.execute(
+            f'CREATE TABLE {quote_name(name)} PARTITION OF {quote_name(TABLE)} FOR VALUES FROM ({lower}) TO ({upper})')
+        return
+    cursor.execute(f'CREATE TABLE {quote_name(name)} (LIKE {quote_name(TABLE)} INCLUDING DEFAULTS)')
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {quote_name(DEFAULT_PARTITION)} '
+        f'WHERE date_created >= {lower} AND date_created < {upper} RETURNING *) '
+        f'INSERT INTO {quote_name(name)} SELECT * FROM moved'
+    )
+    cursor.execute(
+        f'ALTER TABLE {quote_name(TABLE)} ATTACH PARTITION {quote_name(name)} FOR VALUES FROM ({lower}) TO ({upper})')
+
+
+def ensure_partitions(now=None, ahead=None, using=None):
+    """Create the missing month partitions up to `ahead` months from now; return their names."""
+    using = using or router.db_for_write(Post)
+    if not uses_partitions(using):
+        return []
+    now = now or timezone.now()
+    ahead = settings.POST_PARTITIONS_AHEAD if ahead is None else ahead
+    end = add_months(month_start(now), ahead + 1)
+    created = []
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        # Serializes runs, and keeps posts from landing in the default
+        # partition between moving its rows out and attaching a month.
+        cursor.execute('LOCK TABLE %s IN SHARE ROW EXCLUSIVE MODE' % cursor.db.ops.quote_name(TABLE))
+        existing = partitions(cursor)
+        start = covered_until(existing.values()) or month_start(now)
+        while start < end:
+            create_partition(cursor, start, DEFAULT_PARTITION in existing)
+            created.append(partition_name(start))
+            start = add_months(start, 1)
+    return created
+
+
+def scanned_partitions(queryset):
+    """Return the partitions of the posts table that PostgreSQL plans to scan for queryset."""
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        names = set(partitions(cursor))
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    scanned = set()
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if node.get('Relation Name') in names:
+            scanned.add(node['Relation Name'])
+        nodes.extend(node.get('Plans', []))
+    return scanned
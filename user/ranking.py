@@ -0,0 +1,158 @@
+"""Engagement-ranked ("top") feed.
+
+Ranking the followed accounts' posts with annotate(Count('likes')) counts
+every like of every candidate on each request. Instead, scores are updated
+as likes arrive (UserLikePostView calls record_like and record_unlike):
+
+- PostScore holds a post's likes, each worth 1 when given and halving every
+  FEED_TOP_LIKE_HALF_LIFE seconds;
+- AuthorAffinity holds the likes a user gave to an author's posts, halving
+  every FEED_TOP_AFFINITY_HALF_LIFE seconds.
+
+A decayed value is stored with the time it was last updated, which is
+enough to compute it at any later time, so no periodic job is needed.
+top_feed() loads at most FEED_TOP_CANDIDATES posts of the followed accounts
+from the last FEED_TOP_WINDOW seconds, with their scores, and the reader's
+affinities, then ranks them in one pass by
+
+    (1 + likes) * (1 + FEED_TOP_AFFINITY_WEIGHT * affinity) * 0.5 ** (age / FEED_TOP_AGE_HALF_LIFE)
+"""
+import heapq
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import AuthorAffinity, Post, PostLike, PostScore
+
+
+def decayed(value, updated, now, half_life):
+    """Return a value stored at datetime updated as of datetime now."""
+    if not value:
+        return 0.0
+    return value * 0.5 ** ((now - updated).total_seconds() / half_life)
+
+
+def add_to_score(model, lookup, delta, now, half_life):
+    """Add delta to the decayed score of the row matching lookup, never going below zero.
+
+    Removing an event subtracts a whole fresh event, as the time of the
+    original is not known; for an event that has decayed this takes off
+    slightly too much, which only errs against repeated like/unlike.
+    """
+    with transaction.atomic():
+        score, created = model.objects.select_for_update().get_or_create(
+            **lookup, defaults={'value': max(delta, 0), 'updated': now})
+        if not created:
+            score.value = max(decayed(score.value, score.updated, now, half_life) + delta, 0)
+            score.updated = now
+            score.save(update_fields=['value', 'updated'])
+
+
+def record_like(user, post, delta=1):
+    """Update the scores for a like (or, with delta=-1, an unlike) of post by user."""
+    now = timezone.now()
+    add_to_score(PostScore, {'post_id': post.id}, delta, now, settings.FEED_TOP_LIKE_HALF_LIFE)
+    add_to_score(AuthorAffinity, {'user_id': user.id, 'author_id': post.user_id}, delta, now,
+                 settings.FEED_TOP_AFFINITY_HALF_LIFE)
+
+
+def record_unlike(user, post):
+    record_like(user, post, delta=-1)
+
+
+def candidate_posts(user, now):
+    """Return (id, author id, created, likes, likes updated) of the posts that may be ranked."""
+    since = now - timedelta(seconds=settings.FEED_TOP_WINDOW)
+    return (
+        Post.objects.filter(user__in=user.following.all(), date_created__gte=since)
+        .order_by('-id')
+        .values_list('id', 'user_id', 'date_created', 'score__value', 'score__updated')
+        [:settings.FEED_TOP_CANDIDATES]
+    )
+
+
+def author_affinities(user):
+    return AuthorAffinity.objects.filter(user=user).values_list('author_id', 'value', 'updated')
+
+
+def rank(candidates, affinities, now, limit=None):
+    """Return the ids of the best limit candidate posts, best first.
+
+    candidates and affinities are rows of candidate_posts() and
+    author_affinities(). Ties go to the newer post.
+    """
+    if not candidates:
+        return []
+    # Halving every half-life is exp(rate * elapsed) with a negative rate.
+    like_rate = -math.log(2) / settings.FEED_TOP_LIKE_HALF_LIFE
+    affinity_rate = -math.log(2) / settings.FEED_TOP_AFFINITY_HALF_LIFE
+    age_rate = -math.log(2) / settings.FEED_TOP_AGE_HALF_LIFE
+    weight = settings.FEED_TOP_AFFINITY_WEIGHT
+    now_ts = now.timestamp()
+    exp = math.exp
+
+    boost = {
+        author_id: 1 + weight * value * exp((now_ts - updated.timestamp()) * affinity_rate)
+        for author_id, value, updated in affinities
+    }
+    scored = [
+        (
+            (1 + (value * exp((now_ts - updated.timestamp()) * like_rate) if value else 0))
+            * boost.get(author_id, 1)
+            * exp((now_ts - created.timestamp()) * age_rate),
+            post_id,
+        )
+        for post_id, author_id, created, value, updated in candidates
+    ]
+    return [post_id for _score, post_id in heapq.nlargest(limit or len(scored), scored)]
+
+
+def top_feed(user, now=None):
+    """Return the ids of the user's top feed posts, best first."""
+    now = now or timezone.now()
+    return rank(list(candidate_posts(user, now)), list(author_affinities(user)), now,
+                limit=settings.FEED_TOP_SIZE)
+
+
+def in_order(ids, posts):
+    """Return posts sorted like their ids in ids."""
+    posts = {post.id: post for post in posts}
+    return [posts[post_id] for post_id in ids if post_id in posts]
+
+
+def rebuild_scores(now=None):
+    """Recompute the scores of recent posts and all affinities from the likes table.
+
+    Likes have no timestamp, so each is taken as given when its post was
+    created; an affinity is dated by the newest post it counts. Meant to
+    seed the scores once, e.g. after they were introduced.
+    """
+    now = now or timezone.now()
+    since = now - timedelta(seconds=settings.FEED_TOP_WINDOW)
+    post_scores = [
+        PostScore(post_id=post_id, value=likes, updated=created)
+        for post_id, created, likes in (
+            # Grouped on the likes table: partitioned posts cannot be grouped
+            # by id alone on PostgreSQL (see partitions.py).
+            PostLike.objects.filter(post__date_created__gte=since).values('post_id', 'post__date_created')
+            .annotate(like_count=Count('id')).values_list('post_id', 'post__date_created', 'like_count').iterator()
+        )
+    ]
+    affinities = [
+        AuthorAffinity(user_id=user_id, author_id=author_id, value=likes, updated=newest)
+        for user_id, author_id, likes, newest in (
+            Post.likes.through.objects.values('user_id', 'post__user_id')
+            .annotate(like_count=Count('id'), newest=Max('post__date_created'))
+            .values_list('user_id', 'post__user_id', 'like_count', 'newest').iterator()
+        )
+    ]
+    with transaction.atomic():
+        PostScore.objects.all().delete()
+        PostScore.objects.bulk_create(post_scores, batch_size=1000)
+        AuthorAffinity.objects.all().delete()
+        AuthorAffinity.objects.bulk_create(affinities, batch_size=1000)
+    return len(post_scores), len(affinities)
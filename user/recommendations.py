@@ -0,0 +1,230 @@
+"""Item-based post recommendations from the likes matrix.
+
+The likes of posts from the last RECOMMENDATION_WINDOW seconds form a
+sparse user x post matrix, held as one array of post ids per user (their
+RECOMMENDATION_HISTORY_SIZE newest likes) and one array of user ids per
+post (at most RECOMMENDATION_MAX_LIKERS). Two posts are similar when the
+same users liked them: the similarity is the cosine of their columns,
+
+    likers in common / sqrt(likers of one * likers of the other)
+
+For each post, the co-like counts with every other post are summed with
+Counter.update() over its likers' arrays, which counts in C. The
+RECOMMENDATION_NEIGHBOURS most similar posts are kept in SimilarPosts.
+Only the 4 x RECOMMENDATION_NEIGHBOURS posts with the most likers in common
+are scored by cosine, since scoring every co-liked post would take most
+of the build time.
+
+A user's recommendations are the posts most similar to their
+RECOMMENDATION_SEEDS newest likes, similarities summed. They are stored
+in RecommendedPosts as one packed array of RECOMMENDATION_SIZE ids, 8 bytes
+a post, so serving them takes a primary key lookup.
+
+`manage.py refresh_recommendations`, run on a schedule, recomputes the
+posts whose similarities may have changed since the last run: those whose
+likes changed (their PostScore was updated) and every post in the history
+of a user who liked them or who liked or unliked anything since, since
+their likers in common or the cosine norms changed. It then recomputes the
+users seeded by any of these posts, and drops the rows of posts that left
+the window; posts that left it are also never served. An incremental run
+misses only what the caps hide: a post pushed out of a user's
+RECOMMENDATION_HISTORY_SIZE newest likes, or left out of a post's
+RECOMMENDATION_MAX_LIKERS, is caught up by --full, which rebuilds
+everything and drops rows for users no longer in the window.
+"""
+import heapq
+import math
+from array import array
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .likes import liked_among
+from .models import AuthorAffinity, Post, PostScore, RecommendedPosts, SimilarPosts
+from .ranking import in_order
+
+BATCH_SIZE = 1000
+
+
+def pack(typecode, values):
+    return array(typecode, values).tobytes()
+
+
+def unpack(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    return values
+
+
+def window_start(now):
+    return now - timedelta(seconds=settings.RECOMMENDATION_WINDOW)
+
+
+class LikesMatrix:
+    """Sparse user x post matrix of likes, stored by row and by column."""
+
+    def __init__(self, histories, likers):
+        self.histories = histories
+        self.likers = likers
+
+    @classmethod
+    def from_rows(cls, rows, history_size, max_likers):
+        """Build the matrix from (user id, post id) rows grouped by user, newest like first."""
+        histories = {}
+        current = history = None
+        for user_id, post_id in rows:
+            if user_id != current:
+                current = user_id
+                history = histories[user_id] = array('q')
+            if len(history) < history_size:
+                history.append(post_id)
+        likers = {}
+        for user_id, history in histories.items():
+            for post_id in history:
+                column = likers.get(post_id)
+                if column is None:
+                    column = likers[post_id] = array('q')
+                if len(column) < max_likers:
+                    column.append(user_id)
+        return cls(histories, likers)
+
+    @classmethod
+    def load(cls, now):
+        rows = (
+            Post.likes.through.objects.filter(post__date_created__gte=window_start(now))
+            .order_by('user_id', '-id').values_list('user_id', 'post_id').iterator(chunk_size=10_000)
+        )
+        return cls.from_rows(rows, settings.RECOMMENDATION_HISTORY_SIZE, settings.RECOMMENDATION_MAX_LIKERS)
+
+
+def similar_posts(matrix, post_id, size):
+    """Return the size posts most similar to post_id as (similarity, post id), best first."""
+    histories, likers = matrix.histories, matrix.likers
+    counts = Counter()
+    for user_id in likers[post_id]:
+        counts.update(histories[user_id])
+    del counts[post_id]
+    candidates = counts
+    if len(counts) > 4 * size:
+        candidates = sorted(counts, key=counts.__getitem__, reverse=True)[:4 * size]
+    norm = len(likers[post_id])
+    sqrt = math.sqrt
+    return heapq.nlargest(size, (
+        (counts[other] / sqrt(norm * len(likers[other])), other) for other in candidates))
+
+
+def neighbour_rows(matrix, post_ids):
+    """Return {post id: (similar post ids, similarities)} arrays for post_ids."""
+    size = settings.RECOMMENDATION_NEIGHBOURS
+    rows = {}
+    for post_id in post_ids:
+        similar = similar_posts(matrix, post_id, size)
+        rows[post_id] = (array('q', [other for _similarity, other in similar]),
+                         array('f', [similarity for similarity, _other in similar]))
+    return rows
+
+
+def recommend(history, neighbours, size):
+    """Return the ids of the size posts most similar to the history's newest likes, best first.
+
+    neighbours maps post ids to (post ids, similarities) arrays.
+    """
+    scores = {}
+    get = scores.get
+    for post_id in history[:settings.RECOMMENDATION_SEEDS]:
+        row = neighbours.get(post_id)
+        if row is None:
+            continue
+        for other, similarity in zip(*row):
+            scores[other] = get(other, 0.0) + similarity
+    for post_id in history:
+        scores.pop(post_id, None)
+    # size is a large share of the candidates, so sorting them all beats a heap.
+    return [post_id for _score, post_id in sorted(zip(scores.values(), scores.keys()), reverse=True)[:size]]
+
+
+def load_neighbours(post_ids):
+    neighbours = {}
+    post_ids = list(post_ids)
+    for start in range(0, len(post_ids), BATCH_SIZE):
+        for post_id, ids, similarities in SimilarPosts.objects.filter(
+                post_id__in=post_ids[start:start + BATCH_SIZE]).values_list('post_id', 'post_ids', 'similarities'):
+            neighbours[post_id] = (unpack('q', ids), unpack('f', similarities))
+    return neighbours
+
+
+def save_similar_posts(rows, now):
+    SimilarPosts.objects.bulk_create(
+        (SimilarPosts(post_id=post_id, post_ids=ids.tobytes(), similarities=similarities.tobytes(), updated=now)
+         for post_id, (ids, similarities) in rows.items()),
+        batch_size=BATCH_SIZE, update_conflicts=True, unique_fields=['post'],
+        update_fields=['post_ids', 'similarities', 'updated'],
+    )
+
+
+def save_recommendations(recommendations, now):
+    RecommendedPosts.objects.bulk_create(
+        (RecommendedPosts(user_id=user_id, post_ids=pack('q', post_ids), updated=now)
+         for user_id, post_ids in recommendations.items()),
+        batch_size=BATCH_SIZE, update_conflicts=True, unique_fields=['user'],
+        update_fields=['post_ids', 'updated'],
+    )
+
+
+def refresh_recommendations(full=False, now=None):
+    """Recompute similar posts and recommendations that may have changed; return their counts."""
+    now = now or timezone.now()
+    since = None if full else SimilarPosts.objects.aggregate(Max('updated'))['updated__max']
+    matrix = LikesMatrix.load(now)
+    if since is None:
+        dirty = set(matrix.likers)
+        users = set(matrix.histories)
+    else:
+        changed = set(PostScore.objects.filter(updated__gt=since).values_list('post_id', flat=True))
+        dirty = changed & matrix.likers.keys()
+        # Posts that lost their last like in the window have no neighbours left.
+        SimilarPosts.objects.filter(post_id__in=changed - dirty).delete()
+        SimilarPosts.objects.filter(post__date_created__lt=window_start(now)).delete()
+        users = matrix.histories.keys() & set(
+            AuthorAffinity.objects.filter(updated__gt=since).values_list('user_id', flat=True))
+        for post_id in dirty:
+            users.update(matrix.likers[post_id])
+        # Every post co-liked with a changed one has new counts or norms.
+        for user_id in users:
+            dirty.update(matrix.histories[user_id])
+        seeds = settings.RECOMMENDATION_SEEDS
+        for post_id in dirty:
+            users.update(user_id for user_id in matrix.likers[post_id]
+                         if post_id in matrix.histories[user_id][:seeds])
+
+    neighbours = neighbour_rows(matrix, dirty)
+    save_similar_posts(neighbours, now)
+
+    seeds = {post_id for user_id in users for post_id in matrix.histories[user_id][:settings.RECOMMENDATION_SEEDS]}
+    neighbours.update(load_neighbours(seeds - neighbours.keys()))
+    save_recommendations({
+        user_id: recommend(matrix.histories[user_id], neighbours, settings.RECOMMENDATION_SIZE)
+        for user_id in users
+    }, now)
+    if since is None:
+        SimilarPosts.objects.filter(updated__lt=now).delete()
+        RecommendedPosts.objects.filter(updated__lt=now).delete()
+    return len(dirty), len(users)
+
+
+def recommended_posts(user, limit):
+    """Return up to limit recommended posts for user, best first, leaving out their own, liked and expired ones."""
+    data = RecommendedPosts.objects.filter(user=user).values_list('post_ids', flat=True).first()
+    if data is None:
+        return []
+    ids = list(unpack('q', data))
+    liked = liked_among(user, ids)
+    ids = [post_id for post_id in ids if post_id not in liked]
+    posts = (
+        Post.objects.filter(id__in=ids, date_created__gte=window_start(timezone.now()))
+        .exclude(user=user).prefetch_related('tags')
+    )
+    return in_order(ids, posts)[:limit]
@@ -1,6 +1,9 @@
 from rest_framework import serializers
-from .models import User, Post, Tag
+from .likes import liked_among
+from .models import User, Post, Tag, DataExport
 from django.contrib.auth import get_user_model, authenticate
+from django.db import models
+from django.urls import reverse
 from django.utils.translation import gettext as _
 
 class TagSerializer(serializers.ModelSerializer):
@@ -21,13 +24,34 @@ class TagSerializer(serializers.ModelSerializer):
             tag = Tag.objects.create(name=tag_name, user=user)
 
         return tag
+class PostListSerializer(serializers.ListSerializer):
+    """Looks up which posts of the list the requesting user liked all at once."""
+
+    def to_representation(self, data):
+        posts = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        request = self.context.get('request')
+        self.child.liked_post_ids = liked_among(
+            request.user if request else None, [post.id for post in posts])
+        return super().to_representation(posts)
+
+
 class PostSerializer(serializers.ModelSerializer):
     """Serializer for the Post object."""
     tags = TagSerializer(many=True, required=False)
+    liked_by_me = serializers.SerializerMethodField()
+    liked_post_ids = None
+
     class Meta:
         model = Post
-        fields = ['id', 'text', 'image', 'date_created', 'user', 'tags', 'likes']
-        read_only_fields = ['id', 'date_created', 'user', 'likes']
+        fields = ['id', 'text', 'image', 'date_created', 'user', 'tags', 'liked_by_me']
+        read_only_fields = ['id', 'date_created', 'user']
+        list_serializer_class = PostListSerializer
+
+    def get_liked_by_me(self, post):
+        if self.liked_post_ids is None:
+            request = self.context.get('request')
+            return post.id in liked_among(request.user if request else None, [post.id])
+        return post.id in self.liked_post_ids
 
     def create(self, validated_data):
         user = self.context['request'].user
@@ -120,6 +144,16 @@ class ChangePasswordSerializer(serializers.Serializer):
     new_password = serializers.CharField(write_only=True, min_length=5,required=True)
 
 
+class DeleteAccountSerializer(serializers.Serializer):
+    """Serializer for confirming account deletion with the user's password."""
+    password = serializers.CharField(write_only=True, required=True)
+
+
+class RefreshTokenSerializer(serializers.Serializer):
+    """Serializer for refresh token exchange and revocation."""
+    refresh = serializers.CharField()
+
+
 class FollowerSerializer(serializers.ModelSerializer):
     """Serializer for the User object in followers/following list."""
     class Meta:
@@ -131,4 +165,20 @@ class LikeSerializer(serializers.ModelSerializer):
     """Serializer for the liking post action."""
     class Meta:
         model = Post
-        fields = ['id', 'text']
\ No newline at end of file
+        fields = ['id', 'text']
+
+
+class DataExportSerializer(serializers.ModelSerializer):
+    """Serializer for the status of a personal data export."""
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DataExport
+        fields = ['id', 'status', 'created', 'finished', 'size', 'download']
+        read_only_fields = fields
+
+    def get_download(self, obj):
+        if obj.status != DataExport.DONE:
+            return None
+        return self.context['request'].build_absolute_uri(
+            reverse('data-export-download', kwargs={'pk': obj.pk}))
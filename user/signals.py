@@ -0,0 +1,90 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.fields import DateTimeField
+
+from core.tasks import run_in_background
+
+from .events import get_broker
+from .feed import record_new_post, set_latest_post_ids
+from .images import release_image
+from .models import Follow, Post, User
+from .tokens import revoke_user_tokens
+
+
+def post_event(post):
+    """Return the lightweight payload sent to followers for a new post."""
+    return {
+        'id': post.id,
+        'user': post.user_id,
+        'text': post.text,
+        'date_created': DateTimeField().to_representation(post.date_created),
+    }
+
+
+def publish_post(post):
+    follower_ids = list(post.user.followers.values_list('id', flat=True))
+    if follower_ids:
+        get_broker().publish(follower_ids, post_event(post))
+
+
+@receiver(post_save, sender=Post)
+def notify_followers_of_new_post(sender, instance, created, **kwargs):
+    """Push a new post to the live feeds of the author's followers once it is committed."""
+    if created:
+        transaction.on_commit(partial(publish_post, instance))
+
+
+@receiver(post_save, sender=Post)
+def record_new_post_in_follows(sender, instance, created, **kwargs):
+    """Update the followers' latest post id of the author in the background, once the post is committed."""
+    if created:
+        run_in_background(record_new_post, instance.user_id, instance.id)
+
+
+@receiver(m2m_changed, sender=Follow)
+def set_latest_post_ids_of_new_follows(sender, instance, action, reverse, pk_set, **kwargs):
+    """Start new follows at their author's latest post id."""
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        # instance.following.add(authors)
+        follows = Follow.objects.filter(to_user=instance, from_user_id__in=pk_set)
+    else:
+        # instance.followers.add(followers)
+        follows = Follow.objects.filter(from_user=instance, to_user_id__in=pk_set)
+    set_latest_post_ids(follows)
+
+
+@receiver(post_delete, sender=Post)
+def release_image_of_deleted_post(sender, instance, **kwargs):
+    """Drop the deleted post's reference to its image, in the transaction that deletes it."""
+    if instance.image:
+        release_image(instance.image.name)
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens_of_changed_access(sender, instance, created, **kwargs):
+    """Revoke the signed access tokens of a user whose active, staff or superuser status changed."""
+    loaded = getattr(instance, '_loaded_access', None)
+    current = instance.access_values()
+    if not created and loaded and any(current.get(name, value) != value for name, value in loaded.items()):
+        revoke_user_tokens(instance)
+    instance._loaded_access = current
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def revoke_tokens_of_regrouped_users(sender, instance, action, reverse, pk_set, **kwargs):
+    """Revoke the signed access tokens of users added to or removed from groups."""
+    if not reverse and (action in ('post_add', 'post_remove') and pk_set or action == 'post_clear'):
+        revoke_user_tokens(instance)
+    elif reverse and action in ('post_add', 'post_remove'):
+        for user in User.objects.filter(pk__in=pk_set):
+            revoke_user_tokens(user)
+    elif reverse and action == 'pre_clear':
+        # The group's users are gone once cleared.
+        for user in instance.user_set.all():
+            revoke_user_tokens(user)
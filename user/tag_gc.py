@@ -0,0 +1,66 @@
+"""Garbage collection of orphan tags.
+
+A tag is an orphan when no post uses it. Orphans are deleted in batches,
+each with a single DELETE ... WHERE id IN (SELECT ... WHERE NOT EXISTS ...)
+statement, instead of loading them and letting the ORM collect their
+(empty) post relations. Tags younger than TAG_GC_GRACE_PERIOD seconds are
+kept, since a tag is usually created just before it is used.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Post, Tag
+
+
+def orphan_tags(queryset=None):
+    """Return the tags of queryset (all tags by default) that no post uses."""
+    queryset = Tag.objects.all() if queryset is None else queryset
+    return queryset.filter(~Exists(Post.tags.through.objects.filter(tag_id=OuterRef('pk'))))
+
+
+def collectable_tags():
+    """Return the orphan tags older than the grace period."""
+    cutoff = timezone.now() - timedelta(seconds=settings.TAG_GC_GRACE_PERIOD)
+    return orphan_tags(Tag.objects.filter(Q(created__isnull=True) | Q(created__lt=cutoff)))
+
+
+def delete_tags_in_batches(queryset, batch_size=None):
+    """Delete the tags of queryset, batch_size at a time, one statement per batch; return how many."""
+    batch_size = batch_size or settings.TAG_GC_BATCH_SIZE
+    using = router.db_for_write(Tag)
+    connection = connections[using]
+    subquery, params = queryset.order_by('pk').values('pk')[:batch_size].query.get_compiler(using).as_sql()
+    sql = 'DELETE FROM {} WHERE {} IN ({})'.format(
+        connection.ops.quote_name(Tag._meta.db_table),
+        connection.ops.quote_name(Tag._meta.pk.column),
+        subquery,
+    )
+    deleted = 0
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute(sql, params)
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return deleted
+
+
+def collect_orphan_tags(batch_size=None):
+    """Delete every collectable orphan tag; return how many were deleted."""
+    return delete_tags_in_batches(collectable_tags(), batch_size)
+
+
+def orphan_tag_report(top=10):
+    """Summarize what collect_orphan_tags would delete, without deleting anything."""
+    tags = collectable_tags()
+    return {
+        'tags': Tag.objects.count(),
+        'orphans': orphan_tags().count(),
+        'collectable': tags.count(),
+        'top_owners': list(
+            tags.values('user__email').annotate(orphans=Count('pk')).order_by('-orphans')[:top]
+        ),
+    }
@@ -1,22 +1,71 @@
-from datetime import date, timedelta
+import asyncio
+import base64
+import json
+import shutil
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 from io import BytesIO
-from django.test import TestCase
-from django.urls import reverse
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.db.models.deletion import Collector
+from django.urls import NoReverseMatch, reverse
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
+from core.pagination import table_estimate
+
 from .views import PostViewSet
-from .models import Post, Tag
+from .async_views import (
+    FeedEventsView,
+    FollowingFeedAsyncView,
+    UserProfileAsyncView,
+    PostDetailAsyncView,
+    UserLikesListAsyncView,
+    PostLikesListAsyncView,
+    authenticate_token,
+)
+from .events import InMemoryBroker, get_broker
+from .feed import count_new_posts, record_new_post
+from . import images
+from .images import dedup_report, probes
+from .deletion import run_account_deletion
+from .media import relocate_media
+from .tag_gc import collect_orphan_tags, orphan_tag_report
+from .models import (
+    AccountDeletion, AuthorAffinity, DataExport, Follow, ImageBlob, Post, PostScore, RecommendedPosts,
+    SimilarPosts, Tag,
+)
+from .filters import PostFilter
+from . import exports, likes
+from .exports import claim_export, run_export
+from .likes import index_key, invalidate_index, liked_post_ids
+from .partitions import add_months, covered_until, ensure_partitions, month_start, partition_name, scanned_partitions
+from .ranking import rank, rebuild_scores
+from .recommendations import LikesMatrix, load_neighbours, refresh_recommendations, similar_posts
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 from .serializers import TagSerializer
+from .throttling import LocalBucketStore, get_bucket_store
+from .tokens import (
+    BloomFilter, create_token_pair, read_access_token, revocation_filter, user_from_access_token,
+)
 
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from PIL import Image
+from PIL import Image, ImageDraw
 
 import requests
 import os
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 User = get_user_model()
 
@@ -707,3 +756,1185 @@ def test_update_profile_picture(self):
 
     # Clean up the uploaded files
     self.user.profile_picture.delete()
+
+
+class AsyncReadViewsTestCase(TestCase):
+    """Tests checking that the async read views return the same payloads as the DRF views."""
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='password1')
+        self.user2 = User.objects.create_user(email='user2@example.com', password='password1')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.factory = AsyncRequestFactory()
+        self.headers = {'Authorization': f'Token {self.token.key}'}
+        self.user.following.add(self.user2)
+        self.tag = Tag.objects.create(user=self.user2, name='tag1')
+        self.post1 = Post.objects.create(user=self.user2, text='Post 1')
+        self.post2 = Post.objects.create(user=self.user2, text='Post 2')
+        self.post1.tags.add(self.tag)
+        self.post1.likes.add(self.user)
+
+    async def _get(self, view, path, **kwargs):
+        response = await view.as_view()(self.factory.get(path, headers=self.headers), **kwargs)
+        return response.status_code, json.loads(response.content)
+
+    async def test_feed(self):
+        status_code, data = await self._get(FollowingFeedAsyncView, '/api/feed/')
+        self.assertEqual(status_code, 200)
+        expected = await sync_to_async(lambda: self.client.get('/api/feed/').json())()
+        self.assertEqual(data, expected)
+
+    async def test_profile(self):
+        status_code, data = await self._get(UserProfileAsyncView, '/api/profile/', id=self.user2.id)
+        self.assertEqual(status_code, 200)
+        expected = await sync_to_async(lambda: self.client.get(f'/api/profile/{self.user2.id}/').json())()
+        self.assertEqual(data, expected)
+
+    async def test_profile_not_found(self):
+        status_code, _ = await self._get(UserProfileAsyncView, '/api/profile/', id=9999)
+        self.assertEqual(status_code, 404)
+
+    async def test_post_detail(self):
+        status_code, data = await self._get(PostDetailAsyncView, '/api/posts/', pk=self.post1.id)
+        self.assertEqual(status_code, 200)
+        expected = await sync_to_async(lambda: self.client.get(f'/api/posts/{self.post1.id}/').json())()
+        self.assertEqual(data, expected)
+
+    async def test_like_lists(self):
+        status_code, data = await self._get(UserLikesListAsyncView, '/api/likes/')
+        self.assertEqual(status_code, 200)
+        self.assertEqual([post['id'] for post in data], [self.post1.id])
+        status_code, data = await self._get(PostLikesListAsyncView, '/api/posts/', post_id=self.post1.id)
+        self.assertEqual(status_code, 200)
+        self.assertEqual([user['email'] for user in data], ['user@example.com'])
+
+    async def test_missing_token_is_rejected(self):
+        request = self.factory.get('/api/feed/')
+        response = await FollowingFeedAsyncView.as_view()(request)
+        self.assertEqual(response.status_code, 401)
+
+
+class FeedEventsTestCase(TestCase):
+    """Tests for live feed events pushed to followers."""
+    def setUp(self):
+        self.author = User.objects.create_user(email='author@example.com', password='password1')
+        self.follower = User.objects.create_user(email='follower@example.com', password='password1')
+        self.follower.following.add(self.author)
+        self.token = Token.objects.create(user=self.follower)
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_new_post_is_published_to_followers(self):
+        with mock.patch('user.signals.get_broker') as get_broker:
+            with self.captureOnCommitCallbacks(execute=True):
+                post = Post.objects.create(user=self.author, text='New post')
+        user_ids, event = get_broker.return_value.publish.call_args.args
+        self.assertEqual(user_ids, [self.follower.id])
+        self.assertEqual(event['id'], post.id)
+
+    async def test_events_are_batched(self):
+        broker = InMemoryBroker()
+        subscription = broker.subscribe(self.follower.id)
+        broker.publish([self.follower.id], {'id': 1})
+        broker.publish([self.follower.id], {'id': 2})
+        batch = await anext(subscription.batches(window=0.05, max_size=10, heartbeat=1))
+        self.assertEqual([event for _, event in batch], [{'id': 1}, {'id': 2}])
+
+    async def test_resume_from_last_event_id(self):
+        broker = InMemoryBroker(history_size=2)
+        first_id = broker.publish([self.follower.id], {'id': 1})
+        broker.publish([self.follower.id], {'id': 2})
+        subscription = broker.subscribe(self.follower.id, last_event_id=first_id)
+        self.assertFalse(subscription.reset)
+        batch = await anext(subscription.batches(window=0, max_size=10, heartbeat=1))
+        self.assertEqual([event for _, event in batch], [{'id': 2}])
+
+        broker.publish([self.follower.id], {'id': 3})
+        broker.publish([self.follower.id], {'id': 4})
+        self.assertTrue(broker.subscribe(self.follower.id, last_event_id=first_id).reset)
+
+    async def test_unknown_last_event_id_resets(self):
+        broker, restarted = InMemoryBroker(), InMemoryBroker()
+        event_id = broker.publish([self.follower.id], {'id': 1})
+        self.assertNotEqual(restarted.publish([self.follower.id], {'id': 1}), event_id)
+        for last_event_id in (event_id, '1', 'garbage'):
+            with self.subTest(last_event_id=last_event_id):
+                subscription = restarted.subscribe(self.follower.id, last_event_id=last_event_id)
+                self.assertTrue(subscription.reset)
+                self.assertTrue(subscription.queue.empty())
+
+    async def test_least_recent_user_history_is_dropped(self):
+        broker = InMemoryBroker(max_users=2)
+        first_id = broker.publish([1], {'id': 1})
+        broker.publish([2], {'id': 2})
+        broker.publish([1], {'id': 3})
+        broker.publish([3], {'id': 4})
+        self.assertEqual(list(broker._history), [1, 3])
+        self.assertFalse(broker.subscribe(1, last_event_id=first_id).reset)
+        self.assertTrue(broker.subscribe(2, last_event_id=first_id).reset)
+        broker.publish([2], {'id': 5})
+        self.assertTrue(broker.subscribe(2, last_event_id=first_id).reset)
+
+    def test_stream_is_only_routed_when_enabled(self):
+        with self.assertRaises(NoReverseMatch):
+            reverse('user-feed-events')
+
+    async def test_slow_subscriber_is_disconnected(self):
+        broker = InMemoryBroker(queue_size=2)
+        subscription = broker.subscribe(self.follower.id)
+        for i in range(5):
+            broker.publish([self.follower.id], {'id': i})
+        await asyncio.sleep(0)
+        batches = [batch async for batch in subscription.batches(window=0, max_size=10, heartbeat=1)]
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(sum(len(batch) for batch in batches), 2)
+
+    async def test_event_stream(self):
+        request = AsyncRequestFactory().get('/api/feed/events/', headers={'Authorization': f'Token {self.token.key}'})
+        response = await FeedEventsView.as_view()(request)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        first_message = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        event_id = get_broker().publish([self.follower.id], {'id': 42})
+        message = (await asyncio.wait_for(first_message, 5)).decode()
+        self.assertIn(f'id: {event_id}\nevent: posts\ndata: [{{"id": 42}}]', message)
+        await stream.aclose()
+
+
+@override_settings(
+    THROTTLE_USER_BUCKET={'capacity': 3, 'refill_rate': 0.1},
+    THROTTLE_IP_BUCKET={'capacity': 100, 'refill_rate': 1},
+    THROTTLE_COSTS={'like': 1, 'follow': 1, 'tag': 2, 'search': 3},
+)
+class TokenBucketThrottleTestCase(TestCase):
+    """Tests for token-bucket rate limiting of write and search endpoints."""
+    def setUp(self):
+        get_bucket_store().clear()
+        self.addCleanup(get_bucket_store().clear)
+        self.user = User.objects.create_user(email='user@example.com', password='password1')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.posts = [Post.objects.create(user=self.user, text=f'Post {i}') for i in range(4)]
+
+    def test_likes_are_throttled_with_retry_after(self):
+        for post in self.posts[:3]:
+            response = self.client.post(reverse('post-like', kwargs={'post_id': post.id}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('post-like', kwargs={'post_id': self.posts[3].id}))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '10')
+
+    def test_search_costs_more_than_listing(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get('/api/posts/').status_code, status.HTTP_200_OK)
+        response = self.client.get('/api/posts/', {'text__icontains': 'Post'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get('/api/posts/', {'text__icontains': 'Post'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_buckets_are_per_user(self):
+        for _ in range(2):
+            self.client.post(reverse('tags'), {'name': 'tag'})
+        other_user = User.objects.create_user(email='other@example.com', password='password1')
+        self.client.force_authenticate(user=other_user)
+        response = self.client.post(reverse('tags'), {'name': 'tag'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @override_settings(THROTTLE_IP_BUCKET={'capacity': 1, 'refill_rate': 0.1})
+    def test_ip_bucket_is_shared_between_users(self):
+        self.client.post(reverse('post-like', kwargs={'post_id': self.posts[0].id}))
+        other_user = User.objects.create_user(email='other@example.com', password='password1')
+        self.client.force_authenticate(user=other_user)
+        response = self.client.post(reverse('post-like', kwargs={'post_id': self.posts[0].id}))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(THROTTLE_USER_BUCKET={'capacity': 1, 'refill_rate': 0.1},
+                       THROTTLE_IP_BUCKET={'capacity': 2, 'refill_rate': 0.1})
+    def test_refused_requests_take_no_tokens(self):
+        self.client.post(reverse('post-like', kwargs={'post_id': self.posts[0].id}))
+        for _ in range(3):
+            response = self.client.post(reverse('post-like', kwargs={'post_id': self.posts[1].id}))
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        other_user = User.objects.create_user(email='other@example.com', password='password1')
+        self.client.force_authenticate(user=other_user)
+        response = self.client.post(reverse('post-like', kwargs={'post_id': self.posts[0].id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(THROTTLE_USER_BUCKET={'capacity': 100, 'refill_rate': 1},
+                       THROTTLE_IP_BUCKET={'capacity': 3, 'refill_rate': 0.1})
+    def test_forwarded_for_header_is_not_trusted(self):
+        for address in ('10.0.0.1', '10.0.0.2'):
+            response = self.client.get('/api/posts/', {'text__icontains': 'Post'}, HTTP_X_FORWARDED_FOR=address)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_local_store_evicts_least_recently_used(self):
+        store = LocalBucketStore()
+        store.max_buckets = 2
+        self.assertEqual(store.consume([('a', 1, 0.1)], 1), 0)
+        store.consume([('b', 1, 0.1)], 1)
+        store.consume([('a', 1, 0.1)], 1)
+        store.consume([('c', 1, 0.1)], 1)
+        # 'a' is still empty, while 'b' was evicted.
+        self.assertGreater(store.consume([('a', 1, 0.1)], 1), 0)
+        self.assertEqual(store.consume([('b', 1, 0.1)], 1), 0)
+
+
+class SignedAccessTokenTestCase(TestCase):
+    """Tests for stateless signed access tokens, refresh tokens and revocation."""
+    def setUp(self):
+        revocation_filter.reset()
+        self.credentials = {'email': 'user@example.com', 'password': 'password1'}
+        self.user = User.objects.create_user(**self.credentials)
+        self.client = APIClient()
+        response = self.client.post(reverse('access-token'), self.credentials, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.tokens = response.data
+
+    def _get_feed(self, access_token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        return self.client.get(reverse('user-feed'))
+
+    def test_access_token_is_verified_without_queries(self):
+        self._get_feed(self.tokens['access'])
+        payload = read_access_token(self.tokens['access'])
+        with self.assertNumQueries(0):
+            self.assertEqual(read_access_token(self.tokens['access']), payload)
+        user = user_from_access_token(payload)
+        self.assertEqual(user.pk, self.user.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'user@example.com')
+
+    def test_access_token_authenticates_requests(self):
+        self.assertEqual(self._get_feed(self.tokens['access']).status_code, status.HTTP_200_OK)
+
+    def test_tampered_access_token_is_rejected(self):
+        response = self._get_feed(self.tokens['access'][:-2] + 'xx')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_refresh_token_is_rotated(self):
+        response = self.client.post(reverse('access-token-refresh'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self._get_feed(response.data['access']).status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('access-token-refresh'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoked_access_token_is_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+        response = self.client.post(reverse('access-token-revoke'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self._get_feed(self.tokens['access']).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse('access-token-refresh'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_revokes_tokens(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+        response = self.client.put(reverse('user-profile-change-password'),
+                                   {'old_password': 'password1', 'new_password': 'password2'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._get_feed(self.tokens['access']).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_access_change_revokes_tokens(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.bio = 'Unchanged access'
+        user.save()
+        self.assertEqual(self._get_feed(self.tokens['access']).status_code, status.HTTP_200_OK)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self._get_feed(self.tokens['access']).status_code, status.HTTP_401_UNAUTHORIZED)
+        access = create_token_pair(user)['access']
+        user.groups.add(Group.objects.create(name='moderators'))
+        self.assertEqual(self._get_feed(access).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_profile_edit_does_not_restore_token_claims(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        access = create_token_pair(User.objects.get(pk=self.user.pk))['access']
+        # A bulk update bypasses save(), so the old token stays valid.
+        User.objects.filter(pk=self.user.pk).update(is_staff=False, permissions_version=5)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        response = self.client.patch(reverse('user-profile-edit'), {'bio': 'Edited'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.put(reverse('user-profile-change-password'), {
+            'old_password': 'password1', 'new_password': 'password2',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.bio, 'Edited')
+        self.assertFalse(user.is_staff)
+        self.assertGreaterEqual(user.permissions_version, 5)
+
+    def test_inactive_user_is_rejected(self):
+        self.user.is_active = False
+        access = create_token_pair(self.user)['access']
+        self.assertEqual(self._get_feed(access).status_code, status.HTTP_401_UNAUTHORIZED)
+        request = AsyncRequestFactory().get('/api/feed/', headers={'Authorization': f'Bearer {access}'})
+        self.assertIsNone(async_to_sync(authenticate_token)(request))
+
+    async def test_access_token_authenticates_async_views(self):
+        request = AsyncRequestFactory().get('/api/feed/', headers={'Authorization': f"Bearer {self.tokens['access']}"})
+        response = await FollowingFeedAsyncView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(size_bits=1024, hash_count=5)
+        bloom.add('revoked')
+        self.assertIn('revoked', bloom)
+        self.assertNotIn('valid', bloom)
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class DataExportTestCase(TestCase):
+    """Tests for personal data exports."""
+    def setUp(self):
+        export_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(export_dir.cleanup)
+        settings_override = override_settings(DATA_EXPORT_DIR=export_dir.name, DATA_EXPORT_CHUNK_SIZE=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(email='user@example.com', password='password1')
+        self.follower = User.objects.create_user(email='follower@example.com', password='password1')
+        self.followed = User.objects.create_user(email='followed@example.com', password='password1')
+        self.user.followers.add(self.follower)
+        self.user.following.add(self.followed)
+        tag = Tag.objects.create(user=self.user, name='travel')
+        for i in range(5):
+            post = Post.objects.create(user=self.user, text=f'Post {i}')
+            post.tags.add(tag)
+        Post.objects.create(user=self.followed, text='Liked post').likes.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _export(self):
+        response = self.client.post(reverse('data-export'))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        response = self.client.get(reverse('data-export-detail', kwargs={'pk': response.data['id']}))
+        self.assertEqual(response.data['status'], DataExport.DONE)
+        return response.data
+
+    def test_export_contains_user_data(self):
+        export = self._export()
+        response = self.client.get(export['download'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+            posts = [json.loads(line) for line in archive.read('posts.ndjson').splitlines()]
+            likes = [json.loads(line) for line in archive.read('likes.ndjson').splitlines()]
+            followers = [json.loads(line) for line in archive.read('followers.ndjson').splitlines()]
+            following = [json.loads(line) for line in archive.read('following.ndjson').splitlines()]
+            profile = json.loads(archive.read('profile.json'))
+        self.assertEqual([post['text'] for post in posts], [f'Post {i}' for i in range(5)])
+        self.assertTrue(all(post['tags'] == ['travel'] for post in posts))
+        self.assertEqual([like['text'] for like in likes], ['Liked post'])
+        self.assertEqual(followers, [{'id': self.follower.id, 'email': 'follower@example.com'}])
+        self.assertEqual(following, [{'id': self.followed.id, 'email': 'followed@example.com'}])
+        self.assertEqual(profile['email'], 'user@example.com')
+
+    def test_shared_image_is_archived_once(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            name = default_storage.save('post_images/shared.jpg', ContentFile(b'image'))
+            Post.objects.filter(user=self.user, text__in=['Post 0', 'Post 1']).update(image=name)
+            export = self._export()
+        with zipfile.ZipFile(BytesIO(b''.join(self.client.get(export['download']).streaming_content))) as archive:
+            self.assertEqual(archive.namelist().count('images/posts/shared.jpg'), 1)
+            self.assertEqual(archive.read('images/posts/shared.jpg'), b'image')
+
+    def test_download_can_be_resumed(self):
+        export = self._export()
+        full = b''.join(self.client.get(export['download']).streaming_content)
+        response = self.client.get(export['download'], HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], f'bytes 10-{len(full) - 1}/{len(full)}')
+        self.assertEqual(b''.join(response.streaming_content), full[10:])
+
+        response = self.client.get(export['download'], HTTP_RANGE='bytes=10-', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(export['download'], HTTP_RANGE=f'bytes={len(full)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_other_users_cannot_download_export(self):
+        export = self._export()
+        self.client.force_authenticate(user=self.follower)
+        response = self.client.get(export['download'])
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unfinished_export_is_reused(self):
+        with override_settings(BACKGROUND_TASKS_EAGER=False):
+            first = self.client.post(reverse('data-export')).data
+            second = self.client.post(reverse('data-export')).data
+        self.assertEqual(first['id'], second['id'])
+        self.assertIsNone(second['download'])
+
+    def test_running_export_is_not_claimed_twice(self):
+        export = DataExport.objects.create(user=self.user)
+        self.assertIsNotNone(claim_export(export.id))
+        self.assertFalse(run_export(export.id))
+        export.refresh_from_db()
+        self.assertEqual(export.status, DataExport.RUNNING)
+
+        DataExport.objects.filter(id=export.id).update(lease_expires=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(run_export(export.id))
+        export.refresh_from_db()
+        self.assertEqual(export.status, DataExport.DONE)
+
+    def test_build_stops_when_lease_is_taken_over(self):
+        export = DataExport.objects.create(user=self.user)
+        user_posts = exports.user_posts
+
+        def taken_over(user):
+            DataExport.objects.filter(id=export.id).update(lease_token='other')
+            yield from user_posts(user)
+
+        with override_settings(DATA_EXPORT_LEASE=0), \
+                mock.patch.object(exports, 'user_posts', side_effect=taken_over):
+            self.assertFalse(run_export(export.id))
+        export.refresh_from_db()
+        self.assertEqual((export.status, export.lease_token), (DataExport.RUNNING, 'other'))
+        self.assertEqual(os.listdir(settings.DATA_EXPORT_DIR), [])
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class PostImportTestCase(TestCase):
+    """Tests for the bulk NDJSON post import."""
+    def setUp(self):
+        get_bucket_store().clear()
+        self.addCleanup(get_bucket_store().clear)
+        self.user = User.objects.create_user(email='user@example.com', password='password1')
+        self.existing_tag = Tag.objects.create(name='travel')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _import(self, records):
+        body = '\n'.join(record if isinstance(record, str) else json.dumps(record) for record in records)
+        return self.client.generic('POST', reverse('posts-import'), body, content_type='application/x-ndjson')
+
+    def test_import_posts_with_tags(self):
+        records = [{'text': f'Post {i}', 'tags': ['travel', 'food']} for i in range(5)]
+        records.append({'text': 'Old post', 'date_created': '2020-01-02T03:04:05Z'})
+        with override_settings(POST_IMPORT_BATCH_SIZE=2):
+            response = self._import(records)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['imported'], 6)
+        self.assertEqual(Post.objects.filter(user=self.user).count(), 6)
+        self.assertEqual(Tag.objects.filter(name='travel').count(), 1)
+        self.assertEqual(Tag.objects.filter(name='food').count(), 1)
+        self.assertEqual(self.existing_tag.posts.count(), 5)
+        self.assertEqual(Post.objects.get(text='Old post').date_created.year, 2020)
+
+    def test_invalid_lines_are_reported(self):
+        response = self._import([{'text': 'Valid'}, 'not json', {'text': ''}, {'text': 'x', 'tags': 'a'}])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual([error['line'] for error in response.data['errors']], [2, 3, 4])
+
+    def test_batch_uses_constant_queries(self):
+        records = [{'text': f'Post {i}', 'tags': [f'tag{i}', 'travel']} for i in range(50)]
+        # Tags, tag creation, posts, post-tag rows and the followers' latest
+        # post id, plus the savepoint.
+        with self.assertNumQueries(7):
+            self._import(records)
+        self.assertEqual(Post.objects.count(), 50)
+
+    def test_imported_images_are_processed(self):
+        image_io = BytesIO()
+        Image.new('RGB', (600, 600)).save(image_io, format='PNG')
+        record = {'text': 'With image', 'image': base64.b64encode(image_io.getvalue()).decode()}
+        response = self._import([record])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        post = Post.objects.get(text='With image')
+        self.assertRegex(post.image.name, r'^post_images/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}\.jpg$')
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (300, 300))
+        post.image.delete(save=False)
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True, ACCOUNT_DELETION_BATCH_SIZE=2)
+class DeleteAccountTestCase(TestCase):
+    """Tests for the chunked background account deletion."""
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='password1')
+        self.other = User.objects.create_user(email='other@example.com', password='password1')
+        self.user.followers.add(self.other)
+        self.user.following.add(self.other)
+        self.tag = Tag.objects.create(user=self.user, name='travel')
+        for i in range(5):
+            post = Post.objects.create(user=self.user, text=f'Post {i}')
+            post.tags.add(self.tag)
+            post.likes.add(self.other)
+        self.other_post = Post.objects.create(user=self.other, text='Other post')
+        self.other_post.likes.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_delete_account(self):
+        response = self.client.delete(reverse('user-profile-delete'), {'password': 'password1'})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+        self.assertFalse(Post.objects.filter(user_id=self.user.id).exists())
+        self.assertEqual(list(self.other_post.likes.all()), [])
+        self.assertEqual(self.other.followers.count() + self.other.following.count(), 0)
+        self.tag.refresh_from_db()
+        self.assertIsNone(self.tag.user)
+        deletion = AccountDeletion.objects.get(user_id=self.user.id)
+        self.assertEqual(deletion.status, AccountDeletion.DONE)
+        self.assertGreater(deletion.deleted_rows, 5)
+
+    def test_only_deleted_files_are_counted(self):
+        def image(name, references):
+            ImageBlob.objects.create(
+                name=name, sha256=name, source_sha256=name, dhash_0=0, dhash_1=0, dhash_2=0, dhash_3=0,
+                width=1, height=1, fingerprint=b'', size=1, references=references)
+            return name
+
+        own, shared = image('post_images/own.jpg', 2), image('post_images/shared.jpg', 2)
+        Post.objects.filter(user=self.user, text__in=['Post 0', 'Post 1']).update(image=own)
+        Post.objects.filter(user=self.user, text='Post 2').update(image=shared)
+        Post.objects.filter(pk=self.other_post.pk).update(image=shared)
+        Post.objects.filter(user=self.user, text='Post 3').update(image='post_images/legacy.jpg')
+        self.client.delete(reverse('user-profile-delete'), {'password': 'password1'})
+        # The last reference to own.jpg and the blobless legacy.jpg, not shared.jpg.
+        self.assertEqual(AccountDeletion.objects.get(user_id=self.user.id).deleted_files, 2)
+        self.assertEqual(list(ImageBlob.objects.values_list('name', 'references')), [(shared, 1)])
+
+    def test_post_likes_and_tags_are_deleted_in_batches(self):
+        post = Post.objects.get(user=self.user, text='Post 0')
+        for i in range(3):
+            post.likes.add(User.objects.create_user(email=f'liker{i}@example.com', password='password1'))
+        deleted = []
+        collector_delete = Collector.delete
+
+        def record(collector):
+            result = collector_delete(collector)
+            deleted.append(result[1])
+            return result
+
+        with mock.patch.object(Collector, 'delete', autospec=True, side_effect=record):
+            self.client.delete(reverse('user-profile-delete'), {'password': 'password1'})
+        self.assertFalse(Post.objects.filter(user_id=self.user.id).exists())
+        for label in ('user.PostLike', 'user.PostTag'):
+            counts = [per_model[label] for per_model in deleted if label in per_model]
+            self.assertEqual(sum(counts), 9 if label == 'user.PostLike' else 5)
+            self.assertLessEqual(max(counts), 2)
+
+    def test_wrong_password_keeps_account(self):
+        response = self.client.delete(reverse('user-profile-delete'), {'password': 'wrong'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(User.objects.get(id=self.user.id).is_active)
+
+    def test_account_is_deactivated_before_rows_are_deleted(self):
+        with override_settings(BACKGROUND_TASKS_EAGER=False):
+            response = self.client.delete(reverse('user-profile-delete'), {'password': 'password1'})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(User.objects.get(id=self.user.id).is_active)
+        self.assertEqual(Post.objects.filter(user_id=self.user.id).count(), 5)
+        response = APIClient().post(reverse('user-login'), {'email': 'user@example.com', 'password': 'password1'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_interrupted_deletion_resumes(self):
+        deletion = AccountDeletion.objects.create(
+            user_id=self.user.id, email=self.user.email, status=AccountDeletion.RUNNING, stage='posts')
+        run_account_deletion(deletion.id)
+        deletion.refresh_from_db()
+        self.assertEqual(deletion.status, AccountDeletion.DONE)
+        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+
+
+class OrphanTagCollectionTests(TestCase):
+    """Tests for deleting tags that no post uses."""
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='password1')
+        self.other = User.objects.create_user(email='other@example.com', password='password1')
+        self.used = Tag.objects.create(user=self.user, name='used')
+        Post.objects.create(user=self.user, text='Post').tags.add(self.used)
+        self.unused = [Tag.objects.create(user=self.user, name=f'unused {i}') for i in range(3)]
+        self.other_unused = Tag.objects.create(user=self.other, name='other unused')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_collect_deletes_old_orphans_in_batches(self):
+        Tag.objects.update(created=timezone.now() - timedelta(days=2))
+        fresh = Tag.objects.create(user=self.user, name='fresh')
+        self.assertEqual(orphan_tag_report()['collectable'], 4)
+        with self.assertNumQueries(3):
+            self.assertEqual(collect_orphan_tags(batch_size=2), 4)
+        self.assertEqual(set(Tag.objects.all()), {self.used, fresh})
+
+    def test_list_own_unused_tags(self):
+        response = self.client.get(reverse('tags-user-unused'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({tag['name'] for tag in response.data}, {'unused 0', 'unused 1', 'unused 2'})
+
+    def test_delete_all_own_unused_tags(self):
+        response = self.client.delete(reverse('tags-user-unused'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'deleted': 3})
+        self.assertEqual(set(Tag.objects.all()), {self.used, self.other_unused})
+
+
+class MediaViewTestCase(TestCase):
+    """Tests for authenticated media delivery."""
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='password1')
+        self.name = 'post_images/media-test.jpg'
+        default_storage.save(self.name, ContentFile(b'0123456789' * 100))
+        self.addCleanup(default_storage.delete, self.name)
+        self.post = Post.objects.create(user=self.user, text='Post')
+        Post.objects.filter(id=self.post.id).update(image=self.name)
+        self.url = reverse('media', kwargs={'name': self.name})
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_media_requires_authentication(self):
+        response = APIClient().get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_unreferenced_media_is_not_served(self):
+        Post.objects.filter(id=self.post.id).update(image='')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_media_of_inactive_users_is_not_served(self):
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        self.client.force_authenticate(user=User.objects.create_user(email='other@example.com', password='p4ssword'))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_media_served_with_range_and_cache_headers(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertEqual(len(b''.join(response.streaming_content)), 1000)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), b'56789')
+
+    @override_settings(MEDIA_SERVE_METHOD='x-accel-redirect')
+    def test_media_handed_to_nginx(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/post_images/media-test.jpg')
+        self.assertEqual(response.content, b'')
+
+    @override_settings(MEDIA_SERVE_METHOD='x-sendfile')
+    def test_media_handed_to_sendfile(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], default_storage.path(self.name))
+
+
+class ShardedMediaStorageTestCase(TestCase):
+    """Tests for sharded media keys, pluggable storage and relocation of old files."""
+    SHARDED = r'^post_images/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}\.jpg$'
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(email='user@example.com', password='password1')
+
+    def _upload(self, color='red'):
+        image_io = BytesIO()
+        Image.new('RGB', (600, 600), color=color).save(image_io, format='PNG')
+        return SimpleUploadedFile('upload.png', image_io.getvalue())
+
+    def test_upload_is_resized_under_sharded_key(self):
+        post = Post.objects.create(user=self.user, text='Post', image=self._upload())
+        self.assertRegex(post.image.name, self.SHARDED)
+        with default_storage.open(post.image.name) as stored, Image.open(stored) as image:
+            self.assertEqual(image.size, (300, 300))
+        self.assertFalse(default_storage.exists('post_images/upload.png'))
+
+    def test_replaced_upload_is_deleted(self):
+        post = Post.objects.create(user=self.user, text='Post', image=self._upload())
+        old_name = post.image.name
+        post.image = self._upload(color='blue')
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        self.assertNotEqual(post.image.name, old_name)
+        self.assertFalse(default_storage.exists(old_name))
+
+    def test_saving_without_new_upload_keeps_file(self):
+        post = Post.objects.create(user=self.user, text='Post', image=self._upload())
+        name = post.image.name
+        post.text = 'Edited'
+        post.save()
+        self.assertEqual(Post.objects.get(id=post.id).image.name, name)
+
+    def test_relocate_media_moves_legacy_files(self):
+        legacy_name = os.path.join(settings.MEDIA_ROOT, 'post_images', 'legacy-relocation.jpg')
+        default_storage.save('post_images/legacy-relocation.jpg', ContentFile(b'legacy'))
+        post = Post.objects.create(user=self.user, text='Post')
+        Post.objects.filter(id=post.id).update(image=legacy_name)
+        missing = Post.objects.create(user=self.user, text='Missing')
+        Post.objects.filter(id=missing.id).update(image='post_images/missing.jpg')
+
+        results = relocate_media(workers=0)
+        self.assertEqual(results['post_images'], (1, 1))
+        post.refresh_from_db()
+        self.assertRegex(post.image.name, self.SHARDED)
+        with default_storage.open(post.image.name) as stored:
+            self.assertEqual(stored.read(), b'legacy')
+        self.assertFalse(os.path.exists(legacy_name))
+
+    def test_media_view_streams_from_object_storage(self):
+        object_root = tempfile.TemporaryDirectory()
+        self.addCleanup(object_root.cleanup)
+        storages = dict(settings.STORAGES, default={'BACKEND': 'core.storage.LocalObjectStorage'})
+        with override_settings(STORAGES=storages, OBJECT_STORAGE_ROOT=object_root.name):
+            post = Post.objects.create(user=self.user, text='Post', image=self._upload())
+            client = APIClient()
+            client.force_authenticate(user=self.user)
+            response = client.get(post.image.url, HTTP_RANGE='bytes=0-1')
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(b''.join(response.streaming_content), b'\xff\xd8')
+
+
+class TopFeedTestCase(TestCase):
+    """Tests for the engagement-ranked feed and the scores behind it."""
+    def setUp(self):
+        self.reader = User.objects.create_user(email='reader@example.com', password='password1')
+        self.author = User.objects.create_user(email='author@example.com', password='password1')
+        self.author2 = User.objects.create_user(email='author2@example.com', password='password1')
+        self.fans = [User.objects.create_user(email=f'fan{i}@example.com', password='password1') for i in range(3)]
+        self.reader.following.add(self.author, self.author2)
+        self.old_post = Post.objects.create(user=self.author, text='Old post')
+        self.new_post = Post.objects.create(user=self.author, text='New post')
+        self.client = APIClient()
+        get_bucket_store().clear()
+        self.addCleanup(get_bucket_store().clear)
+
+    def _like(self, user, post):
+        self.client.force_authenticate(user=user)
+        response = self.client.post(reverse('post-like', args=[post.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def _feed(self, mode):
+        self.client.force_authenticate(user=self.reader)
+        return self.client.get('/api/feed/', {'mode': mode})
+
+    def test_latest_feed_is_newest_first(self):
+        response = self._feed('latest')
+        self.assertEqual([post['id'] for post in response.json()], [self.new_post.id, self.old_post.id])
+
+    def test_liked_post_ranks_first(self):
+        for fan in self.fans:
+            self._like(fan, self.old_post)
+        self.assertAlmostEqual(PostScore.objects.get(post=self.old_post).value, 3, places=3)
+        response = self._feed('top')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([post['id'] for post in response.json()], [self.old_post.id, self.new_post.id])
+
+    def test_affinity_boosts_author(self):
+        other_post = Post.objects.create(user=self.author2, text='Other post')
+        self._like(self.reader, other_post)
+        newer_post = Post.objects.create(user=self.author, text='Newest post')
+        ids = [post['id'] for post in self._feed('top').json()]
+        # The reader's own like raises both the post and its author over newer posts.
+        self.assertEqual(ids[0], other_post.id)
+        self.assertLess(ids.index(other_post.id), ids.index(newer_post.id))
+        self.assertTrue(AuthorAffinity.objects.filter(user=self.reader, author=self.author2).exists())
+
+    def test_unlike_never_goes_below_zero(self):
+        self._like(self.fans[0], self.old_post)
+        self.client.delete(reverse('post-unlike', args=[self.old_post.id]))
+        self.client.delete(reverse('post-unlike', args=[self.old_post.id]))
+        self.assertEqual(PostScore.objects.get(post=self.old_post).value, 0)
+
+    def test_likes_decay_with_half_life(self):
+        now = timezone.now()
+        half_life = timedelta(seconds=settings.FEED_TOP_LIKE_HALF_LIFE)
+        candidates = [
+            (1, self.author.id, now, 4, now - half_life),
+            (2, self.author.id, now, 2.5, now),
+        ]
+        self.assertEqual(rank(candidates, [], now), [2, 1])
+
+    def test_unknown_mode(self):
+        self.assertEqual(self._feed('random').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild_scores(self):
+        self.old_post.likes.add(*self.fans)
+        self.assertEqual(rebuild_scores(), (1, 3))
+        self.assertEqual(PostScore.objects.get(post=self.old_post).value, 3)
+        self.assertEqual([post['id'] for post in self._feed('top').json()][0], self.old_post.id)
+
+    def test_async_top_feed(self):
+        self._like(self.fans[0], self.old_post)
+        token = Token.objects.create(user=self.reader)
+        request = AsyncRequestFactory().get('/api/feed/', {'mode': 'top'}, headers={'Authorization': f'Token {token.key}'})
+        response = async_to_sync(FollowingFeedAsyncView.as_view())(request)
+        self.assertEqual(json.loads(response.content), self._feed('top').json())
+
+
+class LikedByMeTestCase(TestCase):
+    """Tests for the liked_by_me flag and the liked post index behind it."""
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='password1')
+        self.author = User.objects.create_user(email='author@example.com', password='password1')
+        self.posts = [Post.objects.create(user=self.author, text=f'Post {i}') for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        cache.clear()
+        get_bucket_store().clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(get_bucket_store().clear)
+
+    def _flags(self):
+        response = self.client.get('/api/posts/', {'ordering': 'id'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('likes', response.data[0])
+        return [post['liked_by_me'] for post in response.data]
+
+    def test_flags_for_page(self):
+        self.posts[1].likes.add(self.user)
+        self.assertEqual(self._flags(), [False, True, False])
+        detail = self.client.get(f'/api/posts/{self.posts[1].id}/')
+        self.assertTrue(detail.data['liked_by_me'])
+
+    def test_index_is_kept_current_by_like_view(self):
+        self._flags()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post-like', args=[self.posts[2].id]))
+            self.client.post(reverse('post-like', args=[self.posts[0].id]))
+        self.assertEqual(list(liked_post_ids(self.user.id)), [self.posts[0].id, self.posts[2].id])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self._flags(), [True, False, True])
+        self.assertFalse(any('user_post_likes' in query['sql'] for query in queries))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('post-unlike', args=[self.posts[2].id]))
+        self.assertEqual(self._flags(), [True, False, False])
+
+    def test_stale_load_is_not_used(self):
+        load = likes.load_liked_post_ids
+
+        def load_then_like(user_id):
+            # The likes are read just before a like commits.
+            ids = load(user_id)
+            self.posts[1].likes.add(self.user)
+            invalidate_index(self.user.id)
+            return ids
+
+        with mock.patch.object(likes, 'load_liked_post_ids', side_effect=load_then_like):
+            self.assertEqual(list(liked_post_ids(self.user.id)), [])
+        self.assertEqual(list(liked_post_ids(self.user.id)), [self.posts[1].id])
+
+    @override_settings(LIKED_POSTS_INDEX_MAX_SIZE=1)
+    def test_large_like_sets_are_not_cached(self):
+        self.posts[0].likes.add(self.user)
+        self.posts[2].likes.add(self.user)
+        self.assertEqual(self._flags(), [True, False, True])
+        self.assertIsNone(cache.get(index_key(self.user.id)))
+
+
+class PostPartitionTests(TestCase):
+    """Tests for the monthly partitions of the posts table."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='partitions@example.com', password='pass')
+        self.this_month = month_start(timezone.now())
+
+    def test_month_arithmetic(self):
+        start = month_start(datetime(2026, 11, 30, 23, 0, tzinfo=timezone.get_fixed_timezone(-120)))
+        self.assertEqual(start, datetime(2026, 12, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(add_months(start, 1), datetime(2027, 1, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(add_months(start, 14), datetime(2028, 2, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(partition_name(start), 'user_post_p2026_12')
+        bounds = ["FOR VALUES FROM (MINVALUE) TO ('2026-11-01 00:00:00+00')",
+                  "FOR VALUES FROM ('2026-11-01 00:00:00+00') TO ('2026-12-01 00:00:00+00')", 'DEFAULT']
+        self.assertEqual(covered_until(bounds), datetime(2026, 12, 1, tzinfo=dt_timezone.utc))
+        self.assertIsNone(covered_until(['DEFAULT']))
+
+    @skipUnless(connection.vendor != 'postgresql', 'PostgreSQL tables are partitioned')
+    def test_unpartitioned_database_is_left_alone(self):
+        self.assertEqual(ensure_partitions(), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Partitions are only used on PostgreSQL')
+    def test_date_filters_are_pruned(self):
+        month = add_months(self.this_month, 2)
+        filtered = PostFilter({
+            'date_created__gte': month.isoformat(),
+            'date_created__lte': (add_months(month, 1) - timedelta(seconds=1)).isoformat(),
+        }, queryset=Post.objects.all()).qs
+        self.assertEqual(scanned_partitions(filtered), {partition_name(month)})
+        recent = PostFilter({'date_created__gte': month.isoformat()}, queryset=Post.objects.all()).qs
+        self.assertNotIn('user_post_legacy', scanned_partitions(recent))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Partitions are only used on PostgreSQL')
+    def test_posts_in_the_default_partition_are_moved(self):
+        month = add_months(self.this_month, 6)
+        post = Post.objects.create(user=self.user, text='Scheduled')
+        Post.objects.filter(pk=post.pk).update(date_created=month + timedelta(days=3))
+        post.tags.add(Tag.objects.create(name='later', user=self.user))
+
+        created = ensure_partitions(ahead=6)
+        self.assertIn(partition_name(month), created)
+        self.assertEqual(ensure_partitions(ahead=6), [])
+        in_month = Post.objects.filter(date_created__gte=month, date_created__lt=add_months(month, 1))
+        self.assertEqual(scanned_partitions(in_month), {partition_name(month)})
+        self.assertEqual(list(in_month), [post])
+        self.assertEqual([tag.name for tag in in_month[0].tags.all()], ['later'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Partitions are only used on PostgreSQL')
+    def test_table_estimate_adds_up_partitions(self):
+        Post.objects.bulk_create(Post(user=self.user, text=f'Post {i}') for i in range(5))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE user_post')
+        self.assertEqual(table_estimate(Post.objects.all()), 5)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Partitions are only used on PostgreSQL')
+    def test_like_counts_of_partitioned_posts(self):
+        post = Post.objects.create(user=self.user, text='Liked')
+        Post.objects.create(user=self.user, text='Not liked')
+        post.likes.add(self.user)
+        filtered = PostFilter({'likes_count__gte': 1}, queryset=Post.objects.all()).qs
+        self.assertEqual(list(filtered), [post])
+
+
+class RecommendationTestCase(TestCase):
+    """Tests for item-based post recommendations."""
+    def setUp(self):
+        self.author = User.objects.create_user(email='author@example.com', password='password1')
+        self.alice = User.objects.create_user(email='alice@example.com', password='password1')
+        self.bob = User.objects.create_user(email='bob@example.com', password='password1')
+        self.carol = User.objects.create_user(email='carol@example.com', password='password1')
+        self.posts = [Post.objects.create(user=self.author, text=f'Post {i}') for i in range(4)]
+        self.client = APIClient()
+        get_bucket_store().clear()
+        self.addCleanup(get_bucket_store().clear)
+        p0, p1, p2, p3 = self.posts
+        for user, posts in ((self.alice, [p0, p1]), (self.bob, [p0, p1, p2]), (self.carol, [p0, p3])):
+            for post in posts:
+                self._like(user, post)
+
+    def _like(self, user, post):
+        self.client.force_authenticate(user=user)
+        # Runs the liked post index invalidation that follows the commit.
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('post-like', args=[post.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def _recommended(self, user, **params):
+        self.client.force_authenticate(user=user)
+        return self.client.get('/api/posts/recommended/', params)
+
+    def test_similarity_is_cosine_of_likers(self):
+        matrix = LikesMatrix.from_rows([(1, 11), (1, 10), (2, 12), (2, 11), (2, 10), (3, 13), (3, 10)], 50, 100)
+        self.assertEqual(list(matrix.likers[10]), [1, 2, 3])
+        similar = similar_posts(matrix, 10, 2)
+        self.assertEqual([post_id for _similarity, post_id in similar], [11, 13])
+        self.assertAlmostEqual(similar[0][0], 2 / (3 * 2) ** 0.5)
+        capped = LikesMatrix.from_rows([(1, 12), (1, 11), (1, 10)], 2, 100)
+        self.assertEqual(list(capped.histories[1]), [12, 11])
+
+    def test_recommendations_are_served_best_first(self):
+        p0, p1, p2, p3 = self.posts
+        self.assertEqual(self._recommended(self.alice).json(), [])
+        self.assertEqual(refresh_recommendations(full=True), (4, 3))
+        response = self._recommended(self.alice)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([post['id'] for post in response.json()], [p2.id, p3.id])
+        self.assertEqual([post['id'] for post in self._recommended(self.alice, limit=1).json()], [p2.id])
+        # Posts liked since the refresh and the user's own posts are left out.
+        self._like(self.alice, p2)
+        p3.user = self.alice
+        p3.save()
+        self.assertEqual(self._recommended(self.alice).json(), [])
+
+    def test_refresh_only_recomputes_changes(self):
+        p0, p1, p2, p3 = self.posts
+        refresh_recommendations(full=True)
+        self._like(self.carol, p2)
+        # p2's likers, bob and carol, have liked every post, and alice is seeded by p0 and p1.
+        self.assertEqual(refresh_recommendations(), (4, 3))
+        self.assertEqual(
+            [post['id'] for post in self._recommended(self.carol).json()], [p1.id])
+        self.assertEqual(refresh_recommendations(), (0, 0))
+        self.assertEqual(RecommendedPosts.objects.count(), 3)
+
+    def test_refresh_recomputes_posts_co_liked_with_changes(self):
+        p0, p1, p2, p3 = self.posts
+        refresh_recommendations(full=True)
+        # alice's like of p3 gives p0 and p1 likers in common with it, though their own likes are unchanged.
+        self._like(self.alice, p3)
+        refresh_recommendations()
+        incremental = load_neighbours([p0.id, p1.id, p2.id, p3.id])
+        refresh_recommendations(full=True)
+        self.assertEqual(load_neighbours([p0.id, p1.id, p2.id, p3.id]), incremental)
+
+    def test_expired_posts_are_pruned_and_not_served(self):
+        p0, p1, p2, p3 = self.posts
+        refresh_recommendations(full=True)
+        expired = timezone.now() - timedelta(seconds=settings.RECOMMENDATION_WINDOW + 60)
+        Post.objects.filter(id=p2.id).update(date_created=expired)
+        self.assertEqual([post['id'] for post in self._recommended(self.alice).json()], [p3.id])
+        refresh_recommendations()
+        self.assertFalse(SimilarPosts.objects.filter(post=p2).exists())
+
+    def test_invalid_limit(self):
+        for limit in ('0', 'many', str(settings.RECOMMENDATION_SIZE + 1)):
+            response = self._recommended(self.alice, limit=limit)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ImageDedupTestCase(TestCase):
+    """Tests for sharing stored post images between duplicate uploads."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(email='user@example.com', password='password1')
+
+    def _image(self, size=600, color='red'):
+        image = Image.new('RGB', (size, size), color=color)
+        ImageDraw.Draw(image).ellipse((size // 4, size // 8, size * 3 // 4, size // 2), fill='white')
+        ImageDraw.Draw(image).rectangle((0, size * 2 // 3, size // 2, size), fill='navy')
+        return image
+
+    def _upload(self, image, image_format='PNG', **options):
+        image_io = BytesIO()
+        image.save(image_io, format=image_format, **options)
+        return SimpleUploadedFile('upload.png', image_io.getvalue())
+
+    def _post(self, upload):
+        return Post.objects.create(user=self.user, text='Post', image=upload)
+
+    def test_same_upload_shares_one_file(self):
+        image = self._image()
+        first = self._post(self._upload(image))
+        second = self._post(self._upload(image))
+        self.assertEqual(first.image.name, second.image.name)
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.references, 2)
+        report = dedup_report()
+        self.assertEqual((report['images'], report['post_images']), (1, 2))
+        self.assertEqual(report['saved_bytes'], blob.size)
+        self.assertEqual(report['top_shared'][0]['name'], blob.name)
+
+    def test_reencoded_copy_is_shared(self):
+        first = self._post(self._upload(self._image()))
+        copy = self._post(self._upload(self._image(size=900), 'JPEG', quality=60))
+        self.assertEqual(copy.image.name, first.image.name)
+        with override_settings(IMAGE_DEDUP_MAX_DISTANCE=None):
+            exact_only = self._post(self._upload(self._image(size=900), 'JPEG', quality=60))
+        self.assertNotEqual(exact_only.image.name, first.image.name)
+
+    def test_rolled_back_save_deletes_stored_file(self):
+        post = self._post(self._upload(self._image()))
+        previous = post.image.name
+        post.image = self._upload(self._image(color='green'))
+        # Fails after the new image is stored, so the transaction rolls back.
+        with mock.patch.object(images, 'release_image', side_effect=OSError), self.assertRaises(OSError):
+            post.save()
+        self.assertNotEqual(post.image.name, previous)
+        self.assertFalse(default_storage.exists(post.image.name))
+        self.assertEqual(list(ImageBlob.objects.values_list('name', flat=True)), [previous])
+        self.assertEqual(Post.objects.get(pk=post.pk).image.name, previous)
+
+    def test_recoloured_image_is_not_shared(self):
+        first = self._post(self._upload(self._image()))
+        other = self._post(self._upload(self._image(color='green')))
+        self.assertNotEqual(other.image.name, first.image.name)
+        self.assertEqual(ImageBlob.objects.count(), 2)
+
+    def test_file_is_deleted_with_last_reference(self):
+        image = self._image()
+        first = self._post(self._upload(image))
+        second = self._post(self._upload(image))
+        name = first.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get().references, 1)
+        second.image = self._upload(self._image(color='green'))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+
+    def test_probes_cover_segment_neighbours(self):
+        self.assertEqual(probes(0b101, 0), [0b101])
+        neighbours = probes(0, 1)
+        self.assertEqual(len(neighbours), 17)
+        self.assertEqual({value.bit_count() for value in neighbours}, {0, 1})
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class FeedDeltaTestCase(TestCase):
+    """Tests for polling the latest feed with since_id and max_id."""
+    def setUp(self):
+        self.reader = User.objects.create_user(email='reader@example.com', password='password1')
+        self.author = User.objects.create_user(email='author@example.com', password='password1')
+        self.other = User.objects.create_user(email='other@example.com', password='password1')
+        self.reader.following.add(self.author)
+        self.posts = [Post.objects.create(user=self.author, text=f'Post {i}') for i in range(5)]
+        Post.objects.create(user=self.other, text='Not followed')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.reader)
+
+    def _ids(self, **params):
+        response = self.client.get(reverse('user-feed'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post['id'] for post in response.json()]
+
+    def test_since_id_and_max_id(self):
+        ids = [post.id for post in self.posts]
+        self.assertEqual(self._ids(since_id=ids[2]), [ids[4], ids[3]])
+        self.assertEqual(self._ids(max_id=ids[2]), [ids[1], ids[0]])
+        self.assertEqual(self._ids(since_id=ids[0], max_id=ids[4]), [ids[3], ids[2], ids[1]])
+        self.assertEqual(self._ids(since_id=0, limit=2), [ids[4], ids[3]])
+        self.assertEqual(self._ids(since_id=ids[4]), [])
+
+    def test_invalid_bounds(self):
+        for params in ({'since_id': 'x'}, {'since_id': -1}, {'max_id': 0},
+                       {'since_id': 0, 'limit': settings.FEED_PAGE_SIZE + 1}):
+            response = self.client.get(reverse('user-feed'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('user-feed-new'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_new_posts_count(self):
+        response = self.client.get(reverse('user-feed-new'), {'since_id': self.posts[1].id})
+        self.assertEqual(response.json(), {'count': 3})
+        self.assertEqual(response['X-New-Posts'], '3')
+        response = self.client.head(reverse('user-feed-new'), {'since_id': self.posts[4].id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-New-Posts'], '0')
+        with override_settings(FEED_NEW_POSTS_MAX_COUNT=2):
+            self.assertEqual(count_new_posts(self.reader, 0), 2)
+
+    def test_nothing_new_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(count_new_posts(self.reader, self.posts[4].id), 0)
+        post = Post.objects.create(user=self.author, text='Newer')
+        self.assertEqual(Follow.objects.get(from_user=self.author, to_user=self.reader).latest_post_id, post.id)
+        self.assertEqual(count_new_posts(self.reader, self.posts[4].id), 1)
+
+    def test_new_post_is_recorded_after_commit(self):
+        with mock.patch('user.signals.run_in_background') as run_in_background:
+            post = Post.objects.create(user=self.author, text='Newer')
+        run_in_background.assert_called_once_with(record_new_post, self.author.id, post.id)
+        follow = Follow.objects.get(from_user=self.author, to_user=self.reader)
+        self.assertEqual(follow.latest_post_id, self.posts[4].id)
+
+    def test_follows_are_updated_in_batches(self):
+        for i in range(3):
+            self.author.followers.add(User.objects.create_user(email=f'follower{i}@example.com', password='password1'))
+        with override_settings(FEED_HEAD_BATCH_SIZE=2), self.assertNumQueries(6):
+            post = Post.objects.create(user=self.author, text='Newer')
+        self.assertEqual(set(Follow.objects.filter(from_user=self.author).values_list('latest_post_id', flat=True)),
+                         {post.id})
+
+    def test_new_follow_starts_at_latest_post(self):
+        self.other.followers.add(self.reader)
+        follow = Follow.objects.get(from_user=self.other, to_user=self.reader)
+        self.assertEqual(follow.latest_post_id, Post.objects.filter(user=self.other).get().id)
+        self.assertEqual(count_new_posts(self.reader, self.posts[4].id), 1)
@@ -0,0 +1,145 @@
+"""Token-bucket throttling for write and search endpoints.
+
+Every client has a bucket per authenticated user and a bucket per IP. A
+throttled request takes THROTTLE_COSTS[scope] tokens from both, where scope
+is the view's throttle_scope, or 'search' for requests with a text search
+parameter. Tokens are only taken if every bucket has enough, so a refused
+request costs nothing. Buckets refill continuously up to their capacity.
+Refused requests get 429 with a Retry-After header set by rest_framework.
+
+The IP is the client address rest_framework derives from NUM_PROXIES
+(see settings.py), so a client cannot pick its own by sending
+X-Forwarded-For.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+
+SEARCH_PARAMS = ('text__icontains', 'tags__name__icontains', 'search')
+
+
+class LocalBucketStore:
+    """Buckets kept in this process' memory, guarded by a lock.
+
+    Past max_buckets the least recently used bucket is dropped; it would be
+    full by then unless it is busier than the ones kept."""
+    max_buckets = 100_000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def consume(self, buckets, cost):
+        """Take cost tokens from every (key, capacity, refill_rate) bucket if all have them.
+
+        Return 0, or the seconds until they all will."""
+        with self._lock:
+            now = time.monotonic()
+            levels = []
+            for key, capacity, refill_rate in buckets:
+                tokens, updated_at = self._buckets.get(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - updated_at) * refill_rate))
+            wait = max((cost - tokens) / refill_rate if tokens < cost else 0
+                       for tokens, (_key, _capacity, refill_rate) in zip(levels, buckets))
+            for tokens, (key, _capacity, _refill_rate) in zip(levels, buckets):
+                self._buckets[key] = (tokens if wait else tokens - cost, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisBucketStore:
+    """Buckets shared by all workers, updated atomically by a Lua script in Redis."""
+
+    script = """
+        local now = redis.call('TIME')
+        now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+        local cost = tonumber(ARGV[1])
+        local levels = {}
+        local wait = 0
+        for i, key in ipairs(KEYS) do
+            local capacity = tonumber(ARGV[2 * i])
+            local refill_rate = tonumber(ARGV[2 * i + 1])
+            local bucket = redis.call('HMGET', key, 'tokens', 'updated_at')
+            local tokens = tonumber(bucket[1]) or capacity
+            local updated_at = tonumber(bucket[2]) or now
+            tokens = math.min(capacity, tokens + (now - updated_at) * refill_rate)
+            if tokens < cost then
+                wait = math.max(wait, (cost - tokens) / refill_rate)
+            end
+            levels[i] = tokens
+        end
+        for i, key in ipairs(KEYS) do
+            local tokens = levels[i]
+            if wait == 0 then
+                tokens = tokens - cost
+            end
+            redis.call('HSET', key, 'tokens', tostring(tokens), 'updated_at', tostring(now))
+            redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[2 * i]) / tonumber(ARGV[2 * i + 1])) + 1)
+        end
+        return tostring(wait)
+    """
+
+    def __init__(self):
+        self._script = None
+
+    def consume(self, buckets, cost):
+        keys = [cache.make_key(key) for key, _capacity, _refill_rate in buckets]
+        args = [cost]
+        for _key, capacity, refill_rate in buckets:
+            args += [capacity, refill_rate]
+        # The redis-py client behind the default cache (django.core.cache.backends.redis).
+        # A client's buckets are on one server unless the cache is sharded.
+        client = cache._cache.get_client(keys[0], write=True)
+        if self._script is None:
+            self._script = client.register_script(self.script)
+        return float(self._script(keys=keys, args=args, client=client))
+
+
+@lru_cache(maxsize=None)
+def get_bucket_store():
+    return import_string(settings.THROTTLE_BUCKET_STORE)()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle with per-user and per-IP token buckets and per-endpoint costs."""
+
+    def get_cost(self, request, view):
+        if any(param in request.query_params for param in SEARCH_PARAMS):
+            return settings.THROTTLE_COSTS['search']
+        if request.method in SAFE_METHODS:
+            return 0
+        return settings.THROTTLE_COSTS.get(getattr(view, 'throttle_scope', None), 0)
+
+    def get_buckets(self, request):
+        buckets = [(f"throttle:ip:{self.get_ident(request)}", settings.THROTTLE_IP_BUCKET)]
+        if request.user and request.user.is_authenticated:
+            buckets.append((f"throttle:user:{request.user.pk}", settings.THROTTLE_USER_BUCKET))
+        return buckets
+
+    def allow_request(self, request, view):
+        self.wait_time = 0
+        cost = self.get_cost(request, view)
+        if not cost:
+            return True
+        buckets = [(key, bucket['capacity'], bucket['refill_rate']) for key, bucket in self.get_buckets(request)]
+        self.wait_time = get_bucket_store().consume(buckets, cost)
+        return not self.wait_time
+
+    def wait(self):
+        return math.ceil(self.wait_time)
@@ -0,0 +1,187 @@
+"""Stateless signed access tokens, refresh tokens and their revocation.
+
+An access token is an HMAC-signed payload (django.core.signing) carrying the
+user id, staff flags and the user's permissions version. It is verified
+without touching the database. Revoked tokens are recorded in
+RevokedAccessToken and mirrored in an in-memory Bloom filter rebuilt every
+REVOCATION_SYNC_INTERVAL seconds; only Bloom filter hits are confirmed
+against the database. Refresh tokens are opaque, stored hashed and rotated
+on every use.
+"""
+import hashlib
+import secrets
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import User, RefreshToken, RevokedAccessToken
+
+
+ACCESS_TOKEN_SALT = 'user.tokens.access'
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings."""
+
+    def __init__(self, size_bits, hash_count):
+        self.size_bits = size_bits
+        self.hash_count = hash_count
+        self.bits = bytearray((size_bits + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size_bits for i in range(self.hash_count))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationFilter:
+    """Per-process Bloom filter of revoked access token keys, periodically rebuilt from the database."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._synced_at = 0
+
+    def sync(self):
+        bloom = BloomFilter(settings.REVOCATION_FILTER_BITS, settings.REVOCATION_FILTER_HASHES)
+        keys = RevokedAccessToken.objects.filter(expires_at__gt=timezone.now()).values_list('key', flat=True)
+        for key in keys.iterator():
+            bloom.add(key)
+        with self._lock:
+            self._filter = bloom
+            self._synced_at = time.monotonic()
+
+    def add(self, key):
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(key)
+
+    def might_contain(self, keys):
+        if self._filter is None or time.monotonic() - self._synced_at > settings.REVOCATION_SYNC_INTERVAL:
+            self.sync()
+        return any(key in self._filter for key in keys)
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+
+
+revocation_filter = RevocationFilter()
+
+
+def version_revocation_key(user_id, permissions_version):
+    return f"user:{user_id}:v{permissions_version}"
+
+
+def create_access_token(user):
+    """Return a signed access token for the user."""
+    payload = {
+        'uid': user.pk,
+        'pv': user.permissions_version,
+        'staff': user.is_staff,
+        'su': user.is_superuser,
+        'act': user.is_active,
+        'jti': secrets.token_urlsafe(12),
+    }
+    return signing.dumps(payload, salt=ACCESS_TOKEN_SALT, compress=False)
+
+
+def read_access_token(token):
+    """Return the payload of a valid, unexpired and unrevoked access token, or None."""
+    try:
+        payload = signing.loads(token, salt=ACCESS_TOKEN_SALT, max_age=settings.ACCESS_TOKEN_LIFETIME)
+    except signing.BadSignature:
+        return None
+    keys = [payload['jti'], version_revocation_key(payload['uid'], payload['pv'])]
+    if revocation_filter.might_contain(keys):
+        # Bloom filters have false positives; confirm against the database.
+        if RevokedAccessToken.objects.filter(key__in=keys).exists():
+            return None
+    return payload
+
+
+def user_from_access_token(payload):
+    """Build the user of a token without a query; other fields load on first access."""
+    known_values = {
+        'id': payload['uid'],
+        'is_superuser': payload['su'],
+        'is_staff': payload['staff'],
+        # Tokens issued before 'act' was added belong to active users.
+        'is_active': payload.get('act', True),
+        'permissions_version': payload['pv'],
+    }
+    # from_db expects the values in the order of the model's fields.
+    field_names = [field.attname for field in User._meta.concrete_fields if field.attname in known_values]
+    return User.from_db('default', field_names, [known_values[name] for name in field_names])
+
+
+def revoke_access_token(payload):
+    """Revoke a single access token, given its payload, until it would have expired anyway."""
+    _revoke(payload['jti'])
+
+
+def revoke_refresh_token(user, refresh_token):
+    RefreshToken.objects.filter(user=user, token_hash=hash_refresh_token(refresh_token)).update(revoked=True)
+
+
+def revoke_user_tokens(user):
+    """Revoke all access and refresh tokens of a user, e.g. after a password change.
+
+    Also called when the user's active, staff or superuser status or groups
+    change (see signals.py), since tokens carry the old ones."""
+    with transaction.atomic():
+        _revoke(version_revocation_key(user.pk, user.permissions_version))
+        User.objects.filter(pk=user.pk).update(permissions_version=F('permissions_version') + 1)
+        RefreshToken.objects.filter(user=user, revoked=False).update(revoked=True)
+    user.refresh_from_db(fields=['permissions_version'])
+
+
+def _revoke(key):
+    expires_at = timezone.now() + timedelta(seconds=settings.ACCESS_TOKEN_LIFETIME)
+    RevokedAccessToken.objects.get_or_create(key=key, defaults={'expires_at': expires_at})
+    revocation_filter.add(key)
+
+
+def hash_refresh_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_token_pair(user):
+    """Return a new access token and a new refresh token for the user."""
+    refresh_token = secrets.token_urlsafe(32)
+    RefreshToken.objects.create(
+        user=user,
+        token_hash=hash_refresh_token(refresh_token),
+        expires_at=timezone.now() + timedelta(seconds=settings.REFRESH_TOKEN_LIFETIME),
+    )
+    return {'access': create_access_token(user), 'refresh': refresh_token}
+
+
+def rotate_refresh_token(refresh_token):
+    """Exchange a refresh token for a new token pair; return None if it is not valid."""
+    with transaction.atomic():
+        stored = (
+            RefreshToken.objects.select_for_update().select_related('user')
+            .filter(token_hash=hash_refresh_token(refresh_token), revoked=False,
+                    expires_at__gt=timezone.now())
+            .first()
+        )
+        if stored is None or not stored.user.is_active:
+            return None
+        stored.revoked = True
+        stored.save(update_fields=['revoked'])
+        return create_token_pair(stored.user)
@@ -1,4 +1,5 @@
 from rest_framework import routers
+from django.conf import settings
 from django.urls import include, path
 from .views import (
     UserRegistrationView,
@@ -11,13 +12,24 @@ from .views import (
     PostViewSet,
     TagListCreateView,
     UserTagListView,
+    UserUnusedTagListView,
     TagUpdateDestroyView,
     UnusedTagDestroyView,
     PostLikesListView,
     UserLikesListView,
     UserLikePostView,
     ChangePasswordView,
+    DeleteAccountView,
     FollowingFeedView,
+    AccessTokenView,
+    RefreshAccessTokenView,
+    RevokeAccessTokenView,
+    DataExportView,
+    DataExportDetailView,
+    DataExportDownloadView,
+    PostImportView,
+    RecommendedPostsView,
+    FeedNewPostsView,
 )
 
 router = routers.DefaultRouter()
@@ -29,18 +41,56 @@ urlpatterns = [
     path('profile/<int:id>/', UserProfileView.as_view(), name='user-profile'),
     path('profile/edit/', UserProfileEditView.as_view(), name='user-profile-edit'),
     path('profile/change-password/',ChangePasswordView.as_view(), name='user-profile-change-password'),
+    path('profile/delete/', DeleteAccountView.as_view(), name='user-profile-delete'),
     path('api-token-auth/', ObtainAuthTokenView.as_view(), name='create-token'),
+    path('token/', AccessTokenView.as_view(), name='access-token'),
+    path('token/refresh/', RefreshAccessTokenView.as_view(), name='access-token-refresh'),
+    path('token/revoke/', RevokeAccessTokenView.as_view(), name='access-token-revoke'),
     path('follow/', UserFollowView.as_view(), name='user-follow'),
     path('unfollow/', UserFollowView.as_view(), name='user-unfollow'),
     path('profile/<int:id>/<str:relation>/', UserRelationListView.as_view(), name='user-profile-follow'),
+    path('posts/import/', PostImportView.as_view(), name='posts-import'),
+    path('posts/recommended/', RecommendedPostsView.as_view(), name='posts-recommended'),
     path('', include(router.urls)),
     path('tags/',TagListCreateView.as_view(), name='tags'),
     path('tags/user/', UserTagListView.as_view(), name='tags-user'),
+    path('tags/user/unused/', UserUnusedTagListView.as_view(), name='tags-user-unused'),
     path('tags/<int:pk>/', TagUpdateDestroyView.as_view(), name='tag-update-destroy'),
     path('tags/<int:tag_id>/delete/', UnusedTagDestroyView.as_view(), name='unused-tag-destroy'),
     path('posts/<int:post_id>/likes/', PostLikesListView.as_view(), name='post-likes'),
     path('likes/', UserLikesListView.as_view(), name='user-likes'),
     path('posts/<int:post_id>/like/', UserLikePostView.as_view(), name='post-like'),
     path('posts/<int:post_id>/unlike/', UserLikePostView.as_view(), name='post-unlike'),
-    path('feed/', FollowingFeedView.as_view(), name='user-feed')
+    path('feed/', FollowingFeedView.as_view(), name='user-feed'),
+    path('feed/new/', FeedNewPostsView.as_view(), name='user-feed-new'),
+    path('export/', DataExportView.as_view(), name='data-export'),
+    path('export/<int:pk>/', DataExportDetailView.as_view(), name='data-export-detail'),
+    path('export/<int:pk>/download/', DataExportDownloadView.as_view(), name='data-export-download'),
 ]
+
+
+if settings.FEED_EVENTS_STREAM:
+    from .async_views import FeedEventsView
+
+    # The event stream only works under ASGI; a WSGI worker buffers it forever.
+    urlpatterns += [
+        path('feed/events/', FeedEventsView.as_view(), name='user-feed-events'),
+    ]
+
+if settings.ASYNC_READ_VIEWS:
+    from .async_views import (
+        FollowingFeedAsyncView,
+        UserProfileAsyncView,
+        PostDetailAsyncView,
+        UserLikesListAsyncView,
+        PostLikesListAsyncView,
+    )
+
+    # Serve the read hot paths with the async views, in front of the DRF routes.
+    urlpatterns = [
+        path('profile/<int:id>/', UserProfileAsyncView.as_view(), name='user-profile'),
+        path('posts/<int:pk>/', PostDetailAsyncView.as_view(), name='posts-detail'),
+        path('posts/<int:post_id>/likes/', PostLikesListAsyncView.as_view(), name='post-likes'),
+        path('likes/', UserLikesListAsyncView.as_view(), name='user-likes'),
+        path('feed/', FollowingFeedAsyncView.as_view(), name='user-feed'),
+    ] + urlpatterns
@@ -1,7 +1,14 @@
+import os
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils.translation import gettext as _
 
 from rest_framework import authentication, filters, permissions, serializers, status, viewsets
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.exceptions import APIException
 from rest_framework.generics import (
@@ -19,8 +26,29 @@ from rest_framework.views import APIView
 
 from django_filters.rest_framework import DjangoFilterBackend
 
+from core.files import ranged_file_response
+from core.pagination import ApproximateCountPagination
+
+from .authentication import SignedTokenAuthentication
+from .deletion import schedule_account_deletion
+from .exports import export_path, request_export
+from .feed import bounds_error, count_new_posts, feed_bounds, feed_page, is_delta_request
+from .imports import import_posts
+from .likes import invalidate_index
+from .media import is_public_media, media_response
 from .filters import PostFilter
-from .models import User, Post, Tag
+from .models import User, Post, Tag, DataExport
+from .ranking import in_order, record_like, record_unlike, top_feed
+from .recommendations import recommended_posts
+from .throttling import TokenBucketThrottle
+from .tokens import (
+    create_token_pair,
+    revoke_access_token,
+    revoke_refresh_token,
+    revoke_user_tokens,
+    rotate_refresh_token,
+)
+from .tag_gc import delete_tags_in_batches, orphan_tags
 from .serializers import (
     UserSerializer,
     AuthTokenSerializer,
@@ -31,6 +59,9 @@ from .serializers import (
     UserUpdateSerializer,
     FollowerSerializer,
     ChangePasswordSerializer,
+    DeleteAccountSerializer,
+    RefreshTokenSerializer,
+    DataExportSerializer,
 )
 
 class IsOwnerOrAdminOrSafeMethod(permissions.BasePermission):
@@ -81,15 +112,57 @@ class UserLoginView(APIView):
 
     def post(self, request):
         """Handle user authentication and login."""
-        obtain_auth_token_view = ObtainAuthTokenView.as_view()
-        return obtain_auth_token_view(request=request._request)
+        serializer = self.serializer_class(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        token, created = Token.objects.get_or_create(user=serializer.validated_data['user'])
+        return Response({'token': token.key})
+
+
+class AccessTokenView(APIView):
+    """API view issuing a signed access token and a refresh token."""
+    serializer_class = AuthTokenSerializer
+    permission_classes = []
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        return Response(create_token_pair(serializer.validated_data['user']), status=status.HTTP_201_CREATED)
+
+
+class RefreshAccessTokenView(APIView):
+    """API view exchanging a refresh token for a new token pair."""
+    serializer_class = RefreshTokenSerializer
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        tokens = rotate_refresh_token(serializer.validated_data['refresh'])
+        if tokens is None:
+            return Response({'error': _('Invalid or expired refresh token.')}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response(tokens, status=status.HTTP_201_CREATED)
+
+
+class RevokeAccessTokenView(APIView):
+    """API view revoking the access token used for the request and its refresh token."""
+    serializer_class = RefreshTokenSerializer
+    authentication_classes = [SignedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        revoke_access_token(request.auth)
+        revoke_refresh_token(request.user, serializer.validated_data['refresh'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class UserProfileView(RetrieveAPIView):
     """API view for user profile retrieval by id."""
     serializer_class = UserSerializer
     queryset = User.objects.all()
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     lookup_field = 'id'
 
@@ -97,11 +170,12 @@ class UserProfileView(RetrieveAPIView):
 class UserProfileEditView(UpdateAPIView):
     """API view for editing user profile."""
     serializer_class = UserUpdateSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        # request.user from an access token is built from its claims; load the row before saving.
+        return User.objects.get(pk=self.request.user.pk)
 
 
 class ChangePasswordView(UpdateAPIView):
@@ -110,10 +184,10 @@ class ChangePasswordView(UpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_object(self):
-        return self.request.user
+        return User.objects.get(pk=self.request.user.pk)
     
     def perform_update(self, serializer):
-        user = self.get_object()
+        user = serializer.instance
         old_password = serializer.validated_data.get('old_password')
         new_password = serializer.validated_data.get('new_password')
         
@@ -122,6 +196,7 @@ class ChangePasswordView(UpdateAPIView):
             raise serializers.ValidationError('Invalid old password.')
         user.set_password(new_password)
         user.save()
+        revoke_user_tokens(user)
         
         return user
     def update(self, request, *args, **kwargs):
@@ -129,6 +204,25 @@ class ChangePasswordView(UpdateAPIView):
         response.data['message'] = _('Password has been changed successfully.')
         return response   
     
+class DeleteAccountView(APIView):
+    """API view for deleting the user's own account.
+
+    The account is deactivated at once; its posts, likes, follows and media
+    are removed in the background.
+    """
+    serializer_class = DeleteAccountSerializer
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def delete(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not request.user.check_password(serializer.validated_data['password']):
+            return Response({'error': _('Invalid password.')}, status=status.HTTP_400_BAD_REQUEST)
+        schedule_account_deletion(request.user)
+        return Response({'message': _('Your account will be deleted.')}, status=status.HTTP_202_ACCEPTED)
+
+
 #Not sure yet which implementation is better.
 """class UserProfileView(ListCreateAPIView, RetrieveUpdateDestroyAPIView):
     #API view for user profile listing, retrieval, creation, update, and deletion.
@@ -141,8 +235,10 @@ class ChangePasswordView(UpdateAPIView):
 class UserFollowView(APIView):
     """API view for following/unfollowing another user. """
     serializer_class = FollowSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'follow'
 
     def put(self, request):
         """Follow a user."""
@@ -180,7 +276,7 @@ class UserRelationListView(ListAPIView):
     """API view for listing followers or following for specified user."""
     serializer_class = FollowerSerializer
     queryset = User.objects.all()
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self, user, relation):
@@ -206,24 +302,31 @@ class PostViewSet(viewsets.ModelViewSet):
     """Viewset for handling CRUD operations on Post."""
     queryset = Post.objects.all()
     serializer_class = PostSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrAdminOrSafeMethod | IsAdminUser]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_class = PostFilter
+    # Likes are no longer serialized but posts can still be ordered by them.
+    ordering_fields = ['id', 'text', 'image', 'date_created', 'user', 'tags', 'likes']
+    ordering = ['id']
+    pagination_class = ApproximateCountPagination
+    throttle_classes = [TokenBucketThrottle]
 
 
 class TagListCreateView(ListCreateAPIView):
     """API view for creating and listing Tags."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'tag'
 
 
 class UserTagListView(ListAPIView):
     """API view for retrieving a list of user's own tags."""
     serializer_class = TagSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
@@ -235,13 +338,13 @@ class TagUpdateDestroyView(RetrieveUpdateDestroyAPIView):
     """API view for updating and destroying tags for admin."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAdminUser]
 
 
 class UnusedTagDestroyView(APIView):
     """API View for destroying unused, own tags by user."""
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     def delete(self, request, tag_id):
@@ -258,23 +361,42 @@ class UnusedTagDestroyView(APIView):
             return Response({'error': 'Tag not found.'}, status.HTTP_404_NOT_FOUND)
 
 
+class UserUnusedTagListView(ListAPIView):
+    """API view for listing the user's own tags that no post uses, and deleting them all at once."""
+    serializer_class = TagSerializer
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return orphan_tags(Tag.objects.filter(user=self.request.user))
+
+    def delete(self, request):
+        deleted = delete_tags_in_batches(self.get_queryset())
+        return Response({'deleted': deleted}, status=status.HTTP_200_OK)
+
+
 class UserLikePostView(APIView):
     """API view for liking/unliking posts."""
     serializer_class = LikeSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'like'
 
     def like_post(self, request, post_id):
         post_to_like = get_object_or_404(Post, id=post_id)
         if post_to_like.likes.filter(id=request.user.id).exists():
             raise APIException(_('Post was already liked.'), status.HTTP_409_CONFLICT)
         request.user.liked_posts.add(post_to_like)
-        
+        transaction.on_commit(partial(invalidate_index, request.user.id))
+        record_like(request.user, post_to_like)
 
     def unlike_post(self, request, post_id):
         post_to_unlike = get_object_or_404(Post, id=post_id)
-        request.user.liked_posts.remove(post_to_unlike)
-        
+        if post_to_unlike.likes.filter(id=request.user.id).exists():
+            request.user.liked_posts.remove(post_to_unlike)
+            transaction.on_commit(partial(invalidate_index, request.user.id))
+            record_unlike(request.user, post_to_unlike)
 
     def post(self, request, post_id):
         """Like a post."""
@@ -303,33 +425,167 @@ class UserLikePostView(APIView):
 class UserLikesListView(ListAPIView):
     """API view for retrieving a list of user's liked posts."""
     serializer_class = PostSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ApproximateCountPagination
 
     def get_queryset(self):
         user = self.request.user
-        return user.liked_posts.all()
+        return user.liked_posts.order_by('id')
 
 
 class PostLikesListView(ListAPIView):
     """API view for retrieving a list of users that liked particular post."""
     serializer_class = UserSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ApproximateCountPagination
 
     def get_queryset(self):
         post_id = self.kwargs['post_id']
         post = get_object_or_404(Post, id=post_id)
-        return post.likes.all()
+        return post.likes.order_by('id')
     
 class FollowingFeedView(ListAPIView):
     """API view that returns a list of posts that belong to the accounts followed
-    by the authenticated user."""    
+    by the authenticated user, newest first, or with ?mode=top ranked by
+    engagement (see ranking.py)."""
     serializer_class = PostSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
         user = self.request.user
         followed_accounts = user.following.all()
-        return Post.objects.filter(user__in=followed_accounts)
\ No newline at end of file
+        return Post.objects.filter(user__in=followed_accounts).order_by('-date_created', '-id')
+
+    def list(self, request, *args, **kwargs):
+        mode = request.query_params.get('mode', 'latest')
+        if mode == 'top':
+            ids = top_feed(request.user)
+            posts = in_order(ids, Post.objects.filter(id__in=ids).prefetch_related('tags'))
+            return Response(self.get_serializer(posts, many=True).data)
+        if mode != 'latest':
+            return Response({'error': _('Unknown feed mode.')}, status=status.HTTP_400_BAD_REQUEST)
+        if is_delta_request(request.query_params):
+            try:
+                since_id, max_id, limit = feed_bounds(request.query_params)
+            except ValueError:
+                return Response({'error': bounds_error()}, status=status.HTTP_400_BAD_REQUEST)
+            posts = feed_page(request.user, since_id, max_id).prefetch_related('tags')[:limit]
+            return Response(self.get_serializer(posts, many=True).data)
+        return super().list(request, *args, **kwargs)
+
+
+class FeedNewPostsView(APIView):
+    """API view that counts the posts of the authenticated user's latest feed
+    newer than ?since_id=, without loading them (see feed.py). The count is
+    also sent in the X-New-Posts header, for HEAD requests."""
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            since_id = int(request.query_params['since_id'])
+        except (KeyError, ValueError):
+            since_id = -1
+        if since_id < 0:
+            return Response({'error': _('since_id must be a non-negative integer.')},
+                            status=status.HTTP_400_BAD_REQUEST)
+        count = count_new_posts(request.user, since_id)
+        return Response({'count': count}, headers={'X-New-Posts': str(count)})
+
+
+class RecommendedPostsView(ListAPIView):
+    """API view that returns posts liked by users with similar likes to the
+    authenticated user's, best first (see recommendations.py)."""
+    serializer_class = PostSerializer
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    default_limit = 20
+
+    def list(self, request, *args, **kwargs):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= settings.RECOMMENDATION_SIZE:
+            return Response({'error': _('limit must be between 1 and %(max)d.') % {'max': settings.RECOMMENDATION_SIZE}},
+                            status=status.HTTP_400_BAD_REQUEST)
+        posts = recommended_posts(request.user, limit)
+        return Response(self.get_serializer(posts, many=True).data)
+
+
+class DataExportView(APIView):
+    """API view for requesting an archive of the user's own data and listing their exports."""
+    serializer_class = DataExportSerializer
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        exports = DataExport.objects.filter(user=request.user).order_by('-created')
+        serializer = self.serializer_class(exports, many=True, context={'request': request})
+        return Response(serializer.data)
+
+    def post(self, request):
+        """Start an export, or return the one already in progress."""
+        export = request_export(request.user)
+        serializer = self.serializer_class(export, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+class DataExportDetailView(RetrieveAPIView):
+    """API view for the status of one of the user's exports."""
+    serializer_class = DataExportSerializer
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return DataExport.objects.filter(user=self.request.user)
+
+
+class DataExportDownloadView(APIView):
+    """API view for downloading a finished export; supports Range requests to resume."""
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        export = get_object_or_404(DataExport, pk=pk, user=request.user, status=DataExport.DONE)
+        path = export_path(export)
+        if not os.path.exists(path):
+            return Response({'error': _('Export file not found.')}, status=status.HTTP_404_NOT_FOUND)
+        return ranged_file_response(
+            request, path, content_type='application/zip', filename=export.filename,
+            as_attachment=True, cache_control='private, no-cache')
+
+
+class PostImportView(APIView):
+    """API view importing the user's posts from an NDJSON request body, one post per line."""
+    authentication_classes = [SignedTokenAuthentication, authentication.TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'import'
+
+    def post(self, request):
+        # The body is read line by line instead of being parsed into request.data.
+        stream = request.stream
+        if stream is None:
+            return Response({'error': _('Empty request body.')}, status=status.HTTP_400_BAD_REQUEST)
+        result = import_posts(request.user, stream)
+        response_status = status.HTTP_201_CREATED if result.imported else status.HTTP_400_BAD_REQUEST
+        return Response(result.as_dict(), status=response_status)
+
+
+class MediaView(APIView):
+    """API view delivering post images and profile pictures to signed-in users."""
+    authentication_classes = [
+        SignedTokenAuthentication,
+        authentication.TokenAuthentication,
+        authentication.SessionAuthentication,
+    ]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, name):
+        if not is_public_media(name):
+            raise Http404
+        return media_response(request, name)